@@ -1,14 +1,25 @@
 import os
 import textwrap
+import time
 
 import requests
 import streamlit as st
 
+import vespa_io
+
 
 VESPA_URL = os.getenv("VESPA_URL", "http://localhost:8080").rstrip("/")
 NAMESPACE = "demo"
 DOCTYPE = "item"
 
+# Listing: documents per page (visited through /document/v1, so there is no result-window limit).
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "20"))
+# Exports are written here (mounted as ./exports); files up to DOWNLOAD_MAX_MB also get a download button.
+EXPORT_DIR = os.getenv("EXPORT_DIR", "/exports")
+DOWNLOAD_MAX_MB = int(os.getenv("DOWNLOAD_MAX_MB", "50"))
+# Search results are reused for the same (query, hits) for this long, or until the next write.
+SEARCH_CACHE_TTL_S = int(os.getenv("SEARCH_CACHE_TTL_S", "30"))
+
 
 def vespa_doc_url(docid: str) -> str:
     return f"{VESPA_URL}/document/v1/{NAMESPACE}/{DOCTYPE}/docid/{docid}"
@@ -18,6 +29,38 @@ def vespa_search_url() -> str:
     return f"{VESPA_URL}/search/"
 
 
+@st.cache_resource
+def http() -> requests.Session:
+    # One pooled keep-alive session for the whole app (all reruns and users).
+    return vespa_io.make_session()
+
+
+@st.cache_data(ttl=SEARCH_CACHE_TTL_S, show_spinner=False)
+def cached_search(q: str, hits: int) -> dict:
+    params = {
+        "yql": "select * from sources item where userInput(@q);",
+        "q": q,
+        "hits": hits,
+    }
+    r = http().get(vespa_search_url(), params=params, timeout=10)
+    # Raising keeps error responses out of the cache: the next rerun asks Vespa again.
+    r.raise_for_status()
+    return r.json()
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_page(continuation: str | None, page_size: int) -> dict:
+    # Keyed by continuation token: Streamlit reruns (every click) reuse pages instead of re-visiting.
+    return vespa_io.visit_page(continuation, page_size, session=http())
+
+
+def after_write() -> None:
+    # After a write the cached pages and search results are stale.
+    cached_page.clear()
+    cached_search.clear()
+    st.session_state.pop("list_tokens", None)
+
+
 st.set_page_config(page_title="Beginner Vespa CRUD UI", layout="centered")
 
 st.title("Beginner Vespa CRUD UI")
@@ -41,10 +84,40 @@ if submitted:
     tags = [t.strip() for t in tags_str.split(",") if t.strip()]
     payload = {"fields": {"title": title, "body": body, "tags": tags}}
     # Use POST for create/upsert. Some Vespa versions treat PUT as "field update" requiring {assign: ...}.
-    r = requests.post(vespa_doc_url(docid), json=payload, timeout=10)
+    r = http().post(vespa_doc_url(docid), json=payload, timeout=10)
+    after_write()
     st.code(r.text)
     st.success(f"Saved docid={docid}")
 
+with st.expander("Bulk upload (CSV or JSONL file)"):
+    st.caption(
+        "CSV header: `id,title,body,tags` (tags comma-separated inside the cell). "
+        'JSONL: one item per line, `{"id": "1", "title": "...", "body": "...", "tags": ["..."]}`, '
+        "or the export format from section 5."
+    )
+    bulk_file = st.file_uploader("File", type=["csv", "jsonl", "json"], key="bulk_file")
+    concurrency = st.slider("Parallel requests", min_value=1, max_value=32, value=vespa_io.IMPORT_CONCURRENCY)
+    if st.button("Upload all") and bulk_file is not None:
+        total = max(1, bulk_file.getvalue().count(b"\n"))
+        bar = st.progress(0.0, text="Uploading...")
+        step = max(1, total // 100)
+
+        def show_progress(n: int) -> None:
+            # Redrawing on every document would make the upload wait for the browser.
+            if n % step == 0:
+                bar.progress(min(1.0, n / total), text=f"Uploaded {n} / ~{total}")
+
+        load = vespa_io.import_csv if bulk_file.name.endswith(".csv") else vespa_io.import_jsonl
+        t0 = time.perf_counter()
+        res = load(bulk_file, concurrency=concurrency, on_progress=show_progress)
+        elapsed = time.perf_counter() - t0
+        after_write()
+        bar.progress(1.0, text="Done")
+        msg = f"Uploaded {res['ok']} items ({res['failed']} failed) in {elapsed:.1f}s ({res['ok'] / max(elapsed, 1e-9):.0f}/s)"
+        (st.success if not res["failed"] else st.warning)(msg)
+        for err in res["errors"]:
+            st.code(err)
+
 st.divider()
 
 st.subheader("2) Search")
@@ -52,13 +125,15 @@ q = st.text_input("Search query", value="vespa")
 hits = st.slider("Hits", min_value=1, max_value=20, value=5)
 
 if st.button("Search"):
-    params = {
-        "yql": "select * from sources item where userInput(@q);",
-        "q": q,
-        "hits": hits,
-    }
-    r = requests.get(vespa_search_url(), params=params, timeout=10)
-    data = r.json()
+    st.session_state["search"] = (q, hits)
+
+if "search" in st.session_state:
+    # Kept across reruns (other buttons) and served from cache, so Vespa is asked once per (query, hits).
+    try:
+        data = cached_search(*st.session_state["search"])
+    except requests.RequestException as e:
+        st.error(f"Search failed: {e}")
+        data = {}
     children = data.get("root", {}).get("children", []) or []
 
     st.write(f"Results: {len(children)}")
@@ -73,24 +148,118 @@ if st.button("Search"):
 
 st.divider()
 
-st.subheader("3) List all items (simple)")
-if st.button("List"):
-    params = {
-        "yql": "select * from sources item where true;",
-        "hits": 20,
-    }
-    r = requests.get(vespa_search_url(), params=params, timeout=10)
-    st.json(r.json())
+st.subheader("3) List all items")
+st.caption(
+    f"Pages of {LIST_PAGE_SIZE} documents, read with /document/v1 visiting (in storage order, not sorted). "
+    "Each page comes with a continuation token for the next one."
+)
+col_list, col_refresh = st.columns(2)
+if col_list.button("List") and "list_tokens" not in st.session_state:
+    st.session_state["list_tokens"] = [None]
+if col_refresh.button("Refresh"):
+    after_write()
+    st.session_state["list_tokens"] = [None]
+
+if "list_tokens" in st.session_state:
+    rows = []
+    page = None
+    try:
+        for token in st.session_state["list_tokens"]:
+            page = cached_page(token, LIST_PAGE_SIZE)
+            for doc in page["documents"]:
+                fields = doc.get("fields", {})
+                rows.append(
+                    {
+                        "id": vespa_io.local_id(doc.get("id", "")),
+                        "title": fields.get("title", ""),
+                        "tags": ", ".join(fields.get("tags", [])),
+                        "body": textwrap.shorten(fields.get("body", ""), width=120, placeholder="..."),
+                    }
+                )
+    except requests.RequestException as e:
+        st.error(f"Visiting failed: {e}")
+
+    st.write(f"Loaded: {len(rows)} items")
+    if rows:
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+    if page is not None and page["continuation"]:
+        if st.button("Load more"):
+            # A page can come back empty while more documents remain; skip ahead (a few pages at most).
+            token = page["continuation"]
+            for _ in range(10):
+                st.session_state["list_tokens"].append(token)
+                nxt = cached_page(token, LIST_PAGE_SIZE)
+                if nxt["documents"] or not nxt["continuation"]:
+                    break
+                token = nxt["continuation"]
+            st.rerun()
+    elif page is not None:
+        st.caption("That's everything.")
+    if page is not None:
+        with st.expander("Raw JSON of the last page"):
+            st.json(page)
 
 st.divider()
 
 st.subheader("4) Delete by id")
 del_id = st.text_input("Document id to delete", value="1", key="del_id")
 if st.button("Delete (DELETE)"):
-    r = requests.delete(vespa_doc_url(del_id), timeout=10)
+    r = http().delete(vespa_doc_url(del_id), timeout=10)
+    after_write()
     st.code(r.text)
     st.success(f"Deleted docid={del_id} (if it existed)")
 
+st.divider()
+
+st.subheader("5) Export / import all items (JSONL)")
+st.caption(
+    "One document per line, in `vespa feed` format. Export and import stream page by page / line by line, "
+    "so the whole dataset is never held in memory."
+)
+if st.button("Export"):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"items-{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+    t0 = time.perf_counter()
+    try:
+        with st.spinner("Exporting..."), open(path, "w", encoding="utf-8") as f:
+            n = vespa_io.export_jsonl(f)
+        st.success(f"Exported {n} items to `{path}` (./exports on your machine) in {time.perf_counter() - t0:.1f}s")
+        if os.path.getsize(path) <= DOWNLOAD_MAX_MB * 1024 * 1024:
+            with open(path, "rb") as f:
+                st.download_button("Download", f, file_name=os.path.basename(path), mime="application/jsonl")
+    except requests.RequestException as e:
+        st.error(f"Export failed: {e}")
+
+import_path = st.text_input("Import a file from the exports folder (file name)", value="")
+if st.button("Import"):
+    progress = st.empty()
+
+    def show_progress(n: int) -> None:
+        if n % 500 == 0:
+            progress.write(f"Imported {n} lines...")
+
+    t0 = time.perf_counter()
+    if import_path:
+        path = os.path.join(EXPORT_DIR, os.path.basename(import_path))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                res = vespa_io.import_jsonl(f, on_progress=show_progress)
+        except (OSError, UnicodeDecodeError) as e:
+            res = None
+            st.error(f"Cannot read `{path}`: {e}")
+    else:
+        res = None
+        st.warning("Type a file name first (to upload a file, use Bulk upload in section 1).")
+    if res is not None:
+        after_write()
+        progress.empty()
+        msg = f"Imported {res['ok']} items ({res['failed']} failed) in {time.perf_counter() - t0:.1f}s"
+        (st.success if not res["failed"] else st.warning)(msg)
+        for err in res["errors"]:
+            st.code(err)
+
+st.divider()
+
 st.caption(
     "Tip: if this UI shows errors, check `docker logs beginner_vespa` and `docker logs beginner_vespa_deployer`."
 )
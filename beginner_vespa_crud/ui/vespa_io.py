@@ -0,0 +1,227 @@
+"""
+Reading and writing whole `item` namespaces through Vespa's /document/v1 API.
+
+- `visit_page`: one page of documents plus the continuation token for the next page
+- `iter_documents`: all documents, page by page (only one page in memory at a time)
+- `export_jsonl` / `import_jsonl`: stream documents to / from a JSONL file, one document per line,
+  in the same format `vespa feed` reads ({"put": "id:demo:item::1", "fields": {...}})
+- `import_csv`: bulk upsert from a CSV file with columns id, title, body, tags (comma-separated)
+
+The UI (app.py) uses these; they also work from the command line:
+
+  python vespa_io.py export /exports/items.jsonl
+  python vespa_io.py import /exports/items.jsonl
+  python vespa_io.py import items.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+VESPA_URL = os.getenv("VESPA_URL", "http://localhost:8080").rstrip("/")
+NAMESPACE = "demo"
+DOCTYPE = "item"
+
+# Documents per /document/v1 visit request when exporting, and feed requests in flight when importing.
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", "8"))
+
+
+def make_session(pool_size: int = IMPORT_CONCURRENCY) -> requests.Session:
+    """
+    A Session whose connection pool fits `pool_size` concurrent requests, so connections are
+    reused (keep-alive) instead of opened per document.
+    """
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+def visit_url() -> str:
+    return f"{VESPA_URL}/document/v1/{NAMESPACE}/{DOCTYPE}/docid"
+
+
+def doc_url(docid: str) -> str:
+    return f"{visit_url()}/{docid}"
+
+
+def local_id(full_id: str) -> str:
+    # "id:demo:item::42" -> "42"
+    return full_id.split("::", 1)[-1]
+
+
+def visit_page(continuation: str | None = None, page_size: int = 20, session=None) -> dict:
+    """
+    One visit request. Returns {"documents": [...], "continuation": token or None}.
+    Vespa treats the page size as a hint: a page can hold fewer documents (even zero) while more
+    remain, so keep going until there is no continuation token.
+    """
+    params = {"wantedDocumentCount": page_size}
+    if continuation:
+        params["continuation"] = continuation
+    r = (session or requests).get(visit_url(), params=params, timeout=60)
+    r.raise_for_status()
+    data = r.json()
+    return {"documents": data.get("documents") or [], "continuation": data.get("continuation")}
+
+
+def iter_documents(page_size: int = EXPORT_PAGE_SIZE):
+    with requests.Session() as s:
+        continuation = None
+        while True:
+            page = visit_page(continuation, page_size, session=s)
+            yield from page["documents"]
+            continuation = page["continuation"]
+            if not continuation:
+                return
+
+
+def export_jsonl(f, page_size: int = EXPORT_PAGE_SIZE) -> int:
+    """
+    Writes every document to the text file `f`, one feed operation per line. Returns the count.
+    """
+    n = 0
+    for doc in iter_documents(page_size):
+        f.write(json.dumps({"put": doc["id"], "fields": doc.get("fields") or {}}, ensure_ascii=False) + "\n")
+        n += 1
+    return n
+
+
+def _text_lines(lines):
+    for line in lines:
+        yield line.decode("utf-8-sig") if isinstance(line, bytes) else line
+
+
+def parse_jsonl(lines):
+    """
+    (docid, fields) per line, or a ValueError for a bad line. Accepts the feed format
+    {"put": "id:demo:item::1", "fields": {...}}, the visit format {"id": ..., "fields": {...}} and
+    flat objects {"id": "1", "title": ..., "body": ..., "tags": [...]}.
+    """
+    for line_no, line in enumerate(_text_lines(lines), start=1):
+        if not line.strip():
+            continue
+        try:
+            op = json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"line {line_no}: {e}")
+            continue
+        full_id = (op.get("put") or op.get("id")) if isinstance(op, dict) else None
+        if not full_id:
+            yield ValueError(f"line {line_no}: no 'put' or 'id'")
+            continue
+        fields = op.get("fields") if "fields" in op else {k: v for k, v in op.items() if k not in ("put", "id")}
+        yield local_id(str(full_id)), fields or {}
+
+
+def parse_csv(lines):
+    """
+    (docid, fields) per CSV row (header: id, title, body, tags), or a ValueError for a bad row.
+    """
+    reader = csv.DictReader(_text_lines(lines))
+    for row in reader:
+        docid = (row.get("id") or "").strip()
+        if not docid:
+            yield ValueError(f"line {reader.line_num}: empty id")
+            continue
+        tags = [t.strip() for t in (row.get("tags") or "").split(",") if t.strip()]
+        yield docid, {"title": row.get("title") or "", "body": row.get("body") or "", "tags": tags}
+
+
+def feed(records, concurrency: int = IMPORT_CONCURRENCY, on_progress=None, session=None) -> dict:
+    """
+    Upserts (POST) every (docid, fields) from the iterable `records`; ValueError items count as failures.
+    At most `concurrency` requests are in flight, and only those records are held in memory.
+    `on_progress(done)` is called after each record. Returns {"ok": n, "failed": n, "errors": [first few]}.
+    """
+    result = {"ok": 0, "failed": 0, "errors": []}
+
+    def fail(msg: str) -> None:
+        result["failed"] += 1
+        if len(result["errors"]) < 10:
+            result["errors"].append(msg)
+        if on_progress is not None:
+            on_progress(result["ok"] + result["failed"])
+
+    def finish(fut) -> None:
+        docid, r = fut.result()
+        if r is None:
+            fail(f"{docid}: no response")
+            return
+        if not r.ok:
+            fail(f"{docid}: {r.status_code} {r.text[:200]}")
+            return
+        result["ok"] += 1
+        if on_progress is not None:
+            on_progress(result["ok"] + result["failed"])
+
+    s = session or make_session(concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+
+            def put(docid: str, fields: dict):
+                try:
+                    return docid, s.post(doc_url(docid), json={"fields": fields}, timeout=30)
+                except requests.RequestException:
+                    return docid, None
+
+            in_flight = deque()
+            for rec in records:
+                if isinstance(rec, ValueError):
+                    fail(str(rec))
+                    continue
+                in_flight.append(pool.submit(put, *rec))
+                if len(in_flight) >= concurrency:
+                    finish(in_flight.popleft())
+            while in_flight:
+                finish(in_flight.popleft())
+    finally:
+        if session is None:
+            s.close()
+    return result
+
+
+def import_jsonl(lines, concurrency: int = IMPORT_CONCURRENCY, on_progress=None, session=None) -> dict:
+    return feed(parse_jsonl(lines), concurrency, on_progress, session)
+
+
+def import_csv(lines, concurrency: int = IMPORT_CONCURRENCY, on_progress=None, session=None) -> dict:
+    return feed(parse_csv(lines), concurrency, on_progress, session)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Export / import the whole item namespace as JSONL")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export")
+    ex.add_argument("path")
+    ex.add_argument("--page-size", type=int, default=EXPORT_PAGE_SIZE)
+    im = sub.add_parser("import")
+    im.add_argument("path")
+    im.add_argument("--concurrency", type=int, default=IMPORT_CONCURRENCY)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    if args.cmd == "export":
+        with open(args.path, "w", encoding="utf-8") as f:
+            n = export_jsonl(f, args.page_size)
+        print(f"Exported {n} documents to {args.path} in {time.perf_counter() - t0:.1f}s")
+    else:
+        load = import_csv if args.path.endswith(".csv") else import_jsonl
+        with open(args.path, "r", encoding="utf-8", newline="") as f:
+            res = load(f, args.concurrency)
+        print(f"Imported {res['ok']} documents ({res['failed']} failed) in {time.perf_counter() - t0:.1f}s")
+        for e in res["errors"]:
+            print("  " + e)
+
+
+if __name__ == "__main__":
+    main()
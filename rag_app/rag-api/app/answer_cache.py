@@ -0,0 +1,137 @@
+"""
+Semantic answer cache for /v1/chat/completions.
+
+Paraphrases of an earlier question usually retrieve the same chunks and get the same answer, and the
+chat call is by far the most expensive step. After retrieval, the query embedding is compared with
+the embeddings of recently answered questions (a small in-memory matrix, brute-force cosine):
+a cached answer is served when a previous question is at least `threshold` similar AND was answered
+from exactly the same context (same chunk ids and text, compared by fingerprint), so re-ingested or
+different sources always produce a fresh answer.
+
+Entries expire after `ttl_s`; when full, the least recently used entry is evicted.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+
+# Lookup outcomes (also the `result` label of rag_api_answer_cache_lookups_total).
+HIT = "hit"
+MISS = "miss"
+STALE_SOURCES = "stale_sources"  # a similar question exists, but its context has changed
+
+
+def fingerprint(*parts: str) -> str:
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+@dataclass
+class Entry:
+    scope: str
+    sources: str
+    answer: str
+    chunk_ids: list[str]
+    created: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+@dataclass
+class Lookup:
+    result: str
+    similarity: float | None = None  # best similarity to any cached question in the same scope
+    entry: Entry | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        d: dict[str, Any] = {"result": self.result, "similarity": self.similarity}
+        if self.entry is not None:
+            d["age_s"] = time.time() - self.entry.created
+            d["hits"] = self.entry.hits
+        return d
+
+
+class SemanticCache:
+    def __init__(self, dim: int, capacity: int, ttl_s: float, threshold: float) -> None:
+        self.dim = dim
+        self.capacity = max(0, capacity)
+        self.ttl_s = ttl_s
+        self.threshold = threshold
+        self._vecs = np.zeros((self.capacity, dim), dtype=np.float32)
+        self._entries: list[Entry | None] = [None] * self.capacity
+        self._lru: OrderedDict[int, None] = OrderedDict()  # slot -> None, least recently used first
+        self._free = list(range(self.capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def lookup(self, vec: list[float], scope: str, sources: str) -> Lookup:
+        q = _unit(vec, self.dim)
+        if q is None or not self._lru:
+            return Lookup(MISS)
+
+        now = time.time()
+        with self._lock:
+            sims = self._vecs @ q
+            best: float | None = None
+            stale = False
+            for slot in np.argsort(-sims):
+                slot = int(slot)
+                e = self._entries[slot]
+                if e is None or e.scope != scope:
+                    continue
+                if now - e.created > self.ttl_s:
+                    self._evict(slot)
+                    continue
+                sim = float(sims[slot])
+                if best is None:
+                    best = sim
+                if sim < self.threshold:
+                    break
+                if e.sources != sources:
+                    stale = True
+                    continue
+                e.hits += 1
+                self._lru.move_to_end(slot)
+                return Lookup(HIT, best, e)
+        return Lookup(STALE_SOURCES if stale else MISS, best)
+
+    def store(self, vec: list[float], scope: str, sources: str, answer: str, chunk_ids: list[str]) -> None:
+        q = _unit(vec, self.dim)
+        if q is None or self.capacity == 0:
+            return
+        with self._lock:
+            if not self._free:
+                oldest, _ = self._lru.popitem(last=False)
+                self._evict(oldest)
+            slot = self._free.pop()
+            self._vecs[slot] = q
+            self._entries[slot] = Entry(scope=scope, sources=sources, answer=answer, chunk_ids=list(chunk_ids))
+            self._lru[slot] = None
+
+    def _evict(self, slot: int) -> None:
+        # Caller holds the lock.
+        self._vecs[slot] = 0.0
+        self._entries[slot] = None
+        self._lru.pop(slot, None)
+        self._free.append(slot)
+
+
+def _unit(vec: list[float] | None, dim: int) -> np.ndarray | None:
+    if vec is None or len(vec) != dim:
+        return None
+    v = np.asarray(vec, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    if n == 0.0:
+        return None
+    return v / n
@@ -0,0 +1,246 @@
+"""
+Context packing for the chat prompt.
+
+Retrieved chunks are not pasted into the system prompt as-is:
+
+1. near-duplicates are dropped and the rest ordered by MMR (maximal marginal relevance), using the
+   chunk embeddings Vespa already returned with the hits (no extra embedding calls);
+2. chunks are added in that order until the token budget is used up;
+3. adjacent chunks of the same document (`<doc_id>::chunk-<i>` and `chunk-<i+1>`) are merged into one
+   block, and the overlap region they share (from chunking overlap) is included only once.
+
+Prompt length drives Ollama prefill time, so every token removed here is latency saved.
+Token counts are estimates (rag_common.chunking.ApproxSubwordTokenizer): the real count is only known
+after Ollama has processed the prompt.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+from rag_common.chunking import ApproxSubwordTokenizer
+
+BLOCK_SEPARATOR = "\n\n---\n\n"
+
+_tokenizer = ApproxSubwordTokenizer()
+
+
+def count_tokens(text: str) -> int:
+    return len(_tokenizer.token_spans(text, 0, len(text)))
+
+
+@dataclass
+class Block:
+    doc_id: str
+    chunk_ids: list[str]
+    text: str
+
+    def render(self) -> str:
+        return f"[{self.doc_id} | {', '.join(self.chunk_ids)}]\n{self.text}"
+
+
+@dataclass
+class PackedContext:
+    blocks: list[Block]
+    text: str
+    stats: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def chunk_ids(self) -> list[str]:
+        return [cid for b in self.blocks for cid in b.chunk_ids]
+
+
+def _chunk_index(chunk_id: str) -> int | None:
+    _, sep, tail = chunk_id.rpartition("::chunk-")
+    if not sep or not tail.isdigit():
+        return None
+    return int(tail)
+
+
+def _unit(vec: Any) -> np.ndarray | None:
+    if not isinstance(vec, list) or not vec:
+        return None
+    v = np.asarray(vec, dtype=np.float64)
+    norm = float(np.linalg.norm(v))
+    if norm == 0.0:
+        return None
+    return v / norm
+
+
+def _adjacent(a: dict[str, Any], b: dict[str, Any]) -> bool:
+    if a["doc_id"] != b["doc_id"] or a["index"] is None or b["index"] is None:
+        return False
+    return abs(a["index"] - b["index"]) == 1
+
+
+def overlap_chars(prev: str, nxt: str, min_chars: int = 16) -> int:
+    """
+    Length of the longest suffix of `prev` that is also a prefix of `nxt` (at least `min_chars`,
+    so a shared word or two is not mistaken for chunk overlap). Chunks are slices of the source
+    text, so the overlap region is an exact string match.
+    """
+    if len(prev) < min_chars or len(nxt) < min_chars:
+        return 0
+    probe = nxt[:min_chars]
+    # Earliest match in prev = longest overlap.
+    pos = prev.find(probe, max(0, len(prev) - len(nxt)))
+    while pos >= 0:
+        n = len(prev) - pos
+        if nxt.startswith(prev[pos:]):
+            return n
+        pos = prev.find(probe, pos + 1)
+    return 0
+
+
+def _mmr_order(
+    cands: list[dict[str, Any]],
+    query_vec: list[float] | None,
+    mmr_lambda: float,
+    dup_threshold: float,
+) -> tuple[list[dict[str, Any]], int]:
+    """
+    Greedy MMR: repeatedly take the candidate maximizing
+    lambda * sim(query, c) - (1 - lambda) * max sim(c, already taken).
+    Candidates at least `dup_threshold` similar to a taken chunk are dropped as near-duplicates,
+    except neighbours in the same document (they share overlap on purpose and get merged later).
+    Without embeddings, the Vespa ranking order is kept.
+    """
+    q = _unit(query_vec)
+    if q is None or any(c["unit"] is None or len(c["unit"]) != len(q) for c in cands):
+        return list(cands), 0
+    if not cands:
+        return [], 0
+
+    # One unit matrix; after each pick, a running max similarity to the taken chunks is updated with
+    # a single matrix-vector product instead of re-comparing every candidate with every taken chunk.
+    units = np.stack([c["unit"] for c in cands])
+    query_sim = units @ q
+    for c, s in zip(cands, query_sim.tolist()):
+        c["query_sim"] = s
+    doc_ids = np.array([c["doc_id"] for c in cands], dtype=object)
+    has_index = np.array([c["index"] is not None for c in cands])
+    index = np.array([c["index"] if c["index"] is not None else 0 for c in cands])
+
+    redundancy = np.full(len(cands), -1.0)
+    open_ = np.ones(len(cands), dtype=bool)  # not taken and not a near-duplicate
+    dup = np.zeros(len(cands), dtype=bool)
+    taken: list[dict[str, Any]] = []
+    while open_.any():
+        scores = mmr_lambda * query_sim - (1.0 - mmr_lambda) * (redundancy if taken else 0.0)
+        best = int(np.argmax(np.where(open_, scores, -np.inf)))
+        open_[best] = False
+        taken.append(cands[best])
+        sims = units @ units[best]
+        redundancy = np.maximum(redundancy, sims)
+        adjacent = (doc_ids == doc_ids[best]) & has_index & has_index[best] & (np.abs(index - index[best]) == 1)
+        near = open_ & (sims >= dup_threshold) & ~adjacent
+        dup |= near
+        open_ &= ~near
+    return taken, int(dup.sum())
+
+
+def pack_context(
+    hits: list[dict[str, Any]],
+    query_vec: list[float] | None,
+    max_tokens: int,
+    max_chunks: int,
+    mmr_lambda: float = 0.7,
+    dup_threshold: float = 0.95,
+) -> PackedContext:
+    """
+    Select, de-duplicate and merge `hits` (Vespa order, with optional "embedding") into prompt blocks.
+
+    `stats["baseline_tokens"]` is what the first `max_chunks` hits would have cost when pasted as-is,
+    so `stats["prompt_tokens_saved"]` is directly comparable to the old prompt.
+    """
+    cands: list[dict[str, Any]] = []
+    for rank, h in enumerate(hits):
+        txt = (h.get("text") or "").strip()
+        if not txt:
+            continue
+        cid = h.get("chunk_id") or ""
+        cands.append(
+            {
+                "rank": rank,
+                "chunk_id": cid,
+                "doc_id": h.get("doc_id") or "",
+                "index": _chunk_index(cid),
+                "text": txt,
+                "tokens": count_tokens(txt),
+                "unit": _unit(h.get("embedding")),
+            }
+        )
+
+    baseline = [f"[{c['doc_id']} | {c['chunk_id']}]\n{c['text']}" for c in cands[:max_chunks]]
+    baseline_tokens = count_tokens(BLOCK_SEPARATOR.join(baseline))
+
+    header_tokens = count_tokens(BLOCK_SEPARATOR + "[ | ]\n")
+    ordered, duplicates = _mmr_order(cands, query_vec, mmr_lambda, dup_threshold)
+
+    # Budget: take chunks in MMR order, charging only the tokens a chunk adds once merged with
+    # neighbours already taken. A chunk that does not fit is skipped; a smaller later one may still fit.
+    selected: list[dict[str, Any]] = []
+    by_key: dict[tuple[str, int], dict[str, Any]] = {}
+    used = 0
+    over_budget = 0
+    for c in ordered:
+        if len(selected) >= max_chunks:
+            break
+        cost = c["tokens"]
+        prev = nxt = None
+        if c["index"] is not None:
+            prev = by_key.get((c["doc_id"], c["index"] - 1))
+            if prev is not None:
+                cost -= count_tokens(c["text"][: overlap_chars(prev["text"], c["text"])])
+            nxt = by_key.get((c["doc_id"], c["index"] + 1))
+            if nxt is not None:
+                cost -= count_tokens(nxt["text"][: overlap_chars(c["text"], nxt["text"])])
+        # Block header + separator, or just one more id in an existing block's header.
+        cost += count_tokens(c["chunk_id"]) + (2 if prev or nxt else count_tokens(c["doc_id"]) + header_tokens)
+        if used + cost > max_tokens:
+            over_budget += 1
+            continue
+        used += cost
+        selected.append(c)
+        if c["index"] is not None:
+            by_key[(c["doc_id"], c["index"])] = c
+
+    # Merge runs of consecutive chunks; blocks keep the order of their best-ranked chunk.
+    selected.sort(key=lambda c: (c["doc_id"], c["index"] if c["index"] is not None else -1, c["rank"]))
+    blocks: list[tuple[int, Block]] = []
+    overlap_removed = 0
+    last: dict[str, Any] | None = None
+    for c in selected:
+        if last is not None and _adjacent(last, c):
+            rank, block = blocks[-1]
+            n = overlap_chars(last["text"], c["text"])
+            overlap_removed += count_tokens(c["text"][:n])
+            block.text = block.text + c["text"][n:] if n else block.text + "\n" + c["text"]
+            block.chunk_ids.append(c["chunk_id"])
+            blocks[-1] = (min(rank, c["rank"]), block)
+        else:
+            blocks.append((c["rank"], Block(doc_id=c["doc_id"], chunk_ids=[c["chunk_id"]], text=c["text"])))
+        last = c
+    blocks.sort(key=lambda rb: rb[0])
+    out_blocks = [b for _, b in blocks]
+
+    text = BLOCK_SEPARATOR.join(b.render() for b in out_blocks).strip()
+    prompt_tokens = count_tokens(text)
+    return PackedContext(
+        blocks=out_blocks,
+        text=text,
+        stats={
+            "candidates": len(cands),
+            "chunks_used": len(selected),
+            "blocks": len(out_blocks),
+            "duplicates_dropped": duplicates,
+            "over_budget_dropped": over_budget,
+            "overlap_tokens_removed": overlap_removed,
+            "budget_tokens": max_tokens,
+            "context_tokens": prompt_tokens,
+            "baseline_tokens": baseline_tokens,
+            "prompt_tokens_saved": max(0, baseline_tokens - prompt_tokens),
+        },
+    )
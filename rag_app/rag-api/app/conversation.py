@@ -0,0 +1,207 @@
+"""
+Conversation-scoped retrieval reuse for /v1/chat/completions.
+
+Without it every turn re-embeds and re-retrieves from scratch, although a follow-up ("and how is it
+configured?") is usually answered from the chunks the previous turn already found. Each conversation
+keeps a small state: the query vectors it has retrieved for (the anchors) and the chunks those
+retrievals returned (text + embedding). On the next turn the new query vector is compared with the
+anchors (brute-force cosine):
+
+- at least `threshold` similar to an anchor: REUSE, the conversation's chunks are ranked by cosine to
+  the new query and packed as usual, with no Vespa call;
+- otherwise: REFRESH, a normal retrieval runs and its hits are merged with the best carried-over chunks;
+  the new query becomes another anchor.
+
+A conversation is keyed by the client's `conversation_id`, or else by a fingerprint of the message
+prefix: a turn is stored under the fingerprint of its messages plus the answer it returned, which is
+exactly the history the client sends back with the next turn (see `prefix_key`).
+
+Conversations expire after `ttl_s`; when full, the least recently used one is evicted. A chunk that is
+re-ingested mid-conversation is seen again after the next REFRESH or when the conversation expires.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+
+from .answer_cache import fingerprint
+
+# Turn outcomes (also the `result` label of rag_api_conversation_turns_total).
+NEW = "new"  # no state for this conversation yet: normal retrieval
+REUSE = "reuse"  # close to an earlier query: answered from the conversation's chunks
+REFRESH = "refresh"  # drifted: normal retrieval, merged with the conversation's chunks
+BYPASS = "bypass"  # not applicable (disabled, bm25 / multi mode, no query vector)
+
+# Moving average weight of the latest retrieval cost (the estimate of what a REUSE saves).
+_COST_ALPHA = 0.3
+
+
+def prefix_key(messages: list[str]) -> str | None:
+    """
+    Conversation key for flattened "role:content" messages. None without a user message, so system-only
+    prefixes (shared by every new conversation of a client) never match each other.
+    """
+    if not any(m.startswith("user:") for m in messages):
+        return None
+    return fingerprint("conversation", *messages)
+
+
+@dataclass
+class State:
+    anchors: np.ndarray  # (n, dim) unit query vectors that ran a retrieval, most recent last
+    chunks: OrderedDict[str, tuple[dict[str, Any], np.ndarray]]  # chunk_id -> (hit without embedding, unit vector)
+    retrieve_ms: float = 0.0
+    turns: int = 0
+    reused: int = 0
+    created: float = field(default_factory=time.time)
+    updated: float = field(default_factory=time.time)
+
+
+@dataclass
+class Plan:
+    result: str
+    similarity: float | None = None  # best similarity to an anchor
+    hits: list[dict[str, Any]] = field(default_factory=list)  # REUSE: the ranked conversation chunks
+    saved_ms: float = 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"result": self.result, "similarity": self.similarity, "saved_ms": self.saved_ms}
+
+
+class ConversationStore:
+    def __init__(
+        self, dim: int, capacity: int, ttl_s: float, threshold: float, max_chunks: int, max_anchors: int = 8
+    ) -> None:
+        self.dim = dim
+        self.capacity = max(0, capacity)
+        self.ttl_s = ttl_s
+        self.threshold = threshold
+        self.max_chunks = max(1, max_chunks)
+        self.max_anchors = max(1, max_anchors)
+        self._states: OrderedDict[str, State] = OrderedDict()  # least recently used first
+        self._results: Counter[str] = Counter()
+        self._saved_ms = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get(self, key: str | None) -> State | None:
+        if key is None:
+            return None
+        with self._lock:
+            st = self._states.get(key)
+            if st is not None and time.time() - st.updated > self.ttl_s:
+                del self._states[key]
+                st = None
+            return st
+
+    def plan(self, state: State | None, vec: list[float], n: int) -> Plan:
+        """
+        REUSE (with the conversation's top `n` chunks for `vec`), REFRESH, or NEW without a state.
+        """
+        q = _unit(vec, self.dim)
+        if state is None or q is None or not len(state.anchors):
+            return Plan(NEW)
+        sim = float(np.max(state.anchors @ q))
+        if sim < self.threshold or not state.chunks:
+            return Plan(REFRESH, sim)
+        return Plan(REUSE, sim, self.ranked(state, vec, n), state.retrieve_ms)
+
+    def ranked(self, state: State, vec: list[float], n: int, exclude: set[str] | None = None) -> list[dict[str, Any]]:
+        """
+        The conversation's chunks most similar to `vec` (relevance = cosine), as hits with embeddings.
+        """
+        q = _unit(vec, self.dim)
+        items = [(cid, hv) for cid, hv in state.chunks.items() if not exclude or cid not in exclude]
+        if q is None or not items or n <= 0:
+            return []
+        sims = np.stack([v for _, (_, v) in items]) @ q
+        out = []
+        for i in np.argsort(-sims)[:n]:
+            hit, v = items[int(i)][1]
+            out.append(dict(hit, relevance=float(sims[i]), embedding=v.tolist()))
+        return out
+
+    def record(
+        self,
+        key: str | None,
+        prev: State | None,
+        prev_key: str | None,
+        vec: list[float],
+        hits: list[dict[str, Any]],
+        plan: Plan,
+        retrieve_ms: float,
+    ) -> None:
+        """
+        Store the conversation after a turn under `key` (replacing `prev_key`). REUSE turns only refresh
+        the recency; other turns add `vec` as an anchor and `hits` (with text and embedding) as chunks.
+        """
+        with self._lock:
+            self._results[plan.result] += 1
+            self._saved_ms += plan.saved_ms
+        q = _unit(vec, self.dim)
+        if key is None or q is None or self.capacity == 0:
+            return
+
+        anchors = prev.anchors if prev is not None else np.zeros((0, self.dim), dtype=np.float32)
+        chunks = OrderedDict(prev.chunks) if prev is not None else OrderedDict()
+        cost = prev.retrieve_ms if prev is not None else 0.0
+        if plan.result != REUSE:
+            anchors = np.vstack([anchors, q[None, :]])[-self.max_anchors :]
+            for h in hits:
+                cid = h.get("chunk_id")
+                v = _unit(h.get("embedding"), self.dim)
+                if not cid or v is None or not h.get("text"):
+                    continue
+                chunks.pop(cid, None)
+                chunks[cid] = ({k: h.get(k) for k in ("id", "chunk_id", "doc_id", "text")}, v)
+            while len(chunks) > self.max_chunks:
+                chunks.popitem(last=False)
+            cost = retrieve_ms if prev is None or not prev.retrieve_ms else (
+                _COST_ALPHA * retrieve_ms + (1.0 - _COST_ALPHA) * prev.retrieve_ms
+            )
+        st = State(
+            anchors=anchors,
+            chunks=chunks,
+            retrieve_ms=cost,
+            turns=(prev.turns if prev is not None else 0) + 1,
+            reused=(prev.reused if prev is not None else 0) + (plan.result == REUSE),
+            created=prev.created if prev is not None else time.time(),
+        )
+        with self._lock:
+            if prev_key is not None and prev_key != key:
+                self._states.pop(prev_key, None)
+            self._states[key] = st
+            self._states.move_to_end(key)
+            while len(self._states) > self.capacity:
+                self._states.popitem(last=False)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            results = dict(self._results)
+            saved_ms = self._saved_ms
+        follow_ups = results.get(REUSE, 0) + results.get(REFRESH, 0)
+        return {
+            "entries": len(self._states),
+            "threshold": self.threshold,
+            "turns": results,
+            "reuse_rate": results.get(REUSE, 0) / follow_ups if follow_ups else None,
+            "saved_ms_total": saved_ms,
+        }
+
+
+def _unit(vec: Any, dim: int) -> np.ndarray | None:
+    if vec is None or len(vec) != dim:
+        return None
+    v = np.asarray(vec, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    if n == 0.0:
+        return None
+    return v / n
@@ -0,0 +1,272 @@
+"""
+Durable background ingest jobs for rag-api.
+
+/ingest/* endpoints enqueue a job row in a local SQLite file and return its id immediately.
+A small pool of worker threads claims queued jobs one at a time (bounded concurrency) and
+reports progress back into the same row, which GET /ingest/jobs/{id} reads.
+
+Jobs survive an API restart: rows left in `running` by a crash are put back to `queued` on
+startup, unless they have already been interrupted `max_attempts` times (a document that keeps
+crashing the process, e.g. out of memory, is then marked `failed` instead of crashing it again). Re-running a job is safe because chunk ids are deterministic (`<doc_id>::chunk-<i>`),
+so Vespa simply overwrites the same documents.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Callable
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id               TEXT PRIMARY KEY,
+    kind             TEXT NOT NULL,
+    doc_id           TEXT NOT NULL,
+    status           TEXT NOT NULL,
+    params           TEXT NOT NULL,
+    request_id       TEXT,
+    created_at       REAL NOT NULL,
+    started_at       REAL,
+    finished_at      REAL,
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    chunks_total     INTEGER,
+    chunks_embedded  INTEGER NOT NULL DEFAULT 0,
+    chunks_fed       INTEGER NOT NULL DEFAULT 0,
+    error            TEXT,
+    result           TEXT
+);
+CREATE INDEX IF NOT EXISTS ingest_jobs_status_created ON ingest_jobs (status, created_at);
+"""
+
+# queued -> running -> done | failed
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobStore:
+    def __init__(self, path: str) -> None:
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.path = path
+        # One connection shared by the API and worker threads; all access goes through the lock.
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+
+    def enqueue(self, kind: str, doc_id: str, params: dict[str, Any], request_id: str, max_queued: int = 0) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if max_queued > 0:
+                (n,) = self._conn.execute("SELECT COUNT(*) FROM ingest_jobs WHERE status = ?", (QUEUED,)).fetchone()
+                if n >= max_queued:
+                    raise QueueFull(f"Ingest queue is full ({n} jobs queued). Retry later.")
+            self._conn.execute(
+                "INSERT INTO ingest_jobs (id, kind, doc_id, status, params, request_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, doc_id, QUEUED, json.dumps(params), request_id, time.time()),
+            )
+        return job_id
+
+    def claim(self) -> dict[str, Any] | None:
+        """
+        Atomically move the oldest queued job to `running` and return it (with params).
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM ingest_jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE ingest_jobs SET status = ?, started_at = ?, attempts = attempts + 1, "
+                    "chunks_embedded = 0, chunks_fed = 0 WHERE id = ?",
+                    (RUNNING, time.time(), row["id"]),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        job = dict(row)
+        job["params"] = json.loads(job["params"] or "{}")
+        return job
+
+    def update_progress(self, job_id: str, total: int | None, embedded: int, fed: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ingest_jobs SET chunks_total = ?, chunks_embedded = ?, chunks_fed = ? WHERE id = ?",
+                (total, embedded, fed, job_id),
+            )
+
+    def finish(self, job_id: str, result: dict[str, Any]) -> None:
+        """
+        Store the final result. Params are cleared: they can hold the full text or a PDF password,
+        and are not needed once the job has completed.
+        """
+        ok = bool(result.get("ok"))
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ingest_jobs SET status = ?, finished_at = ?, error = ?, result = ?, params = '{}' WHERE id = ?",
+                (DONE if ok else FAILED, time.time(), None if ok else result.get("error"), json.dumps(result), job_id),
+            )
+
+    def requeue_running(self, max_attempts: int = 0) -> tuple[int, list[dict[str, Any]]]:
+        """
+        Called once at startup: anything still `running` was interrupted by a restart.
+
+        Jobs that have already been started `max_attempts` times (0 = no limit) are marked `failed`
+        instead of being queued again. Returns (number requeued, the failed jobs with their params).
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                failed: list[dict[str, Any]] = []
+                if max_attempts > 0:
+                    rows = self._conn.execute(
+                        "SELECT * FROM ingest_jobs WHERE status = ? AND attempts >= ?", (RUNNING, max_attempts)
+                    ).fetchall()
+                    now = time.time()
+                    for row in rows:
+                        error = f"Interrupted {row['attempts']} times by an API restart; not retried."
+                        self._conn.execute(
+                            "UPDATE ingest_jobs SET status = ?, finished_at = ?, error = ?, result = ?, params = '{}' "
+                            "WHERE id = ?",
+                            (FAILED, now, error, json.dumps({"ok": False, "error": error}), row["id"]),
+                        )
+                        job = dict(row)
+                        job["params"] = json.loads(job["params"] or "{}")
+                        failed.append(job)
+                cur = self._conn.execute("UPDATE ingest_jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cur.rowcount, failed
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM ingest_jobs GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, doc_id, status, request_id, created_at, started_at, finished_at, attempts, "
+                "chunks_total, chunks_embedded, chunks_fed, error, result FROM ingest_jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["eta_s"] = _eta_seconds(job)
+        if job["status"] == QUEUED:
+            with self._lock:
+                (ahead,) = self._conn.execute(
+                    "SELECT COUNT(*) FROM ingest_jobs WHERE status = ? AND created_at < ?", (QUEUED, job["created_at"])
+                ).fetchone()
+            job["queue_position"] = ahead
+        return job
+
+
+def _eta_seconds(job: dict[str, Any]) -> float | None:
+    """
+    Linear ETA from the feed rate so far (embedding dominates, and each chunk is embedded then fed).
+    """
+    if job["status"] != RUNNING or not job["started_at"] or not job["chunks_total"]:
+        return None
+    fed = job["chunks_fed"] or 0
+    if fed <= 0:
+        return None
+    elapsed = time.time() - job["started_at"]
+    return max(0.0, (job["chunks_total"] - fed) * (elapsed / fed))
+
+
+class WorkerPool:
+    """
+    N threads, each processing one job at a time. `notify()` wakes idle workers right after enqueue;
+    otherwise they poll every `poll_interval_s`.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handler: Callable[[dict[str, Any]], dict[str, Any]],
+        workers: int,
+        poll_interval_s: float = 1.0,
+        max_attempts: int = 0,
+        on_abandoned: Callable[[dict[str, Any]], None] | None = None,
+    ) -> None:
+        self.store = store
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.poll_interval_s = poll_interval_s
+        self.max_attempts = max_attempts
+        # Called at startup for each job failed for too many interruptions (e.g. to delete its spool file).
+        self.on_abandoned = on_abandoned
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self.active = 0
+        self._active_lock = threading.Lock()
+
+    def start(self) -> None:
+        requeued, abandoned = self.store.requeue_running(self.max_attempts)
+        if requeued:
+            print(f"[ingest-jobs] requeued {requeued} interrupted job(s)", file=sys.stderr)
+        for job in abandoned:
+            print(
+                f"[ingest-jobs] job {job['id']} ({job['doc_id']}) failed: interrupted {job['attempts']} times",
+                file=sys.stderr,
+            )
+            if self.on_abandoned is not None:
+                self.on_abandoned(job)
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"ingest-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            job = self.store.claim()
+            if job is None:
+                self._wake.wait(self.poll_interval_s)
+                self._wake.clear()
+                continue
+
+            with self._active_lock:
+                self.active += 1
+            try:
+                result = self.handler(job)
+            except Exception as e:
+                result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            finally:
+                with self._active_lock:
+                    self.active -= 1
+            self.store.finish(job["id"], result)
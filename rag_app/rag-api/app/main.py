@@ -1,14 +1,23 @@
 from __future__ import annotations
 
-import io
+import codecs
+import contextvars
 import os
 import time
 import uuid
-from typing import Any
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator
 
 import requests
-from fastapi import FastAPI, File, Form, UploadFile
-from pypdf import PdfReader
+from fastapi import FastAPI, File, Form, Request, Response, UploadFile
+from fastapi.responses import JSONResponse
+from rag_common import chunk_cache, chunking, quantize, target_hits, tracing
+from starlette.concurrency import run_in_threadpool
+
+from . import answer_cache, context, conversation, jobs, metrics, scheduler, singleflight
+from .pdf_extract import PdfAccessError, iter_pdf_pages, open_pdf
 
 app = FastAPI(title="rag-api", version="0.1.0")
 
@@ -21,40 +30,181 @@ VESPA_URL = os.environ.get("VESPA_URL", "http://vespa:8080").rstrip("/")
 VESPA_NAMESPACE = os.environ.get("VESPA_NAMESPACE", "my_ns")
 EMBED_DIM = int(os.environ.get("EMBED_DIM", "768"))
 
+# Compact embedding copies fed next to the float one (rag_common.quantize): "", "int8", "binary" or "int8,binary".
+EMBED_VARIANTS = quantize.parse_variants(os.environ.get("EMBED_VARIANTS", ""))
+# Which embedding the vector leg searches: float (`vector` profile), int8 (`vector_int8`), or binary
+# (`vector_binary`); int8/binary rescore their candidates with the float vector and need those
+# variants fed at ingest. Hybrid queries use the matching `hybrid*` profile.
+ANN_VARIANTS = ("float",) + quantize.VARIANTS
+RAG_ANN_VARIANT = os.environ.get("RAG_ANN_VARIANT", "float").strip().lower()
+
 RAG_TOP_K = int(os.environ.get("RAG_TOP_K", "5"))
 RAG_TARGET_HITS = int(os.environ.get("RAG_TARGET_HITS", "50"))
+# Adaptive targetHits (rag_common.target_hits): RAG_TARGET_HITS is then only the starting point, moved within
+# [MIN, MAX] to keep p95 vector-query latency under RAG_TARGET_HITS_SLO_MS and recall@k at RAG_TARGET_HITS_RECALL.
+# Recall is measured on RAG_TARGET_HITS_SHADOW_RATE of the queries by an exact (approximate:false) search in the
+# background; this also runs with a fixed targetHits, to report its recall.
+RAG_TARGET_HITS_ADAPTIVE = os.environ.get("RAG_TARGET_HITS_ADAPTIVE", "false").strip().lower() in ("1", "true", "yes")
+RAG_TARGET_HITS_MIN = int(os.environ.get("RAG_TARGET_HITS_MIN", "10"))
+RAG_TARGET_HITS_MAX = int(os.environ.get("RAG_TARGET_HITS_MAX", "500"))
+RAG_TARGET_HITS_SLO_MS = float(os.environ.get("RAG_TARGET_HITS_SLO_MS", "50"))
+RAG_TARGET_HITS_RECALL = float(os.environ.get("RAG_TARGET_HITS_RECALL", "0.95"))
+RAG_TARGET_HITS_SHADOW_RATE = float(os.environ.get("RAG_TARGET_HITS_SHADOW_RATE", "0.02"))
+RAG_TARGET_HITS_INTERVAL_S = float(os.environ.get("RAG_TARGET_HITS_INTERVAL_S", "30"))
+# Retrieval mode (overridable per request with "retrieval_mode"):
+#   vector = nearestNeighbor only, bm25 = userInput only, hybrid = one combined query (`hybrid` rank profile),
+#   rrf = vector and BM25 queries sent concurrently, fused client-side with reciprocal rank fusion,
+#   multi = the question plus rewrites, embedded in one batch and searched concurrently, fused with RRF.
+RETRIEVAL_MODES = ("vector", "bm25", "hybrid", "rrf", "multi")
+RAG_RETRIEVAL_MODE = os.environ.get("RAG_RETRIEVAL_MODE", "vector").strip().lower()
+RAG_RRF_K = int(os.environ.get("RAG_RRF_K", "60"))
+RAG_RRF_VECTOR_WEIGHT = float(os.environ.get("RAG_RRF_VECTOR_WEIGHT", "1.0"))
+RAG_RRF_BM25_WEIGHT = float(os.environ.get("RAG_RRF_BM25_WEIGHT", "1.0"))
+RAG_MULTI_QUERY_N = int(os.environ.get("RAG_MULTI_QUERY_N", "3"))
+RAG_MULTI_QUERY_BUDGET_MS = float(os.environ.get("RAG_MULTI_QUERY_BUDGET_MS", "1500"))
+RAG_MULTI_QUERY_REWRITE_TIMEOUT_S = float(os.environ.get("RAG_MULTI_QUERY_REWRITE_TIMEOUT_S", "30"))
+# Two-phase fetch (overridable per request with "fetch_mode"): full = searches return chunk text + embedding;
+# two_phase = searches return only the slim `ids` summary, and text + embedding come from a local LRU
+# (rag_common.chunk_cache) with one batched Vespa query for the misses.
+FETCH_MODES = ("full", "two_phase")
+RAG_FETCH_MODE = os.environ.get("RAG_FETCH_MODE", "full").strip().lower()
+CHUNK_CACHE_ENTRIES = int(os.environ.get("CHUNK_CACHE_ENTRIES", "20000"))
+CHUNK_CACHE_MB = int(os.environ.get("CHUNK_CACHE_MB", "256"))
+CHUNK_CACHE_TTL_S = float(os.environ.get("CHUNK_CACHE_TTL_S", "3600"))
+# Semantic answer cache (see app/answer_cache.py); bypass per request with "cache": false.
+RAG_CACHE_ENABLED = os.environ.get("RAG_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+RAG_CACHE_THRESHOLD = float(os.environ.get("RAG_CACHE_THRESHOLD", "0.95"))
+RAG_CACHE_TTL_S = float(os.environ.get("RAG_CACHE_TTL_S", "3600"))
+RAG_CACHE_CAPACITY = int(os.environ.get("RAG_CACHE_CAPACITY", "1000"))
+# Conversation-scoped retrieval reuse (see app/conversation.py); bypass per request with "conversation": false.
+# A follow-up at least RAG_CONV_REUSE_THRESHOLD similar to an earlier query of the same conversation is
+# answered from that conversation's chunks (at most RAG_CONV_MAX_CHUNKS kept) without a Vespa call.
+RAG_CONV_ENABLED = os.environ.get("RAG_CONV_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+RAG_CONV_REUSE_THRESHOLD = float(os.environ.get("RAG_CONV_REUSE_THRESHOLD", "0.8"))
+RAG_CONV_TTL_S = float(os.environ.get("RAG_CONV_TTL_S", "1800"))
+RAG_CONV_CAPACITY = int(os.environ.get("RAG_CONV_CAPACITY", "500"))
+RAG_CONV_MAX_CHUNKS = int(os.environ.get("RAG_CONV_MAX_CHUNKS", "32"))
+RAG_RETRIEVAL_THREADS = int(os.environ.get("RAG_RETRIEVAL_THREADS", "8"))
+# Context packing (see app/context.py): fetch RAG_CANDIDATE_HITS, keep at most RAG_TOP_K chunks
+# within RAG_CONTEXT_TOKENS (estimated), dropping near-duplicates via MMR over the hit embeddings.
+RAG_CANDIDATE_HITS = int(os.environ.get("RAG_CANDIDATE_HITS", str(RAG_TOP_K * 2)))
+RAG_CONTEXT_TOKENS = int(os.environ.get("RAG_CONTEXT_TOKENS", "1500"))
+RAG_MMR_LAMBDA = float(os.environ.get("RAG_MMR_LAMBDA", "0.7"))
+RAG_DUP_THRESHOLD = float(os.environ.get("RAG_DUP_THRESHOLD", "0.95"))
 
 CHUNK_WORDS = int(os.environ.get("CHUNK_WORDS", "220"))
 CHUNK_OVERLAP_WORDS = int(os.environ.get("CHUNK_OVERLAP_WORDS", "40"))
+# CHUNK_TOKENIZER=words budgets chunks in words (CHUNK_WORDS / CHUNK_OVERLAP_WORDS).
+# CHUNK_TOKENIZER=approx budgets in estimated subword tokens (CHUNK_MAX_TOKENS / CHUNK_OVERLAP_TOKENS),
+# so a chunk cannot overflow the embedding model's context (nomic-embed-text: 2048 in Ollama by default).
+CHUNK_TOKENIZER = os.environ.get("CHUNK_TOKENIZER", "words").strip().lower()
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "64"))
+# Start a new chunk at each markdown heading.
+CHUNK_STRUCTURE = os.environ.get("CHUNK_STRUCTURE", "false").strip().lower() in ("1", "true", "yes")
+
+# Background ingest (see app/jobs.py)
+INGEST_DB_PATH = os.environ.get("INGEST_DB_PATH", "/data/ingest_jobs.sqlite3")
+INGEST_SPOOL_DIR = os.environ.get("INGEST_SPOOL_DIR", "/data/ingest_spool")
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+INGEST_MAX_QUEUED = int(os.environ.get("INGEST_MAX_QUEUED", "1000"))
+# A job interrupted by this many restarts is marked failed rather than retried (0 = retry forever).
+INGEST_MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", "3"))
+
+# Admission control for Ollama (see app/scheduler.py): concurrent calls per backend, and how long an
+# interactive request may queue (or be predicted to queue) before it is rejected with 429/503.
+LLM_CHAT_CONCURRENCY = int(os.environ.get("LLM_CHAT_CONCURRENCY", "2"))
+LLM_EMBED_CONCURRENCY = int(os.environ.get("LLM_EMBED_CONCURRENCY", "4"))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "32"))
+LLM_MAX_QUEUE_WAIT_S = float(os.environ.get("LLM_MAX_QUEUE_WAIT_S", "30"))
+
+# Single-flight (see app/singleflight.py): concurrent identical embed / Vespa search / chat calls run once
+# and share the result.
+RAG_SINGLEFLIGHT_ENABLED = os.environ.get("RAG_SINGLEFLIGHT_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+
+# Uploads are copied to the spool dir in blocks of this size (never held in memory whole).
+UPLOAD_BLOCK_BYTES = int(os.environ.get("UPLOAD_BLOCK_BYTES", str(1024 * 1024)))
+
+tracer = tracing.tracer_from_env("rag-api")
+
+
+def _make_chunker() -> chunking.Chunker:
+    tokenizer = chunking.make_tokenizer(CHUNK_TOKENIZER)
+    if isinstance(tokenizer, chunking.WhitespaceTokenizer):
+        return chunking.Chunker(tokenizer, CHUNK_WORDS, CHUNK_OVERLAP_WORDS, structure=CHUNK_STRUCTURE)
+    return chunking.Chunker(tokenizer, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, structure=CHUNK_STRUCTURE)
+
+
+_chunker = _make_chunker()
+_chunk_cache = chunk_cache.ChunkCache(CHUNK_CACHE_ENTRIES, CHUNK_CACHE_MB * 1024 * 1024, CHUNK_CACHE_TTL_S)
+_answer_cache = answer_cache.SemanticCache(
+    dim=EMBED_DIM, capacity=RAG_CACHE_CAPACITY, ttl_s=RAG_CACHE_TTL_S, threshold=RAG_CACHE_THRESHOLD
+)
+# targetHits below the candidate count would return fewer hits than the context packer asks for.
+_min_target_hits = max(RAG_TOP_K, RAG_CANDIDATE_HITS)
+_target_hits = target_hits.Controller(
+    initial=max(RAG_TARGET_HITS, _min_target_hits),
+    min_hits=max(RAG_TARGET_HITS_MIN if RAG_TARGET_HITS_ADAPTIVE else RAG_TARGET_HITS, _min_target_hits),
+    max_hits=RAG_TARGET_HITS_MAX if RAG_TARGET_HITS_ADAPTIVE else max(RAG_TARGET_HITS, _min_target_hits),
+    latency_slo_ms=RAG_TARGET_HITS_SLO_MS,
+    recall_target=RAG_TARGET_HITS_RECALL,
+    shadow_rate=RAG_TARGET_HITS_SHADOW_RATE,
+    interval_s=RAG_TARGET_HITS_INTERVAL_S,
+)
+_conversations = conversation.ConversationStore(
+    dim=EMBED_DIM,
+    capacity=RAG_CONV_CAPACITY,
+    ttl_s=RAG_CONV_TTL_S,
+    threshold=RAG_CONV_REUSE_THRESHOLD,
+    max_chunks=RAG_CONV_MAX_CHUNKS,
+)
+_chat_gate = scheduler.Limiter("chat", LLM_CHAT_CONCURRENCY, LLM_MAX_QUEUE, LLM_MAX_QUEUE_WAIT_S)
+_embed_gate = scheduler.Limiter("embed", LLM_EMBED_CONCURRENCY, LLM_MAX_QUEUE, LLM_MAX_QUEUE_WAIT_S)
+_embed_flights = singleflight.Group("embed", RAG_SINGLEFLIGHT_ENABLED)
+_search_flights = singleflight.Group("search", RAG_SINGLEFLIGHT_ENABLED)
+_chat_flights = singleflight.Group("chat", RAG_SINGLEFLIGHT_ENABLED)
+_retrieval_pool = ThreadPoolExecutor(max_workers=RAG_RETRIEVAL_THREADS, thread_name_prefix="retrieve")
+
+
+@contextmanager
+def _stage(name: str, **attrs: Any) -> Iterator[tracing.Span]:
+    """
+    One pipeline stage: Prometheus histogram/error counter + a (possibly unsampled) trace span.
+    """
+    with metrics.stage(name), tracer.span(name, **attrs) as span:
+        yield span
 
 
-def _chunk_text(text: str, chunk_words: int, overlap_words: int) -> list[str]:
-    words = (text or "").split()
-    if not words:
-        return []
-
-    out: list[str] = []
-    i = 0
-    while i < len(words):
-        j = min(len(words), i + chunk_words)
-        out.append(" ".join(words[i:j]).strip())
-        if j >= len(words):
-            break
-        i = max(0, j - overlap_words)
-    return [c for c in out if c]
+def _flight_timeout(gate: scheduler.Limiter, call_timeout_s: float) -> float | None:
+    """
+    How long a coalesced caller waits for the leader. The leader may first queue for a slot (up to
+    max_wait_s when interactive, without a limit when bulk) before its HTTP timeout starts; the
+    priority is part of the flight key, so leader and followers always queue alike.
+    """
+    if scheduler.current_priority() == scheduler.BULK:
+        return None
+    return call_timeout_s + gate.max_wait_s
 
 
 def _ollama_embed_one(prompt: str) -> list[float]:
     """
-    Ollama embeddings endpoint.
+    Ollama embeddings endpoint (identical concurrent calls share one request).
+    """
+    k = singleflight.key("embed_one", OLLAMA_EMBED_MODEL, prompt, scheduler.current_priority())
+    return _embed_flights.do(k, lambda: _ollama_embed_one_call(prompt), timeout_s=_flight_timeout(_embed_gate, 120))
+
+
+def _ollama_embed_one_call(prompt: str) -> list[float]:
+    """
     Note: Ollama returns HTTP 404 for "model not found" (not just for unknown routes),
     so we must parse the body to give a good error message.
     """
-    r = requests.post(
-        f"{OLLAMA_BASE_URL}/api/embeddings",
-        json={"model": OLLAMA_EMBED_MODEL, "prompt": prompt},
-        timeout=120,
-    )
+    with _embed_gate.slot():
+        r = requests.post(
+            f"{OLLAMA_BASE_URL}/api/embeddings",
+            json={"model": OLLAMA_EMBED_MODEL, "prompt": prompt},
+            timeout=120,
+        )
     try:
         data = r.json()
     except Exception:
@@ -77,6 +227,42 @@ def _ollama_embed_one(prompt: str) -> list[float]:
     raise RuntimeError(f"Ollama embeddings failed (HTTP {r.status_code}): {data}")
 
 
+def _ollama_embed_many(prompts: list[str]) -> list[list[float]]:
+    """
+    Embed several texts in one request (Ollama /api/embed, which takes a list of inputs).
+    """
+    k = singleflight.key("embed_many", OLLAMA_EMBED_MODEL, prompts, scheduler.current_priority())
+    return _embed_flights.do(k, lambda: _ollama_embed_many_call(prompts), timeout_s=_flight_timeout(_embed_gate, 120))
+
+
+def _ollama_embed_many_call(prompts: list[str]) -> list[list[float]]:
+    with _embed_gate.slot():
+        r = requests.post(
+            f"{OLLAMA_BASE_URL}/api/embed",
+            json={"model": OLLAMA_EMBED_MODEL, "input": prompts},
+            timeout=120,
+        )
+    try:
+        data = r.json()
+    except Exception:
+        data = {"raw": r.text}
+
+    if r.ok:
+        embs = data.get("embeddings")
+        if isinstance(embs, list) and len(embs) == len(prompts):
+            return embs
+        raise RuntimeError(f"Unexpected Ollama embed response shape: {data}")
+
+    if isinstance(data, dict) and data.get("error"):
+        raise RuntimeError(
+            f"Ollama embed error (HTTP {r.status_code}): {data['error']}. "
+            f"Fix: pull the model inside the ollama container, e.g. "
+            f"`docker exec rag_ollama ollama pull {OLLAMA_EMBED_MODEL}`"
+        )
+
+    raise RuntimeError(f"Ollama embed failed (HTTP {r.status_code}): {data}")
+
+
 def _validate_embedding_dim(vec: list[float]) -> None:
     if len(vec) != EMBED_DIM:
         raise ValueError(
@@ -94,27 +280,52 @@ def _vespa_feed_chunk(fields: dict[str, Any]) -> dict[str, Any]:
     url = f"{VESPA_URL}/document/v1/{VESPA_NAMESPACE}/chunk/docid/{chunk_id}"
     r = requests.post(url, json={"fields": fields}, timeout=60)
     r.raise_for_status()
+    _chunk_cache.invalidate([chunk_id])
     return r.json()
 
 
-def _vespa_retrieve(query_vec: list[float], top_k: int, target_hits: int) -> list[dict[str, Any]]:
+_HIT_FIELDS = "chunk_id, doc_id, text, embedding"
+
+
+def _tensor_values(t: Any) -> list[float] | None:
+    # short-value rendering is a plain list; older renderings wrap it as {"values": [...]}.
+    if isinstance(t, dict):
+        t = t.get("values")
+    return t if isinstance(t, list) else None
+
+
+def _select(slim: bool) -> str:
+    # slim: the search returns only the `ids` document-summary (chunk_id, doc_id); see _resolve_chunks.
+    return "*" if slim else _HIT_FIELDS
+
+
+def _vespa_search(req: dict[str, Any], slim: bool = False, kind: str = "search") -> list[dict[str, Any]]:
     """
-    Retrieve top chunks from Vespa using vector search.
+    Run one query against Vespa /search/ and return the hits in rank order.
+    Identical concurrent queries share one request; every caller gets its own hit dicts.
     """
-    yql = (
-        "select chunk_id, doc_id, text from sources chunk "
-        f"where ({{targetHits:{target_hits}}}nearestNeighbor(embedding, q));"
+    k = singleflight.key(req, slim, kind)
+    return _search_flights.do(
+        k, lambda: _vespa_search_call(req, slim, kind), timeout_s=30, copy=lambda hits: [dict(h) for h in hits]
     )
-    req = {
-        "yql": yql,
-        "hits": top_k,
-        "ranking.profile": "vector",
-        "input.query(q)": query_vec,
-    }
 
-    r = requests.post(f"{VESPA_URL}/search/", json=req, timeout=30)
+
+def _vespa_search_call(req: dict[str, Any], slim: bool, kind: str) -> list[dict[str, Any]]:
+    # Dense tensors as plain arrays (hit embeddings are used for near-duplicate suppression in context packing).
+    req = dict(req, **{"presentation.format.tensors": "short-value"})
+    if slim:
+        req["presentation.summary"] = "ids"
+    span = tracing.current_span()
+    req.update(tracing.vespa_query_params(span))
+    headers = {"traceparent": span.traceparent} if span is not None else None
+
+    r = requests.post(f"{VESPA_URL}/search/", json=req, headers=headers, timeout=30)
     r.raise_for_status()
+    metrics.VESPA_RESPONSE_BYTES.labels(kind=kind).inc(len(r.content))
+    if span is not None:
+        span.set(response_bytes=len(r.content))
     body = r.json()
+    tracing.record_vespa_response(span, body)
     children = (((body or {}).get("root") or {}).get("children") or []) or []
 
     out: list[dict[str, Any]] = []
@@ -127,20 +338,226 @@ def _vespa_retrieve(query_vec: list[float], top_k: int, target_hits: int) -> lis
                 "chunk_id": fields.get("chunk_id"),
                 "doc_id": fields.get("doc_id"),
                 "text": fields.get("text"),
+                "embedding": _tensor_values(fields.get("embedding")),
             }
         )
+    if kind == "search":
+        metrics.RETRIEVED_HITS.inc(len(out))
+    if span is not None:
+        span.set(hit_count=len(out))
     return out
 
 
-def _ollama_chat(messages: list[dict[str, Any]]) -> str:
+def _ann_variant() -> str:
+    return RAG_ANN_VARIANT if RAG_ANN_VARIANT in ANN_VARIANTS else "float"
+
+
+def _nn_clause(variant: str, target_hits: int) -> str:
+    field, query_input = quantize.FIELDS[variant], quantize.QUERY_INPUTS[variant]
+    return f"({{targetHits:{target_hits}}}nearestNeighbor({field}, {query_input}))"
+
+
+def _nn_inputs(variant: str, query_vec: list[float]) -> dict[str, Any]:
+    # The float query is always sent: it is the search vector, or rescores the compact candidates.
+    inputs: dict[str, Any] = {"input.query(q)": query_vec}
+    if variant != "float":
+        inputs[f"input.query({quantize.QUERY_INPUTS[variant]})"] = quantize.encode(query_vec, variant)
+    return inputs
+
+
+def _vespa_retrieve(query_vec: list[float], top_k: int, target_hits: int, slim: bool = False) -> list[dict[str, Any]]:
     """
-    Call Ollama chat endpoint and return assistant content.
+    Retrieve top chunks from Vespa using vector search.
+    """
+    variant = _ann_variant()
+    yql = f"select {_select(slim)} from sources chunk where {_nn_clause(variant, target_hits)};"
+    req: dict[str, Any] = {"yql": yql, "hits": top_k, "ranking.profile": quantize.RANK_PROFILES[variant]}
+    req.update(_nn_inputs(variant, query_vec))
+    t0 = time.perf_counter()
+    hits = _vespa_search(req, slim=slim)
+    _target_hits.observe_latency(target_hits, (time.perf_counter() - t0) * 1000.0)
+    if _target_hits.shadow_due():
+        # Not _in_pool: the check outlives the request, so it must not join the request's trace.
+        _retrieval_pool.submit(_shadow_recall, query_vec, top_k, target_hits, [h.get("chunk_id") for h in hits])
+    return hits
+
+
+def _shadow_recall(query_vec: list[float], top_k: int, target_hits_used: int, approx_ids: list[str]) -> None:
+    """
+    Ground truth for the targetHits controller: the same query as an exact float search, compared by top-k ids.
+    """
+    recall = None
+    try:
+        yql = (
+            f"select {_select(True)} from sources chunk "
+            f"where ({{targetHits:{top_k}, approximate:false}}nearestNeighbor(embedding, q));"
+        )
+        with metrics.stage("shadow_exact"):
+            exact = _vespa_search(
+                {"yql": yql, "hits": top_k, "ranking.profile": "vector", "input.query(q)": query_vec},
+                slim=True,
+                kind="shadow",
+            )
+        recall = target_hits.recall_at_k(approx_ids, [h.get("chunk_id") for h in exact])
+        metrics.TARGET_HITS_SHADOW_QUERIES.labels(result="ok").inc()
+    except Exception:
+        metrics.TARGET_HITS_SHADOW_QUERIES.labels(result="error").inc()
+    finally:
+        _target_hits.shadow_done(target_hits_used, recall)
+
+
+def _vespa_retrieve_bm25(query_text: str, top_k: int, slim: bool = False) -> list[dict[str, Any]]:
+    """
+    Retrieve top chunks from Vespa using BM25 over `text` (the user's words, parsed by userInput).
+    """
+    if not query_text:
+        return []
+    yql = f'select {_select(slim)} from sources chunk where ({{defaultIndex:"text"}}userInput(@query));'
+    return _vespa_search({"yql": yql, "hits": top_k, "ranking.profile": "bm25", "query": query_text}, slim=slim)
+
+
+def _vespa_retrieve_hybrid(
+    query_vec: list[float], query_text: str, top_k: int, target_hits: int, slim: bool = False
+) -> list[dict[str, Any]]:
+    """
+    One combined query: nearestNeighbor OR userInput, ranked by the schema's `hybrid` profile (or
+    `hybrid_int8` / `hybrid_binary` for a compact RAG_ANN_VARIANT).
+    """
+    variant = _ann_variant()
+    where = _nn_clause(variant, target_hits)
+    if query_text:
+        where += ' or ({defaultIndex:"text"}userInput(@query))'
+    yql = f"select {_select(slim)} from sources chunk where {where};"
+    profile = "hybrid" if variant == "float" else f"hybrid_{variant}"
+    req: dict[str, Any] = {"yql": yql, "hits": top_k, "ranking.profile": profile, "query": query_text}
+    req.update(_nn_inputs(variant, query_vec))
+    return _vespa_search(req, slim=slim)
+
+
+def _vespa_fetch_chunks(chunk_ids: list[str]) -> dict[str, dict[str, Any]]:
+    """
+    Second phase of a slim search: text + embedding for `chunk_ids`, in one unranked query.
+    """
+    yql = f"select {_HIT_FIELDS} from sources chunk where {chunk_cache.yql_in('chunk_id', chunk_ids)};"
+    hits = _vespa_search({"yql": yql, "hits": len(chunk_ids), "ranking.profile": "unranked"}, kind="fetch")
+    return {h["chunk_id"]: {"text": h["text"], "embedding": h["embedding"]} for h in hits if h.get("chunk_id")}
+
+
+def _resolve_chunks(hits: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Fill in text + embedding for slim hits from the chunk cache, fetching misses in one batch.
+    Hits whose chunk no longer exists keep text=None (context packing skips them).
+    """
+    ids = [h["chunk_id"] for h in hits if h.get("chunk_id")]
+    found, fetched = _chunk_cache.resolve(ids, _vespa_fetch_chunks)
+    for h in hits:
+        f = found.get(h.get("chunk_id") or "")
+        if f is not None:
+            h["text"] = f["text"]
+            h["embedding"] = f["embedding"]
+    metrics.CHUNK_CACHE_LOOKUPS.labels(result="hit").inc(len(ids) - len(fetched))
+    metrics.CHUNK_CACHE_LOOKUPS.labels(result="miss").inc(len(fetched))
+    return {"chunks": len(ids), "cache_hits": len(ids) - len(fetched), "fetched": len(fetched)}
+
+
+def _rrf_fuse(legs: dict[str, list[dict[str, Any]]], k: int, weights: dict[str, float], top_k: int) -> list[dict[str, Any]]:
     """
-    r = requests.post(
-        f"{OLLAMA_BASE_URL}/api/chat",
-        json={"model": OLLAMA_CHAT_MODEL, "messages": messages, "stream": False},
-        timeout=300,
+    Weighted reciprocal rank fusion: score(d) = sum over legs of weight / (k + rank of d in that leg).
+    `relevance` becomes the fused score; `ranks` records the 1-based rank per leg.
+    """
+    fused: dict[str, dict[str, Any]] = {}
+    for leg, hits in legs.items():
+        w = weights.get(leg, 1.0)
+        for rank, h in enumerate(hits, start=1):
+            key = h.get("chunk_id") or h.get("id") or ""
+            f = fused.get(key)
+            if f is None:
+                f = fused[key] = dict(h, relevance=0.0, ranks={})
+            f["relevance"] += w / (k + rank)
+            f["ranks"][leg] = rank
+    return sorted(fused.values(), key=lambda h: h["relevance"], reverse=True)[:top_k]
+
+
+def _in_pool(fn: Callable[..., Any], *args: Any) -> Future[Any]:
+    # Run with the caller's contextvars, so spans opened in the pool thread nest under the request span.
+    return _retrieval_pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _timed_leg(name: str, fn: Callable[..., list[dict[str, Any]]], *args: Any) -> tuple[list[dict[str, Any]], float]:
+    t0 = time.perf_counter()
+    with _stage(f"retrieve_{name}"):
+        hits = fn(*args)
+    return hits, (time.perf_counter() - t0) * 1000.0
+
+
+def _embed_query(query_text: str, timings_ms: dict[str, float]) -> list[float]:
+    t0 = time.perf_counter()
+    with _stage("query_embed", query_chars=len(query_text)):
+        q = _ollama_embed_one(query_text)
+        _validate_embedding_dim(q)
+    timings_ms["embed_ms"] = (time.perf_counter() - t0) * 1000.0
+    return q
+
+
+def _retrieve(
+    mode: str,
+    query_text: str,
+    top_k: int,
+    target_hits: int,
+    rrf_k: int,
+    rrf_weights: dict[str, float],
+    timings_ms: dict[str, float],
+    slim: bool = False,
+    query_vec: list[float] | None = None,
+) -> tuple[list[float] | None, list[dict[str, Any]]]:
+    """
+    Embed the query (not needed for mode=bm25, or when `query_vec` is given) and retrieve `top_k`
+    candidate chunks. Returns (query vector or None, hits).
+
+    mode=rrf sends the BM25 leg first, so it runs in Vespa while the query is still being embedded,
+    then the nearestNeighbor leg; the two ranked lists are fused client-side with `_rrf_fuse`.
+    """
+    bm25_future = _in_pool(_timed_leg, "bm25", _vespa_retrieve_bm25, query_text, top_k, slim) if mode == "rrf" else None
+
+    q = query_vec
+    if q is None and mode != "bm25":
+        q = _embed_query(query_text, timings_ms)
+
+    t1 = time.perf_counter()
+    with _stage("retrieve", mode=mode, top_k=top_k, target_hits=target_hits) as span:
+        if mode == "vector":
+            hits = _vespa_retrieve(q, top_k=top_k, target_hits=target_hits, slim=slim)
+        elif mode == "bm25":
+            hits = _vespa_retrieve_bm25(query_text, top_k=top_k, slim=slim)
+        elif mode == "hybrid":
+            hits = _vespa_retrieve_hybrid(q, query_text, top_k=top_k, target_hits=target_hits, slim=slim)
+        else:
+            vector_hits, timings_ms["retrieve_vector_ms"] = _timed_leg(
+                "vector", _vespa_retrieve, q, top_k, target_hits, slim
+            )
+            bm25_hits, timings_ms["retrieve_bm25_ms"] = bm25_future.result()
+            hits = _rrf_fuse({"vector": vector_hits, "bm25": bm25_hits}, k=rrf_k, weights=rrf_weights, top_k=top_k)
+            span.set(vector_hits=len(vector_hits), bm25_hits=len(bm25_hits), fused_hits=len(hits))
+    timings_ms["retrieve_ms"] = (time.perf_counter() - t1) * 1000.0
+    return q, hits
+
+
+def _ollama_chat(messages: list[dict[str, Any]], timeout: float = 300, options: dict[str, Any] | None = None) -> str:
+    """
+    Call Ollama chat endpoint and return assistant content (identical concurrent prompts share one call).
+    """
+    k = singleflight.key("chat", OLLAMA_CHAT_MODEL, messages, options, scheduler.current_priority())
+    return _chat_flights.do(
+        k, lambda: _ollama_chat_call(messages, timeout, options), timeout_s=_flight_timeout(_chat_gate, timeout)
     )
+
+
+def _ollama_chat_call(messages: list[dict[str, Any]], timeout: float, options: dict[str, Any] | None) -> str:
+    body: dict[str, Any] = {"model": OLLAMA_CHAT_MODEL, "messages": messages, "stream": False}
+    if options:
+        body["options"] = options
+    with _chat_gate.slot():
+        r = requests.post(f"{OLLAMA_BASE_URL}/api/chat", json=body, timeout=timeout)
     try:
         data = r.json()
     except Exception:
@@ -150,6 +567,13 @@ def _ollama_chat(messages: list[dict[str, Any]]) -> str:
         msg = (data.get("message") or {}) if isinstance(data, dict) else {}
         content = msg.get("content")
         if isinstance(content, str):
+            prompt_tokens = int(data.get("prompt_eval_count") or 0)
+            completion_tokens = int(data.get("eval_count") or 0)
+            metrics.LLM_TOKENS.labels(kind="prompt").inc(prompt_tokens)
+            metrics.LLM_TOKENS.labels(kind="completion").inc(completion_tokens)
+            span = tracing.current_span()
+            if span is not None:
+                span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
             return content
         raise RuntimeError(f"Unexpected Ollama chat response shape: {data}")
 
@@ -163,38 +587,208 @@ def _ollama_chat(messages: list[dict[str, Any]]) -> str:
     raise RuntimeError(f"Ollama chat failed (HTTP {r.status_code}): {data}")
 
 
-def _ingest_text(doc_id: str, text: str) -> dict[str, Any]:
+def _rewrite_query(query_text: str, n: int, timeout: float = RAG_MULTI_QUERY_REWRITE_TIMEOUT_S) -> list[str]:
+    """
+    Ask the chat model for `n` alternative phrasings of the question (one per line).
+    Returns only the rewrites; any failure or timeout returns [] so the caller falls back to the original.
+    """
+    prompt = (
+        f"Rewrite the following question as {n} different search queries that could find the answer "
+        "in a document collection. Use different wording and spell out abbreviations. "
+        "Output one query per line, nothing else.\n\n"
+        f"Question: {query_text}"
+    )
+    try:
+        out = _ollama_chat(
+            [{"role": "user", "content": prompt}],
+            timeout=timeout,
+            options={"num_predict": 40 * n, "temperature": 0.3},
+        )
+    except scheduler.Overloaded:
+        raise
+    except Exception as e:
+        tracing.mark_error(e)
+        return []
+
+    variants: list[str] = []
+    seen = {query_text.strip().lower()}
+    for line in out.splitlines():
+        v = line.strip().lstrip("-*0123456789.) ").strip().strip('"')
+        if v and v.lower() not in seen:
+            seen.add(v.lower())
+            variants.append(v)
+    return variants[:n]
+
+
+def _retrieve_multi(
+    query_text: str,
+    variants: list[str] | None,
+    top_k: int,
+    target_hits: int,
+    rrf_k: int,
+    timings_ms: dict[str, float],
+    slim: bool = False,
+) -> tuple[list[float], list[dict[str, Any]], dict[str, Any]]:
+    """
+    Multi-query retrieval: the original question plus rewrites (given by the client in `variants`,
+    otherwise generated by the chat model). All texts are embedded in one batched call, one vector
+    search per text is sent concurrently, and the hit lists are fused with RRF (deduplicated by chunk_id).
+
+    Everything shares one deadline, RAG_MULTI_QUERY_BUDGET_MS from the start of the call: a generated
+    rewrite step that misses it is abandoned (the original question is searched alone), and a search
+    that has not finished by then is dropped. Only when no search at all made the deadline is the
+    original question waited for.
+    Returns (original query vector, fused hits, debug info).
+    """
+    t_start = time.perf_counter()
+    deadline = t_start + RAG_MULTI_QUERY_BUDGET_MS / 1000.0
+    if variants is None:
+        with _stage("query_rewrite", variants=RAG_MULTI_QUERY_N) as span:
+            remaining = max(0.0, deadline - time.perf_counter())
+            rewrite = _in_pool(
+                _rewrite_query, query_text, RAG_MULTI_QUERY_N, min(RAG_MULTI_QUERY_REWRITE_TIMEOUT_S, remaining)
+            )
+            try:
+                variants = rewrite.result(timeout=remaining)
+            except FutureTimeoutError:
+                variants = []
+                span.set(timed_out=True)
+            span.set(generated=len(variants))
+        timings_ms["rewrite_ms"] = (time.perf_counter() - t_start) * 1000.0
+    texts = [query_text] + [v for v in variants if v and v != query_text]
+
+    t_embed_start = time.perf_counter()
+    with _stage("query_embed", query_chars=len(query_text), variants=len(texts)):
+        vecs = _ollama_embed_many(texts)
+        for v in vecs:
+            _validate_embedding_dim(v)
+    t_embed = time.perf_counter()
+    timings_ms["embed_ms"] = (t_embed - t_embed_start) * 1000.0
+
+    with _stage("retrieve", mode="multi", top_k=top_k, target_hits=target_hits, variants=len(texts)) as span:
+        futures = [
+            _in_pool(_timed_leg, "variant", _vespa_retrieve, vec, top_k, target_hits, slim) for vec in vecs
+        ]
+        wait(futures, timeout=max(0.0, deadline - time.perf_counter()))
+        if not any(f.done() and f.exception() is None for f in futures):
+            # Over budget with nothing back: the answer still needs the original question's hits.
+            futures[0].result()
+
+        legs: dict[str, list[dict[str, Any]]] = {}
+        used: list[dict[str, Any]] = []
+        dropped: list[str] = []
+        for i, (text, fut) in enumerate(zip(texts, futures)):
+            if not fut.done() or fut.exception() is not None:
+                dropped.append(text)
+                metrics.MULTI_QUERY_VARIANTS.labels(outcome="dropped").inc()
+                continue
+            hits_i, ms = fut.result()
+            legs[f"q{i}"] = hits_i
+            used.append({"query": text, "hits": len(hits_i), "ms": ms})
+            metrics.MULTI_QUERY_VARIANTS.labels(outcome="used").inc()
+        hits = _rrf_fuse(legs, k=rrf_k, weights={}, top_k=top_k)
+        span.set(variants_used=len(used), variants_dropped=len(dropped), fused_hits=len(hits))
+    timings_ms["retrieve_ms"] = (time.perf_counter() - t_embed) * 1000.0
+
+    return vecs[0], hits, {"variants": used, "dropped": dropped, "budget_ms": RAG_MULTI_QUERY_BUDGET_MS}
+
+
+def _ingest_text(
+    doc_id: str,
+    text: str,
+    progress: Callable[[int | None, int, int], None] | None = None,
+) -> dict[str, Any]:
+    # Text already in memory: chunk it up front (cheap, offsets only) so progress has a real total.
+    t0 = time.perf_counter()
+    chunks = _chunker.chunk_text(text)
+    chunk_ms = (time.perf_counter() - t0) * 1000.0
+    return _ingest_chunks(doc_id, iter(chunks), progress=progress, total_hint=len(chunks), chunk_ms=chunk_ms)
+
+
+def _ingest_stream(
+    doc_id: str,
+    pieces: Iterable[str],
+    progress: Callable[[int | None, int, int], None] | None = None,
+) -> dict[str, Any]:
+    """
+    Ingest text that arrives in pieces (e.g. PDF pages as they are extracted): chunks are produced
+    lazily, so embedding starts before the whole document is available.
+    """
+    return _ingest_chunks(doc_id, _chunker.iter_chunks(pieces), progress=progress)
+
+
+def _ingest_chunks(
+    doc_id: str,
+    chunk_iter: Iterator[chunking.Chunk],
+    progress: Callable[[int | None, int, int], None] | None = None,
+    total_hint: int | None = None,
+    chunk_ms: float = 0.0,
+) -> dict[str, Any]:
+    """
+    Embed -> feed each chunk as it is pulled from `chunk_iter`.
+
+    `progress(total, embedded, fed)` is called after each step of each chunk; `total` is `total_hint`
+    (None when a streamed document's chunk count is not known up front) until the input is exhausted.
+    """
     t0 = time.perf_counter()
-    chunks = _chunk_text(text, CHUNK_WORDS, CHUNK_OVERLAP_WORDS)
-    if not chunks:
-        return {"ok": False, "error": "Text is empty after cleaning/chunking."}
 
     chunk_ids: list[str] = []
+    chunk_ms_total = chunk_ms
     embed_ms_total = 0.0
     feed_ms_total = 0.0
 
-    for i, chunk_text in enumerate(chunks):
+    i = 0
+    while True:
+        # Time spent here includes waiting for the producer (e.g. PDF extraction).
+        t_chunk0 = time.perf_counter()
+        chunk = next(chunk_iter, None)
+        chunk_ms_total += (time.perf_counter() - t_chunk0) * 1000.0
+        if chunk is None:
+            break
+        chunk_text = chunk.text
+        metrics.CHUNKS.labels(step="created").inc()
+
         chunk_id = f"{doc_id}::chunk-{i}"
 
         t_embed0 = time.perf_counter()
-        emb = _ollama_embed_one(chunk_text)
+        # Ingest embeddings queue behind interactive ones (see app/scheduler.py).
+        with _stage("chunk_embed", chunk_index=i, chunk_chars=len(chunk_text)), scheduler.priority(scheduler.BULK):
+            emb = _ollama_embed_one(chunk_text)
         t_embed1 = time.perf_counter()
         _validate_embedding_dim(emb)
         embed_ms_total += (t_embed1 - t_embed0) * 1000.0
+        metrics.CHUNKS.labels(step="embedded").inc()
+        if progress is not None:
+            progress(total_hint, i + 1, i)
 
         fields = {
             "chunk_id": chunk_id,
             "doc_id": doc_id,
             "text": chunk_text,
             "embedding": emb,
+            **quantize.variant_fields(emb, EMBED_VARIANTS),
         }
 
         t_feed0 = time.perf_counter()
-        _vespa_feed_chunk(fields)
+        with _stage("feed", chunk_id=chunk_id):
+            _vespa_feed_chunk(fields)
         t_feed1 = time.perf_counter()
         feed_ms_total += (t_feed1 - t_feed0) * 1000.0
+        metrics.CHUNKS.labels(step="fed").inc()
+        if progress is not None:
+            progress(total_hint, i + 1, i + 1)
 
         chunk_ids.append(chunk_id)
+        i += 1
+
+    metrics.STAGE_SECONDS.labels(stage="chunk").observe(chunk_ms_total / 1000.0)
+    span = tracing.current_span()
+    if span is not None:
+        span.set(chunk_count=len(chunk_ids), chunk_ms=chunk_ms_total)
+    if not chunk_ids:
+        return {"ok": False, "error": "Text is empty after cleaning/chunking."}
+    if progress is not None:
+        progress(len(chunk_ids), len(chunk_ids), len(chunk_ids))
 
     t1 = time.perf_counter()
     return {
@@ -205,10 +799,152 @@ def _ingest_text(doc_id: str, text: str) -> dict[str, Any]:
         "chunk_ids": chunk_ids,
         "embed": {"model": OLLAMA_EMBED_MODEL, "dim": EMBED_DIM, "total_ms": embed_ms_total},
         "feed": {"vespa_url": VESPA_URL, "total_ms": feed_ms_total},
+        "chunk": {
+            "tokenizer": CHUNK_TOKENIZER,
+            "max_tokens": _chunker.max_tokens,
+            "overlap_tokens": _chunker.overlap_tokens,
+            "structure": CHUNK_STRUCTURE,
+            "total_ms": chunk_ms_total,
+        },
         "total_ms": (t1 - t0) * 1000.0,
     }
 
 
+def _iter_text_file(path: str) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(UPLOAD_BLOCK_BYTES)
+            if not block:
+                break
+            yield decoder.decode(block)
+    yield decoder.decode(b"", final=True)
+
+
+def _iter_file_text(path: str, filename: str, pdf_password: str | None, extract: dict[str, Any]) -> Iterator[str]:
+    """
+    Stream a spooled upload as text pieces. For PDFs, per-page extraction timings are collected
+    into `extract` (filled in as pages arrive; complete once the iterator is exhausted).
+    """
+    if not filename.lower().endswith(".pdf"):
+        # treat as text by default (txt/md/etc)
+        yield from _iter_text_file(path)
+        return
+
+    page_ms: list[float] = extract.setdefault("pages_ms", [])
+    t0 = time.perf_counter()
+    for text in iter_pdf_pages(path, pdf_password, page_ms):
+        metrics.STAGE_SECONDS.labels(stage="extract_page").observe(page_ms[-1] / 1000.0)
+        # Page boundary is whitespace, like the old "\n\n".join(pages).
+        yield text
+        yield "\n\n"
+    extract["pages"] = len(page_ms)
+    extract["total_ms"] = sum(page_ms)
+    extract["max_ms"] = max(page_ms) if page_ms else 0.0
+    extract["wall_ms"] = (time.perf_counter() - t0) * 1000.0
+
+
+def _ingest_file_path(
+    doc_id: str,
+    path: str,
+    filename: str,
+    pdf_password: str | None,
+    progress: Callable[[int | None, int, int], None] | None = None,
+) -> dict[str, Any]:
+    extract: dict[str, Any] = {}
+    result = _ingest_stream(doc_id, _iter_file_text(path, filename, pdf_password, extract), progress=progress)
+    if extract:
+        result["extract"] = extract
+    return result
+
+
+def _discard(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _run_ingest_job(job: dict[str, Any]) -> dict[str, Any]:
+    """
+    Worker-side handler for one queued ingest job (runs on an ingest worker thread).
+    """
+    params = job["params"]
+    job_id = job["id"]
+    with metrics.request("ingest_job"), tracer.span(
+        "ingest_job", traceparent=params.get("traceparent"), job_id=job_id, kind=job["kind"], doc_id=job["doc_id"]
+    ):
+        try:
+            def progress(total: int | None, embedded: int, fed: int) -> None:
+                _jobs.update_progress(job_id, total, embedded, fed)
+
+            if job["kind"] == "file":
+                result = _ingest_file_path(
+                    job["doc_id"], params["path"], params["filename"], params.get("pdf_password"), progress=progress
+                )
+            else:
+                result = _ingest_text(doc_id=job["doc_id"], text=params.get("text") or "", progress=progress)
+        except Exception as e:
+            tracing.mark_error(e)
+            result = {"ok": False, "error": str(e)}
+        finally:
+            if job["kind"] == "file":
+                _discard(params["path"])
+
+    result["request_id"] = job["request_id"]
+    if job["kind"] == "file":
+        result["filename"] = params.get("filename")
+        result["bytes"] = params.get("bytes")
+    return result
+
+
+_jobs = jobs.JobStore(INGEST_DB_PATH)
+
+
+def _abandon_ingest_job(job: dict[str, Any]) -> None:
+    if job["kind"] == "file" and job["params"].get("path"):
+        _discard(job["params"]["path"])
+
+
+_workers = jobs.WorkerPool(
+    _jobs,
+    _run_ingest_job,
+    workers=INGEST_WORKERS,
+    max_attempts=INGEST_MAX_ATTEMPTS,
+    on_abandoned=_abandon_ingest_job,
+)
+
+
+@app.on_event("startup")
+def _start_ingest_workers() -> None:
+    _workers.start()
+
+
+@app.on_event("shutdown")
+def _stop_ingest_workers() -> None:
+    _workers.stop()
+
+
+def _enqueue_ingest(kind: str, doc_id: str, params: dict[str, Any], request_id: str) -> dict[str, Any]:
+    span = tracing.current_span()
+    if span is not None:
+        params["traceparent"] = span.traceparent
+    try:
+        job_id = _jobs.enqueue(kind, doc_id, params, request_id, max_queued=INGEST_MAX_QUEUED)
+    except jobs.QueueFull as e:
+        return {"ok": False, "request_id": request_id, "error": str(e)}
+    _workers.notify()
+    return {
+        "ok": True,
+        "request_id": request_id,
+        "trace_id": tracing.current_trace_id(),
+        "doc_id": doc_id,
+        "job_id": job_id,
+        "status": jobs.QUEUED,
+        "status_url": f"/ingest/jobs/{job_id}",
+    }
+
+
 @app.get("/health")
 def health() -> dict:
     return {
@@ -219,13 +955,47 @@ def health() -> dict:
         "ollama_chat_model": OLLAMA_CHAT_MODEL,
         "ollama_embed_model": OLLAMA_EMBED_MODEL,
         "embed_dim": EMBED_DIM,
+        "embed_variants": list(EMBED_VARIANTS),
+        "rag_ann_variant": RAG_ANN_VARIANT,
         "rag_top_k": RAG_TOP_K,
-        "rag_target_hits": RAG_TARGET_HITS,
+        "rag_target_hits": _target_hits.stats(),
+        "rag_retrieval_mode": RAG_RETRIEVAL_MODE,
+        "rag_rrf_k": RAG_RRF_K,
+        "rag_fetch_mode": RAG_FETCH_MODE,
+        "chunk_cache": _chunk_cache.stats(),
+        "answer_cache": {"enabled": RAG_CACHE_ENABLED, "entries": len(_answer_cache), "threshold": RAG_CACHE_THRESHOLD},
+        "conversations": {"enabled": RAG_CONV_ENABLED, **_conversations.stats()},
         "chunk_words": CHUNK_WORDS,
         "chunk_overlap_words": CHUNK_OVERLAP_WORDS,
+        "chunk_tokenizer": CHUNK_TOKENIZER,
+        "chunk_max_tokens": _chunker.max_tokens,
+        "chunk_overlap_tokens": _chunker.overlap_tokens,
+        "chunk_structure": CHUNK_STRUCTURE,
+        "ingest_workers": INGEST_WORKERS,
+        "llm_scheduler": {"chat": _chat_gate.stats(), "embed": _embed_gate.stats()},
+        "singleflight": {g.backend: g.stats() for g in (_embed_flights, _search_flights, _chat_flights)},
+        "ingest_jobs": _jobs.counts(),
     }
 
 
+@app.get("/metrics")
+def prometheus_metrics() -> Response:
+    counts = _jobs.counts()
+    for status in (jobs.QUEUED, jobs.RUNNING, jobs.DONE, jobs.FAILED):
+        metrics.INGEST_JOBS.labels(status=status).set(counts.get(status, 0))
+    metrics.INGEST_WORKERS_BUSY.set(_workers.active)
+    metrics.ANSWER_CACHE_ENTRIES.set(len(_answer_cache))
+    metrics.CONVERSATION_ENTRIES.set(len(_conversations))
+    th = _target_hits.stats()
+    metrics.TARGET_HITS.set(th["target_hits"])
+    if th["estimated_recall"] is not None:
+        metrics.TARGET_HITS_RECALL.set(th["estimated_recall"])
+    if th["latency_p95_ms"] is not None:
+        metrics.TARGET_HITS_LATENCY_P95.set(th["latency_p95_ms"] / 1000.0)
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
 @app.get("/v1")
 def v1_index() -> dict[str, Any]:
     """
@@ -244,7 +1014,12 @@ def v1_index() -> dict[str, Any]:
 
 
 @app.post("/ingest/text")
-def ingest_text(payload: dict) -> dict[str, Any]:
+def ingest_text(payload: dict, request: Request) -> dict[str, Any]:
+    with metrics.request("ingest_text"), tracer.span("ingest_text", traceparent=request.headers.get("traceparent")):
+        return _ingest_text_endpoint(payload)
+
+
+def _ingest_text_endpoint(payload: dict) -> dict[str, Any]:
     doc_id = (payload.get("doc_id") or "").strip()
     text = (payload.get("text") or "").strip()
     if not doc_id:
@@ -253,82 +1028,105 @@ def ingest_text(payload: dict) -> dict[str, Any]:
         return {"ok": False, "error": "Missing text"}
 
     request_id = payload.get("request_id") or str(uuid.uuid4())
+    if not payload.get("wait"):
+        return _enqueue_ingest("text", doc_id, {"text": text}, request_id)
+
+    trace_id = tracing.current_trace_id()
     try:
         result = _ingest_text(doc_id=doc_id, text=text)
         result["request_id"] = request_id
+        result["trace_id"] = trace_id
         return result
     except Exception as e:
-        return {"ok": False, "request_id": request_id, "error": str(e)}
+        tracing.mark_error(e)
+        return {"ok": False, "request_id": request_id, "trace_id": trace_id, "error": str(e)}
 
 
 @app.post("/ingest/file")
 async def ingest_file(
+    request: Request,
     doc_id: str = Form(...),
     file: UploadFile = File(...),
     pdf_password: str | None = Form(None),
+    wait: bool = Form(False),
+) -> dict[str, Any]:
+    traceparent = request.headers.get("traceparent")
+    with metrics.request("ingest_file"), tracer.span("ingest_file", traceparent=traceparent):
+        return await _ingest_file_endpoint(doc_id, file, pdf_password, wait)
+
+
+async def _ingest_file_endpoint(
+    doc_id: str, file: UploadFile, pdf_password: str | None, wait: bool
 ) -> dict[str, Any]:
     request_id = str(uuid.uuid4())
     filename = (file.filename or "").lower()
-    data = await file.read()
+
+    # Spool to disk in blocks: the worker (or the inline path below) reads the file from here.
+    os.makedirs(INGEST_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(INGEST_SPOOL_DIR, f"{request_id}{os.path.splitext(filename)[1]}")
+    size = 0
+    with open(path, "wb") as f:
+        while True:
+            block = await file.read(UPLOAD_BLOCK_BYTES)
+            if not block:
+                break
+            f.write(block)
+            size += len(block)
 
     try:
         if filename.endswith(".pdf"):
-            reader = PdfReader(io.BytesIO(data))
-            if getattr(reader, "is_encrypted", False):
-                if not pdf_password:
-                    return {
-                        "ok": False,
-                        "request_id": request_id,
-                        "filename": file.filename,
-                        "bytes": len(data),
-                        "error": (
-                            "This PDF appears to be encrypted/password-protected. "
-                            "Provide `pdf_password` as a multipart form field, e.g. "
-                            "`-F \"pdf_password=...\"`. "
-                            "If you still see an AES/cryptography error, rebuild rag-api to install cryptography."
-                        ),
-                    }
-
-                # pypdf decrypt returns 0 if it fails, 1/2 if it succeeds (depending on algorithm)
-                try:
-                    ok = reader.decrypt(pdf_password)
-                except Exception as e:
-                    return {
-                        "ok": False,
-                        "request_id": request_id,
-                        "filename": file.filename,
-                        "bytes": len(data),
-                        "error": f"Failed to decrypt PDF: {e}",
-                    }
-
-                if not ok:
-                    return {
-                        "ok": False,
-                        "request_id": request_id,
-                        "filename": file.filename,
-                        "bytes": len(data),
-                        "error": "PDF password was rejected (wrong password).",
-                    }
-
-            text = "\n\n".join((p.extract_text() or "") for p in reader.pages).strip()
-        else:
-            # treat as text by default (txt/md/etc)
-            text = data.decode("utf-8", errors="replace").strip()
+            # Fail fast on password problems instead of queueing a job that cannot succeed.
+            await run_in_threadpool(open_pdf, path, pdf_password)
+
+        if not wait:
+            params = {"path": path, "filename": file.filename, "pdf_password": pdf_password, "bytes": size}
+            result = _enqueue_ingest("file", doc_id, params, request_id)
+            result["filename"] = file.filename
+            result["bytes"] = size
+            if not result["ok"]:
+                _discard(path)
+            return result
+
+        # Off the event loop: extraction + embedding can take minutes.
+        try:
+            result = await run_in_threadpool(_ingest_file_path, doc_id, path, filename, pdf_password)
+        finally:
+            _discard(path)
 
-        result = _ingest_text(doc_id=doc_id, text=text)
         result["request_id"] = request_id
+        result["trace_id"] = tracing.current_trace_id()
         result["filename"] = file.filename
-        result["bytes"] = len(data)
+        result["bytes"] = size
         return result
+    except PdfAccessError as e:
+        _discard(path)
+        return {
+            "ok": False,
+            "request_id": request_id,
+            "filename": file.filename,
+            "bytes": size,
+            "error": str(e),
+        }
     except Exception as e:
+        tracing.mark_error(e)
+        _discard(path)
         return {
             "ok": False,
             "request_id": request_id,
+            "trace_id": tracing.current_trace_id(),
             "filename": file.filename,
             "error": str(e),
         }
 
 
+@app.get("/ingest/jobs/{job_id}")
+def ingest_job_status(job_id: str) -> dict[str, Any]:
+    job = _jobs.get(job_id)
+    if job is None:
+        return {"ok": False, "error": f"Unknown job_id: {job_id}"}
+    return {"ok": True, **job}
+
+
 # Minimal OpenAI-compatible model list so OpenWebUI can connect.
 @app.get("/v1/models")
 def list_models() -> dict:
@@ -349,7 +1147,63 @@ def list_models() -> dict:
 # - retrieve top chunks from Vespa
 # - call Ollama chat model with context
 @app.post("/v1/chat/completions")
-def chat_completions(payload: dict) -> dict:
+def chat_completions(payload: dict, request: Request) -> Any:
+    with metrics.request("chat_completions"), tracer.span(
+        "chat_completions", traceparent=request.headers.get("traceparent")
+    ):
+        try:
+            return _chat_completions(payload)
+        except scheduler.Overloaded as e:
+            tracing.mark_error(e)
+            return _overloaded_response(e)
+
+
+def _overloaded_response(e: scheduler.Overloaded) -> JSONResponse:
+    """
+    Fast rejection while Ollama is saturated (OpenAI-style error body, so chat clients can retry).
+    """
+    return JSONResponse(
+        status_code=e.status_code,
+        headers={"Retry-After": str(int(e.retry_after_s))},
+        content={
+            "error": {
+                "message": str(e),
+                "type": "overloaded",
+                "code": e.reason,
+                "backend": e.backend,
+            }
+        },
+    )
+
+
+def _flat_message(m: dict[str, Any] | None) -> str:
+    return f"{(m or {}).get('role')}:{(m or {}).get('content')}"
+
+
+def _conversation_history(messages: list[dict[str, Any]]) -> list[str]:
+    """
+    Everything in the conversation except the last user message, flattened for fingerprinting:
+    cached answers are only reused within the same conversation prefix.
+    """
+    last_user = max((i for i, m in enumerate(messages) if (m or {}).get("role") == "user"), default=-1)
+    return [_flat_message(m) for i, m in enumerate(messages) if i != last_user]
+
+
+def _conversation_key(payload: dict, messages: list[dict[str, Any]], answer: str | None = None) -> str | None:
+    """
+    Key of the conversation state: the request's `conversation_id`, else a fingerprint of the message
+    prefix. Without `answer`: the history before the last user message (where this turn looks);
+    with it: all messages plus that answer (where the next turn will look).
+    """
+    conversation_id = payload.get("conversation_id")
+    if conversation_id:
+        return answer_cache.fingerprint("conversation_id", str(conversation_id))
+    if answer is None:
+        return conversation.prefix_key(_conversation_history(messages))
+    return conversation.prefix_key([_flat_message(m) for m in messages] + [f"assistant:{answer}"])
+
+
+def _chat_completions(payload: dict) -> dict:
     request_id = str(uuid.uuid4())
     messages_in = payload.get("messages", []) or []
 
@@ -362,27 +1216,103 @@ def chat_completions(payload: dict) -> dict:
     if not user_text:
         user_text = ""
 
+    retrieval_mode = str(payload.get("retrieval_mode") or RAG_RETRIEVAL_MODE).strip().lower()
+    fetch_mode = str(payload.get("fetch_mode") or RAG_FETCH_MODE).strip().lower()
+    fetch_info: dict[str, Any] | None = None
+    rrf_k = RAG_RRF_K
+    target_hits_now = _target_hits.current
+    rrf_weights = {"vector": RAG_RRF_VECTOR_WEIGHT, "bm25": RAG_RRF_BM25_WEIGHT}
+
+    timings_ms: dict[str, float] = {}
+    context_stats: dict[str, Any] = {}
+    multi_query: dict[str, Any] | None = None
+    cache_info: dict[str, Any] | None = None
+    conv_info: dict[str, Any] | None = None
     try:
-        # 1) Embed query
-        t0 = time.perf_counter()
-        q = _ollama_embed_one(user_text)
-        _validate_embedding_dim(q)
-        t1 = time.perf_counter()
-
-        # 2) Retrieve
-        hits = _vespa_retrieve(q, top_k=RAG_TOP_K, target_hits=RAG_TARGET_HITS)
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"retrieval_mode must be one of {', '.join(RETRIEVAL_MODES)} (got {retrieval_mode!r}).")
+        if fetch_mode not in FETCH_MODES:
+            raise ValueError(f"fetch_mode must be one of {', '.join(FETCH_MODES)} (got {fetch_mode!r}).")
+        slim = fetch_mode == "two_phase"
+        rrf_k = int(payload.get("rrf_k") or RAG_RRF_K)
+        rrf_weights.update({k: float(v) for k, v in (payload.get("rrf_weights") or {}).items()})
+
+        # 1) + 2) Embed query and retrieve candidates
+        n_candidates = max(RAG_TOP_K, RAG_CANDIDATE_HITS)
+
+        # Follow-up in a known conversation: embed first, and skip retrieval if the query has not
+        # drifted from one the conversation already retrieved for (bm25 has no vector; multi rewrites).
+        use_conv = (
+            RAG_CONV_ENABLED and payload.get("conversation") is not False and retrieval_mode not in ("bm25", "multi")
+        )
+        conv_key = _conversation_key(payload, messages_in) if use_conv else None
+        conv_state = _conversations.get(conv_key)
+        conv_plan = conversation.Plan(conversation.NEW if use_conv else conversation.BYPASS)
+        q_pre: list[float] | None = None
+        if conv_state is not None:
+            q_pre = _embed_query(user_text, timings_ms)
+            with _stage("conversation_lookup", anchors=len(conv_state.anchors), chunks=len(conv_state.chunks)) as span:
+                conv_plan = _conversations.plan(conv_state, q_pre, n_candidates)
+                span.set(result=conv_plan.result, similarity=conv_plan.similarity)
+
+        if conv_plan.result == conversation.REUSE:
+            q, hits = q_pre, conv_plan.hits
+        elif retrieval_mode == "multi":
+            variants = payload.get("query_variants")
+            q, hits, multi_query = _retrieve_multi(
+                user_text,
+                [str(v) for v in variants] if isinstance(variants, list) else None,
+                top_k=n_candidates,
+                target_hits=target_hits_now,
+                rrf_k=rrf_k,
+                timings_ms=timings_ms,
+                slim=slim,
+            )
+        else:
+            q, hits = _retrieve(
+                retrieval_mode,
+                user_text,
+                top_k=n_candidates,
+                target_hits=target_hits_now,
+                rrf_k=rrf_k,
+                rrf_weights=rrf_weights,
+                timings_ms=timings_ms,
+                slim=slim,
+                query_vec=q_pre,
+            )
+        if slim and conv_plan.result != conversation.REUSE:
+            t_fetch = time.perf_counter()
+            with _stage("fetch_chunks", hits=len(hits)) as span:
+                fetch_info = _resolve_chunks(hits)
+                span.set(**fetch_info)
+            timings_ms["fetch_ms"] = (time.perf_counter() - t_fetch) * 1000.0
+        retrieve_cost_ms = timings_ms.get("retrieve_ms", 0.0) + timings_ms.get("fetch_ms", 0.0)
+        carried = 0
+        if conv_plan.result == conversation.REFRESH:
+            # Keep the conversation's best chunks for the new query available to the packer.
+            extra = _conversations.ranked(conv_state, q, RAG_TOP_K, exclude={h.get("chunk_id") for h in hits})
+            hits = hits + extra
+            carried = len(extra)
         t2 = time.perf_counter()
 
-        context_blocks: list[str] = []
-        for h in hits:
-            cid = h.get("chunk_id") or ""
-            did = h.get("doc_id") or ""
-            txt = (h.get("text") or "").strip()
-            if not txt:
-                continue
-            context_blocks.append(f"[{did} | {cid}]\n{txt}")
-
-        context_text = "\n\n---\n\n".join(context_blocks).strip()
+        # 3) Pack context: token budget, near-duplicate suppression, merge adjacent chunks
+        with _stage("pack_context", candidates=len(hits), budget_tokens=RAG_CONTEXT_TOKENS) as span:
+            packed = context.pack_context(
+                hits,
+                q,
+                max_tokens=RAG_CONTEXT_TOKENS,
+                max_chunks=RAG_TOP_K,
+                mmr_lambda=RAG_MMR_LAMBDA,
+                dup_threshold=RAG_DUP_THRESHOLD,
+            )
+            span.set(**packed.stats)
+        t_pack = time.perf_counter()
+        timings_ms["pack_ms"] = (t_pack - t2) * 1000.0
+        context_stats = packed.stats
+        metrics.CONTEXT_TOKENS.labels(kind="packed").inc(packed.stats["context_tokens"])
+        metrics.CONTEXT_TOKENS.labels(kind="saved").inc(packed.stats["prompt_tokens_saved"])
+
+        context_text = packed.text
         if not context_text:
             answer = (
                 "I couldn't find any stored context in Vespa yet.\n"
@@ -405,20 +1335,56 @@ def chat_completions(payload: dict) -> dict:
                 if role in ("system", "user", "assistant") and isinstance(content, str):
                     messages_out.append({"role": role, "content": content})
 
-            answer = _ollama_chat(messages_out)
+            # 4) Semantic answer cache: same-scope paraphrase answered from the same context?
+            cache_scope = answer_cache.fingerprint(OLLAMA_CHAT_MODEL, *_conversation_history(messages_in))
+            cache_sources = answer_cache.fingerprint(context_text)
+            use_cache = RAG_CACHE_ENABLED and q is not None and payload.get("cache") is not False
+            cached = None
+            if use_cache:
+                with _stage("cache_lookup") as span:
+                    lookup = _answer_cache.lookup(q, cache_scope, cache_sources)
+                    span.set(result=lookup.result, similarity=lookup.similarity)
+                metrics.ANSWER_CACHE_LOOKUPS.labels(result=lookup.result).inc()
+                if lookup.similarity is not None:
+                    metrics.ANSWER_CACHE_SIMILARITY.observe(lookup.similarity)
+                cache_info = lookup.to_dict()
+                cached = lookup.entry
+            else:
+                cache_info = {"result": "bypass" if RAG_CACHE_ENABLED else "disabled"}
+
+            if cached is not None:
+                answer = cached.answer
+            else:
+                with _stage("chat", model=OLLAMA_CHAT_MODEL, context_chunks=len(packed.chunk_ids), prompt_chars=len(system)):
+                    answer = _ollama_chat(messages_out)
+                timings_ms["chat_ms"] = (time.perf_counter() - t_pack) * 1000.0
+                if use_cache:
+                    _answer_cache.store(q, cache_scope, cache_sources, answer, packed.chunk_ids)
 
             # Append sources (ids only) so you can verify what was used.
-            source_lines = [f"- {h.get('doc_id')} :: {h.get('chunk_id')}" for h in hits if h.get("chunk_id")]
+            source_lines = [f"- {b.doc_id} :: {cid}" for b in packed.blocks for cid in b.chunk_ids if cid]
             if source_lines:
                 answer = answer.rstrip() + "\n\nSources:\n" + "\n".join(source_lines)
 
-        embed_ms = (t1 - t0) * 1000.0
-        retrieve_ms = (t2 - t1) * 1000.0
-
         content = answer
         model_name = payload.get("model", "rag-ollama")
         created = int(time.time())
+
+        next_key = _conversation_key(payload, messages_in, content) if use_conv else None
+        _conversations.record(next_key, conv_state, conv_key, q, hits, conv_plan, retrieve_cost_ms)
+        metrics.CONVERSATION_TURNS.labels(result=conv_plan.result).inc()
+        metrics.CONVERSATION_SAVED_SECONDS.inc(conv_plan.saved_ms / 1000.0)
+        conv_info = conv_plan.to_dict()
+        if use_conv:
+            conv_info.update(
+                key="conversation_id" if payload.get("conversation_id") else "prefix",
+                turn=(conv_state.turns if conv_state is not None else 0) + 1,
+                reused_chunks=len(hits) if conv_plan.result == conversation.REUSE else carried,
+            )
+    except scheduler.Overloaded:
+        raise
     except Exception as e:
+        tracing.mark_error(e)
         content = f"RAG error: {e}"
         model_name = payload.get("model", "rag-ollama")
         created = int(time.time())
@@ -438,11 +1404,20 @@ def chat_completions(payload: dict) -> dict:
         # Extra debug info (non-OpenAI standard). Safe to ignore by clients.
         "rag_debug": {
             "request_id": request_id,
+            "trace_id": tracing.current_trace_id(),
             "vespa_namespace": VESPA_NAMESPACE,
             "top_k": RAG_TOP_K,
-            "target_hits": RAG_TARGET_HITS,
+            "target_hits": target_hits_now,
+            "retrieval_mode": retrieval_mode,
+            "rrf": {"k": rrf_k, "weights": rrf_weights} if retrieval_mode == "rrf" else None,
+            "multi_query": multi_query,
+            "fetch": {"mode": fetch_mode, **(fetch_info or {})},
+            "cache": cache_info,
+            "conversation": conv_info,
             "embed_model": OLLAMA_EMBED_MODEL,
             "chat_model": OLLAMA_CHAT_MODEL,
+            "timings_ms": timings_ms,
+            "context": context_stats,
         },
     }
 
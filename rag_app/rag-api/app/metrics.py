@@ -0,0 +1,219 @@
+"""
+Prometheus metrics for rag-api (served at GET /metrics).
+
+Every pipeline stage is timed into one histogram, labelled by stage:
+
+  rag_api_stage_seconds{stage="query_embed|retrieve|retrieve_vector|retrieve_bm25|retrieve_variant|query_rewrite|conversation_lookup|fetch_chunks|shadow_exact|pack_context|cache_lookup|chat|chunk|chunk_embed|feed"}
+
+so Grafana can stack "where did the time go" per request type under load.
+"""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+REGISTRY = CollectorRegistry()
+
+# Embedding / Vespa calls are milliseconds, LLM chat can take minutes on CPU: use wide buckets.
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+STAGE_SECONDS = Histogram(
+    "rag_api_stage_seconds",
+    "Latency of one pipeline stage",
+    labelnames=["stage"],
+    buckets=_BUCKETS,
+    registry=REGISTRY,
+)
+STAGE_ERRORS = Counter(
+    "rag_api_stage_errors",
+    "Exceptions raised inside a pipeline stage",
+    labelnames=["stage"],
+    registry=REGISTRY,
+)
+REQUEST_SECONDS = Histogram(
+    "rag_api_request_seconds",
+    "End-to-end latency of an API endpoint",
+    labelnames=["endpoint"],
+    buckets=_BUCKETS,
+    registry=REGISTRY,
+)
+IN_FLIGHT = Gauge(
+    "rag_api_in_flight",
+    "Requests currently being processed",
+    labelnames=["endpoint"],
+    registry=REGISTRY,
+)
+CHUNKS = Counter(
+    "rag_api_chunks",
+    "Chunks processed by the ingest pipeline",
+    labelnames=["step"],  # created | embedded | fed
+    registry=REGISTRY,
+)
+LLM_TOKENS = Counter(
+    "rag_api_llm_tokens",
+    "Tokens reported by Ollama chat responses",
+    labelnames=["kind"],  # prompt | completion
+    registry=REGISTRY,
+)
+INGEST_JOBS = Gauge(
+    "rag_api_ingest_jobs",
+    "Background ingest jobs in the durable queue, by status",
+    labelnames=["status"],
+    registry=REGISTRY,
+)
+INGEST_WORKERS_BUSY = Gauge(
+    "rag_api_ingest_workers_busy",
+    "Ingest worker threads currently processing a job",
+    registry=REGISTRY,
+)
+CONTEXT_TOKENS = Counter(
+    "rag_api_context_tokens",
+    "Estimated prompt context tokens: sent after packing, and saved vs. pasting the top hits as-is",
+    labelnames=["kind"],  # packed | saved
+    registry=REGISTRY,
+)
+MULTI_QUERY_VARIANTS = Counter(
+    "rag_api_multi_query_variants",
+    "Query variants in multi-query retrieval, by whether their search made the latency budget",
+    labelnames=["outcome"],  # used | dropped
+    registry=REGISTRY,
+)
+ANSWER_CACHE_LOOKUPS = Counter(
+    "rag_api_answer_cache_lookups",
+    "Semantic answer cache lookups",
+    labelnames=["result"],  # hit | miss | stale_sources
+    registry=REGISTRY,
+)
+ANSWER_CACHE_SIMILARITY = Histogram(
+    "rag_api_answer_cache_similarity",
+    "Best cosine similarity to a cached question on each lookup (to tune RAG_CACHE_THRESHOLD)",
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.95, 0.96, 0.97, 0.98, 0.99, 1.0),
+    registry=REGISTRY,
+)
+ANSWER_CACHE_ENTRIES = Gauge(
+    "rag_api_answer_cache_entries",
+    "Answers currently held in the semantic answer cache",
+    registry=REGISTRY,
+)
+CONVERSATION_TURNS = Counter(
+    "rag_api_conversation_turns",
+    "Chat turns by conversation retrieval reuse outcome",
+    labelnames=["result"],  # new | reuse | refresh | bypass
+    registry=REGISTRY,
+)
+CONVERSATION_SAVED_SECONDS = Counter(
+    "rag_api_conversation_saved_seconds",
+    "Estimated retrieval time saved by reusing a conversation's chunks",
+    registry=REGISTRY,
+)
+CONVERSATION_ENTRIES = Gauge(
+    "rag_api_conversation_entries",
+    "Conversations currently holding retrieval state",
+    registry=REGISTRY,
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "rag_api_llm_queue_depth",
+    "Callers waiting for an Ollama backend slot",
+    labelnames=["backend", "priority"],  # chat | embed, interactive | bulk
+    registry=REGISTRY,
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "rag_api_llm_queue_wait_seconds",
+    "Time spent waiting for an Ollama backend slot",
+    labelnames=["backend", "priority"],
+    buckets=_BUCKETS,
+    registry=REGISTRY,
+)
+LLM_IN_FLIGHT = Gauge(
+    "rag_api_llm_in_flight",
+    "Ollama calls currently running, per backend",
+    labelnames=["backend"],
+    registry=REGISTRY,
+)
+LLM_SHED = Counter(
+    "rag_api_llm_shed",
+    "Interactive requests rejected by admission control",
+    labelnames=["backend", "reason"],  # queue_full | predicted_wait | wait_timeout
+    registry=REGISTRY,
+)
+VESPA_RESPONSE_BYTES = Counter(
+    "rag_api_vespa_response_bytes",
+    "Bytes received from Vespa /search/",
+    labelnames=["kind"],  # search | fetch (second phase of two-phase retrieval) | shadow
+    registry=REGISTRY,
+)
+CHUNK_CACHE_LOOKUPS = Counter(
+    "rag_api_chunk_cache_lookups",
+    "Chunk text lookups in two-phase retrieval",
+    labelnames=["result"],  # hit | miss
+    registry=REGISTRY,
+)
+TARGET_HITS = Gauge(
+    "rag_api_target_hits",
+    "nearestNeighbor targetHits currently used (moved by the adaptive controller if enabled)",
+    registry=REGISTRY,
+)
+TARGET_HITS_RECALL = Gauge(
+    "rag_api_target_hits_estimated_recall",
+    "Mean recall@k of the current targetHits vs. exact search, from sampled shadow queries",
+    registry=REGISTRY,
+)
+TARGET_HITS_LATENCY_P95 = Gauge(
+    "rag_api_target_hits_latency_p95_seconds",
+    "p95 latency of vector queries at the current targetHits",
+    registry=REGISTRY,
+)
+TARGET_HITS_SHADOW_QUERIES = Counter(
+    "rag_api_target_hits_shadow_queries",
+    "Exact-search shadow queries run to estimate recall",
+    labelnames=["result"],  # ok | error
+    registry=REGISTRY,
+)
+SINGLEFLIGHT_CALLS = Counter(
+    "rag_api_singleflight_calls",
+    "Backend calls by single-flight outcome (coalesced = served by an identical call already in flight)",
+    labelnames=["backend", "result"],  # embed | search | chat; leader | coalesced | timeout
+    registry=REGISTRY,
+)
+RETRIEVED_HITS = Counter(
+    "rag_api_retrieved_hits",
+    "Hits returned by Vespa retrieval",
+    registry=REGISTRY,
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a pipeline stage and count it as an error if it raises.
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage=name).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage=name).observe(time.perf_counter() - t0)
+
+
+@contextmanager
+def request(endpoint: str) -> Iterator[None]:
+    """
+    Track in-flight count and end-to-end latency for one endpoint call.
+    """
+    t0 = time.perf_counter()
+    IN_FLIGHT.labels(endpoint=endpoint).inc()
+    try:
+        yield
+    finally:
+        IN_FLIGHT.labels(endpoint=endpoint).dec()
+        REQUEST_SECONDS.labels(endpoint=endpoint).observe(time.perf_counter() - t0)
+
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
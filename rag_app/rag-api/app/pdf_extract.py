@@ -0,0 +1,122 @@
+"""
+Parallel PDF text extraction.
+
+pypdf's `extract_text()` is pure Python and CPU-bound, so threads do not help: pages are split
+into ranges and extracted in a process pool. Results are yielded in page order as soon as the
+next range is ready, so the caller can start chunking/embedding before the last page is done.
+
+This module is imported by the pool's (spawned) worker processes, so keep it free of app state:
+only pypdf and the standard library.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterator
+
+from pypdf import PdfReader
+
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "25"))
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+class PdfAccessError(ValueError):
+    """
+    Encrypted PDF without (or with a wrong) password: reported to the caller as-is.
+    """
+
+
+def open_pdf(path: str, pdf_password: str | None) -> PdfReader:
+    reader = PdfReader(path)
+    if getattr(reader, "is_encrypted", False):
+        if not pdf_password:
+            raise PdfAccessError(
+                "This PDF appears to be encrypted/password-protected. "
+                "Provide `pdf_password` as a multipart form field, e.g. "
+                "`-F \"pdf_password=...\"`. "
+                "If you still see an AES/cryptography error, rebuild rag-api to install cryptography."
+            )
+
+        # pypdf decrypt returns 0 if it fails, 1/2 if it succeeds (depending on algorithm)
+        try:
+            ok = reader.decrypt(pdf_password)
+        except Exception as e:
+            raise PdfAccessError(f"Failed to decrypt PDF: {e}") from e
+
+        if not ok:
+            raise PdfAccessError("PDF password was rejected (wrong password).")
+    return reader
+
+
+def extract_page_range(path: str, pdf_password: str | None, start: int, end: int) -> list[tuple[int, str, float]]:
+    """
+    Runs in a worker process: returns [(page_index, text, extract_ms), ...] for pages [start, end).
+    """
+    reader = open_pdf(path, pdf_password)
+    out: list[tuple[int, str, float]] = []
+    for i in range(start, end):
+        t0 = time.perf_counter()
+        text = reader.pages[i].extract_text() or ""
+        out.append((i, text, (time.perf_counter() - t0) * 1000.0))
+    return out
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn (not fork): the API process runs worker/exporter threads, which fork does not copy safely.
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def iter_pdf_pages(path: str, pdf_password: str | None, page_ms: list[float]) -> Iterator[str]:
+    """
+    Yield page texts in order. Per-page extraction time (ms) is appended to `page_ms`.
+
+    At most 2 ranges per worker are in flight, so a slow consumer (embedding) does not make
+    the whole document's text pile up in memory.
+    """
+    n_pages = len(open_pdf(path, pdf_password).pages)
+    step = max(1, PDF_PAGES_PER_TASK)
+    ranges = iter([(s, min(n_pages, s + step)) for s in range(0, n_pages, step)])
+
+    if n_pages <= step:
+        # Small document: not worth a round trip to the pool.
+        for _, text, ms in extract_page_range(path, pdf_password, 0, n_pages):
+            page_ms.append(ms)
+            yield text
+        return
+
+    pool = _get_pool()
+    pending: deque[Future[list[tuple[int, str, float]]]] = deque()
+
+    def submit_next() -> None:
+        r = next(ranges, None)
+        if r is not None:
+            pending.append(pool.submit(extract_page_range, path, pdf_password, r[0], r[1]))
+
+    for _ in range(2 * PDF_EXTRACT_WORKERS):
+        submit_next()
+
+    try:
+        while pending:
+            pages = pending.popleft().result()
+            submit_next()
+            for _, text, ms in pages:
+                page_ms.append(ms)
+                yield text
+    finally:
+        for f in pending:
+            f.cancel()
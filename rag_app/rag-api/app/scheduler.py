@@ -0,0 +1,152 @@
+"""
+Admission control for the Ollama backends.
+
+Each backend (chat, embed) gets a `Limiter`: at most `concurrency` calls run at once, and the rest
+wait in a priority queue. Interactive work (chat requests, query embeddings) is always admitted
+before bulk work (ingest embeddings), so a large ingest cannot starve users.
+
+Interactive callers are shed instead of queued indefinitely, with `Overloaded` (mapped to
+HTTP 429/503 by the API):
+  - queue_full       more than `max_queue` interactive callers already waiting (429)
+  - predicted_wait   the expected queue time (waiters ahead x recent call duration / concurrency)
+                     already exceeds `max_wait_s`, so fail now rather than time out later (503)
+  - wait_timeout     queued for `max_wait_s` without getting a slot (503)
+Bulk callers are never shed: ingest jobs are bounded by the worker pool and simply wait.
+
+The caller's priority travels in a contextvar (`priority(BULK)`), so helpers deep in the call
+stack do not need an extra argument.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from . import metrics
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+_priority: ContextVar[int] = ContextVar("llm_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(p: int) -> Iterator[None]:
+    token = _priority.set(p)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class Overloaded(Exception):
+    def __init__(self, backend: str, reason: str, status_code: int, retry_after_s: float) -> None:
+        super().__init__(f"{backend} backend overloaded ({reason}); retry in ~{retry_after_s:.0f}s")
+        self.backend = backend
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after_s = retry_after_s
+
+
+class Limiter:
+    def __init__(self, backend: str, concurrency: int, max_queue: int, max_wait_s: float) -> None:
+        self.backend = backend
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting: list[tuple[int, int]] = []  # heap of (priority, arrival seq)
+        self._seq = itertools.count()
+        self._service_s: float | None = None  # EWMA of call duration
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """
+        Hold one backend slot for the duration of the block (at the caller's contextvar priority).
+        """
+        self._enter(current_priority())
+        metrics.LLM_IN_FLIGHT.labels(backend=self.backend).inc()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            metrics.LLM_IN_FLIGHT.labels(backend=self.backend).dec()
+            self._leave(time.perf_counter() - t0)
+
+    def _enter(self, prio: int) -> None:
+        name = PRIORITY_NAMES.get(prio, str(prio))
+        t0 = time.perf_counter()
+        with self._cond:
+            if self._active < self.concurrency and not self._waiting:
+                self._active += 1
+                metrics.LLM_QUEUE_WAIT_SECONDS.labels(backend=self.backend, priority=name).observe(0.0)
+                return
+
+            shed = prio == INTERACTIVE
+            if shed:
+                queued = sum(1 for p, _ in self._waiting if p == INTERACTIVE)
+                if self.max_queue > 0 and queued >= self.max_queue:
+                    self._shed("queue_full", 429, self._estimate_wait(prio) or self.max_wait_s)
+                est = self._estimate_wait(prio)
+                if est is not None and est > self.max_wait_s:
+                    self._shed("predicted_wait", 503, est)
+
+            key = (prio, next(self._seq))
+            heapq.heappush(self._waiting, key)
+            depth = metrics.LLM_QUEUE_DEPTH.labels(backend=self.backend, priority=name)
+            depth.inc()
+            deadline = t0 + self.max_wait_s
+            try:
+                while not (self._waiting[0] == key and self._active < self.concurrency):
+                    remaining = deadline - time.perf_counter()
+                    if shed and remaining <= 0:
+                        self._waiting.remove(key)
+                        heapq.heapify(self._waiting)
+                        self._cond.notify_all()
+                        self._shed("wait_timeout", 503, self._estimate_wait(prio) or self.max_wait_s)
+                    self._cond.wait(remaining if shed else None)
+                heapq.heappop(self._waiting)
+                self._active += 1
+                # More than one slot may be free: let the next waiter re-check.
+                self._cond.notify_all()
+            finally:
+                depth.dec()
+        metrics.LLM_QUEUE_WAIT_SECONDS.labels(backend=self.backend, priority=name).observe(time.perf_counter() - t0)
+
+    def _leave(self, service_s: float) -> None:
+        with self._cond:
+            self._active -= 1
+            self._service_s = service_s if self._service_s is None else 0.8 * self._service_s + 0.2 * service_s
+            self._cond.notify_all()
+
+    def _estimate_wait(self, prio: int) -> float | None:
+        # Caller holds the lock.
+        if self._service_s is None:
+            return None
+        ahead = sum(1 for p, _ in self._waiting if p <= prio)
+        return (ahead + 1) * self._service_s / self.concurrency
+
+    def _shed(self, reason: str, status_code: int, retry_after_s: float) -> None:
+        metrics.LLM_SHED.labels(backend=self.backend, reason=reason).inc()
+        raise Overloaded(self.backend, reason, status_code, max(1.0, math.ceil(retry_after_s)))
+
+    def stats(self) -> dict[str, object]:
+        with self._cond:
+            return {
+                "concurrency": self.concurrency,
+                "active": self._active,
+                "queued": len(self._waiting),
+                "avg_call_s": self._service_s,
+            }
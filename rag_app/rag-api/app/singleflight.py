@@ -0,0 +1,92 @@
+"""
+Single-flight coalescing of identical backend calls.
+
+When the same question arrives from many users at once, every request would embed the same text,
+send the same Vespa query and ask the chat model the same prompt. A `Group` per backend lets only the
+first caller (the leader) run a call; concurrent callers with the same key (model + input) wait for
+the leader's result instead of running it again. Only calls that are in flight at the same moment are
+shared: once the leader finishes the key is forgotten, so nothing is cached.
+
+- the leader's exception is raised in every waiting caller (a failure is not retried N times at once)
+- a waiting caller gives up after `timeout_s` with `TimeoutError`, so a stuck leader cannot hold
+  followers longer than their own call would have; the caller passes its call's HTTP timeout plus the
+  admission wait the leader may spend first (None: wait as long as the leader, e.g. bulk calls)
+- callers that queue differently must not share a flight: rag-api puts the scheduler priority into
+  the key, so an interactive caller never waits behind a bulk leader and a bulk caller never receives
+  an interactive leader's `Overloaded`
+- `copy` gives each caller its own copy of a mutable result (hit dicts are filled in later per request)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Callable, TypeVar
+
+from . import metrics
+
+T = TypeVar("T")
+
+# Call outcomes (also the `result` label of rag_api_singleflight_calls_total).
+LEADER = "leader"
+COALESCED = "coalesced"
+TIMEOUT = "timeout"
+
+
+def key(*parts: Any) -> str:
+    """
+    Stable key for JSON-serializable call inputs (dict key order does not matter).
+    """
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class Group:
+    def __init__(self, backend: str, enabled: bool = True) -> None:
+        self.backend = backend
+        self.enabled = enabled
+        self._calls: dict[str, Future[Any]] = {}
+        self._lock = threading.Lock()
+        self.counts = {LEADER: 0, COALESCED: 0, TIMEOUT: 0}
+
+    def do(self, k: str, fn: Callable[[], T], timeout_s: float | None, copy: Callable[[T], T] | None = None) -> T:
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            fut = self._calls.get(k)
+            leader = fut is None
+            if leader:
+                fut = self._calls[k] = Future()
+        if not leader:
+            try:
+                result = fut.result(timeout=timeout_s)
+            except FutureTimeout:
+                self._count(TIMEOUT)
+                raise TimeoutError(f"{self.backend}: identical call still running after {timeout_s:g}s") from None
+            self._count(COALESCED)
+            return copy(result) if copy is not None else result
+
+        self._count(LEADER)
+        try:
+            result = fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+        finally:
+            with self._lock:
+                self._calls.pop(k, None)
+        return copy(result) if copy is not None else result
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {"enabled": self.enabled, "in_flight": len(self._calls), **self.counts}
+
+    def _count(self, result: str) -> None:
+        with self._lock:
+            self.counts[result] += 1
+        metrics.SINGLEFLIGHT_CALLS.labels(backend=self.backend, result=result).inc()
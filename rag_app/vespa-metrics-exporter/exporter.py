@@ -10,6 +10,10 @@ This exporter fetches Vespa JSON on each scrape and exposes a single Gauge:
   vespa_metric_value{metric="...", stat="...", node="...", service="..."} <number>
 
 To avoid high cardinality, set EXPORT_PATH_REGEX to filter metric names.
+
+It also exposes its own self-instrumentation under the `vespa_exporter_` prefix
+(fetch latency, payload size, JSON parse time, series emitted/filtered, fetch errors,
+last successful scrape) so you can alert when the exporter itself becomes the bottleneck.
 """
 
 from __future__ import annotations
@@ -17,13 +21,15 @@ from __future__ import annotations
 import json
 import os
 import re
+import socket
 import sys
 import time
+import urllib.error
 import urllib.request
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
-from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Gauge, generate_latest
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
 
 
 VESPA_METRICS_URL = os.getenv("VESPA_METRICS_URL", "http://vespa:19071/metrics/v2/values")
@@ -35,11 +41,87 @@ FETCH_TIMEOUT_SECONDS = float(os.getenv("FETCH_TIMEOUT_SECONDS", "2.5"))
 _FILTER: Optional[re.Pattern[str]] = re.compile(EXPORT_PATH_REGEX, re.IGNORECASE) if EXPORT_PATH_REGEX else None
 
 
-def _fetch_json(url: str) -> Dict[str, Any]:
+# Self metrics live in their own long-lived registry: the Vespa registry is rebuilt on every
+# scrape, but histograms/counters must accumulate across scrapes to be useful.
+SELF_REGISTRY = CollectorRegistry()
+
+_FETCH_SECONDS = Histogram(
+    "vespa_exporter_fetch_seconds",
+    "Time spent fetching Vespa /metrics/v2/values (HTTP only)",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+    registry=SELF_REGISTRY,
+)
+_PARSE_SECONDS = Histogram(
+    "vespa_exporter_parse_seconds",
+    "Time spent decoding the Vespa metrics JSON payload",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+    registry=SELF_REGISTRY,
+)
+_SCRAPE_SECONDS = Histogram(
+    "vespa_exporter_scrape_seconds",
+    "Total time to build the Vespa registry for one scrape (fetch + parse + flatten)",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    registry=SELF_REGISTRY,
+)
+_PAYLOAD_BYTES = Gauge(
+    "vespa_exporter_payload_bytes",
+    "Size in bytes of the last Vespa metrics payload",
+    registry=SELF_REGISTRY,
+)
+_SERIES_EMITTED = Gauge(
+    "vespa_exporter_series_emitted",
+    "Number of vespa_metric_value series exported by the last scrape",
+    registry=SELF_REGISTRY,
+)
+_SERIES_FILTERED = Gauge(
+    "vespa_exporter_series_filtered",
+    "Number of Vespa values dropped by EXPORT_PATH_REGEX in the last scrape",
+    registry=SELF_REGISTRY,
+)
+_FETCH_ERRORS = Counter(
+    "vespa_exporter_fetch_errors",
+    "Failed attempts to fetch or decode Vespa metrics, by error type",
+    labelnames=["error_type"],
+    registry=SELF_REGISTRY,
+)
+_LAST_SUCCESS = Gauge(
+    "vespa_exporter_last_success_timestamp_seconds",
+    "Unix timestamp of the last scrape that fetched and decoded Vespa metrics",
+    registry=SELF_REGISTRY,
+)
+
+
+def _classify_error(e: Exception) -> str:
+    """
+    Map an exception to a small, fixed set of label values (keeps cardinality bounded).
+    """
+    if isinstance(e, urllib.error.HTTPError):
+        return "http_status"
+    if isinstance(e, (socket.timeout, TimeoutError)):
+        return "timeout"
+    if isinstance(e, urllib.error.URLError):
+        reason = getattr(e, "reason", None)
+        if isinstance(reason, (socket.timeout, TimeoutError)):
+            return "timeout"
+        return "connection"
+    if isinstance(e, (json.JSONDecodeError, UnicodeDecodeError)):
+        return "decode"
+    return "other"
+
+
+def _fetch_bytes(url: str) -> bytes:
     req = urllib.request.Request(url, headers={"Accept": "application/json"})
-    with urllib.request.urlopen(req, timeout=FETCH_TIMEOUT_SECONDS) as resp:
-        data = resp.read()
-    return json.loads(data.decode("utf-8"))
+    with _FETCH_SECONDS.time():
+        with urllib.request.urlopen(req, timeout=FETCH_TIMEOUT_SECONDS) as resp:
+            data = resp.read()
+    _PAYLOAD_BYTES.set(len(data))
+    return data
+
+
+def _fetch_json(url: str) -> Dict[str, Any]:
+    data = _fetch_bytes(url)
+    with _PARSE_SECONDS.time():
+        return json.loads(data.decode("utf-8"))
 
 
 def _iter_metric_objects(obj: Any, ctx: Dict[str, str]) -> Iterable[Tuple[Dict[str, str], Dict[str, Any]]]:
@@ -120,10 +202,20 @@ def build_registry() -> CollectorRegistry:
     try:
         payload = _fetch_json(VESPA_METRICS_URL)
     except Exception as e:
-        # Expose an "up" style signal via stderr; Prometheus will see missing series.
+        # Prometheus will see missing Vespa series; the error counter says why. The last-scrape gauges
+        # describe this scrape, so they must not keep reporting the previous successful one.
+        _FETCH_ERRORS.labels(error_type=_classify_error(e)).inc()
+        _PAYLOAD_BYTES.set(0)
+        _SERIES_EMITTED.set(0)
+        _SERIES_FILTERED.set(0)
         print(f"[exporter] ERROR fetching {VESPA_METRICS_URL}: {e}", file=sys.stderr)
         return registry
 
+    _LAST_SUCCESS.set(time.time())
+
+    # Several Vespa objects can map onto the same label set; count distinct series, not writes.
+    series: set[Tuple[str, str, str, str]] = set()
+    filtered = 0
     for ctx, metric_obj in _iter_metric_objects(payload, ctx={"node": "", "service": ""}):
         values = metric_obj.get("values", {})
         if not isinstance(values, dict):
@@ -131,15 +223,15 @@ def build_registry() -> CollectorRegistry:
         for key, num in _flatten_values(values):
             # Filter on the full key (most specific), not the base metric.
             if _FILTER and not _FILTER.search(key):
+                filtered += 1
                 continue
             metric, stat = _split_metric_and_stat(key)
-            gauge.labels(
-                metric=metric,
-                stat=stat,
-                node=ctx.get("node", ""),
-                service=ctx.get("service", ""),
-            ).set(num)
+            labels = (metric, stat, ctx.get("node", ""), ctx.get("service", ""))
+            gauge.labels(*labels).set(num)
+            series.add(labels)
 
+    _SERIES_EMITTED.set(len(series))
+    _SERIES_FILTERED.set(filtered)
     return registry
 
 
@@ -160,8 +252,9 @@ class Handler(BaseHTTPRequestHandler):
             return
 
         start = time.time()
-        registry = build_registry()
-        body = generate_latest(registry)
+        with _SCRAPE_SECONDS.time():
+            registry = build_registry()
+        body = generate_latest(registry) + generate_latest(SELF_REGISTRY)
 
         self.send_response(200)
         self.send_header("Content-Type", CONTENT_TYPE_LATEST)
@@ -1,25 +1,99 @@
 from __future__ import annotations
 
+import contextvars
 import json
 import os
+import sys
 import time
 import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from typing import Any
 
 import numpy as np
 import requests
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from rag_common import chunk_cache, projection, target_hits, tracing
 from sentence_transformers import SentenceTransformer
 
+from . import planner
+
 VESPA_URL = os.environ.get("VESPA_URL", "http://vespa:8080")
 VESPA_NAMESPACE = os.environ.get("VESPA_NAMESPACE", "lab")
 EMBED_MODEL = os.environ.get("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 EMBED_DIM = int(os.environ.get("EMBED_DIM", "384"))
 LOG_PATH = os.environ.get("LOG_PATH", "/logs/requests.jsonl")
 
+# Dimensionality reduction: a projection artifact from tools/reduce_dims.py. When set, query vectors are
+# projected with it and searched against `embedding_reduced` (ingest must feed it with the same file).
+EMBED_PROJECTION = os.environ.get("EMBED_PROJECTION", "")
+
+# Two-phase fetch ("fetch": "two_phase" in /search): ids-only search + chunk text from this cache.
+CHUNK_CACHE_ENTRIES = int(os.environ.get("CHUNK_CACHE_ENTRIES", "20000"))
+CHUNK_CACHE_MB = int(os.environ.get("CHUNK_CACHE_MB", "128"))
+CHUNK_CACHE_TTL_S = float(os.environ.get("CHUNK_CACHE_TTL_S", "3600"))
+
+# Query planner ("plan": "auto" in /search): per-request targetHits / exact vs approximate / Vespa
+# filter thresholds from filter selectivity. Attribute value counts are refreshed every PLANNER_REFRESH_S.
+PLANNER_DEFAULT = os.environ.get("PLANNER_DEFAULT", "fixed")  # fixed | auto
+PLANNER_REFRESH_S = float(os.environ.get("PLANNER_REFRESH_S", "60"))
+# Filters matching at most this many docs are searched exactly (approximate:false).
+PLANNER_EXACT_MAX_DOCS = int(os.environ.get("PLANNER_EXACT_MAX_DOCS", "2000"))
+# Filters keeping at least this fraction of docs use post-filtering with a raised targetHits.
+PLANNER_POSTFILTER_MIN = float(os.environ.get("PLANNER_POSTFILTER_MIN", "0.8"))
+# Passed as ranking.matching.filterFirstThreshold for pre-filtered HNSW.
+PLANNER_FILTER_FIRST_THRESHOLD = float(os.environ.get("PLANNER_FILTER_FIRST_THRESHOLD", "0.3"))
+
+# Adaptive targetHits ("target_hits": "auto" in /search, rag_common.target_hits): moved within [MIN, MAX] to
+# keep p95 Vespa latency of unfiltered vector searches under TARGET_HITS_SLO_MS and recall@hits at
+# TARGET_HITS_RECALL. Recall comes from re-running TARGET_HITS_SHADOW_RATE of those searches exactly
+# (approximate:false) in the background. TARGET_HITS_DEFAULT is used when a request sets no target_hits.
+TARGET_HITS_DEFAULT = os.environ.get("TARGET_HITS_DEFAULT", "50").strip().lower()  # a number or "auto"
+TARGET_HITS_MIN = int(os.environ.get("TARGET_HITS_MIN", "10"))
+TARGET_HITS_MAX = int(os.environ.get("TARGET_HITS_MAX", "1000"))
+TARGET_HITS_SLO_MS = float(os.environ.get("TARGET_HITS_SLO_MS", "30"))
+TARGET_HITS_RECALL = float(os.environ.get("TARGET_HITS_RECALL", "0.95"))
+TARGET_HITS_SHADOW_RATE = float(os.environ.get("TARGET_HITS_SHADOW_RATE", "0.05"))
+TARGET_HITS_INTERVAL_S = float(os.environ.get("TARGET_HITS_INTERVAL_S", "30"))
+
+# /search/batch: at most BATCH_MAX_QUERIES per call; Vespa searches run BATCH_FANOUT at a time
+# (a call may ask for less with "concurrency").
+BATCH_MAX_QUERIES = int(os.environ.get("BATCH_MAX_QUERIES", "256"))
+BATCH_FANOUT = int(os.environ.get("BATCH_FANOUT", "8"))
+
+_HIT_FIELDS = "chunk_id, doc_id, tenant_id, source, text"
+
 app = FastAPI(title="retrieval-lab", version="0.1.0")
 
+tracer = tracing.tracer_from_env("retrieval-lab")
+
 _model: SentenceTransformer | None = None
+_projection = projection.load(EMBED_PROJECTION) if EMBED_PROJECTION else None
+if _projection is not None and _projection.in_dim != EMBED_DIM:
+    raise ValueError(f"EMBED_PROJECTION {_projection.name} projects {_projection.in_dim}-dim vectors, EMBED_DIM={EMBED_DIM}")
+_chunk_cache = chunk_cache.ChunkCache(CHUNK_CACHE_ENTRIES, CHUNK_CACHE_MB * 1024 * 1024, CHUNK_CACHE_TTL_S)
+_filter_stats = planner.FilterStats(VESPA_URL, PLANNER_REFRESH_S)
+_batch_pool = ThreadPoolExecutor(max_workers=max(1, BATCH_FANOUT), thread_name_prefix="search-batch")
+_target_hits = target_hits.Controller(
+    # Start from a numeric TARGET_HITS_DEFAULT (the controller clamps it to [MIN, MAX]).
+    initial=50 if TARGET_HITS_DEFAULT == "auto" else int(TARGET_HITS_DEFAULT),
+    min_hits=TARGET_HITS_MIN,
+    max_hits=TARGET_HITS_MAX,
+    latency_slo_ms=TARGET_HITS_SLO_MS,
+    recall_target=TARGET_HITS_RECALL,
+    shadow_rate=TARGET_HITS_SHADOW_RATE,
+    interval_s=TARGET_HITS_INTERVAL_S,
+)
+_shadow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+
+
+@app.on_event("startup")
+def _startup() -> None:
+    _filter_stats.start()
+
+
+@app.on_event("shutdown")
+def _shutdown() -> None:
+    _filter_stats.stop()
 
 
 def _get_model() -> SentenceTransformer:
@@ -30,25 +104,81 @@ def _get_model() -> SentenceTransformer:
 
 
 def _embed(text: str) -> tuple[list[float], float, float]:
+    vecs, latency_ms, norms = _embed_many([text])
+    return vecs[0], latency_ms, norms[0]
+
+
+def _embed_many(texts: list[str]) -> tuple[list[list[float]], float, list[float]]:
+    """
+    One model forward pass for all `texts`. Returns (vectors, total latency ms, vector norms).
+    Vectors are projected with EMBED_PROJECTION if set; norms are the model's own.
+    """
     t0 = time.perf_counter()
-    vec = _get_model().encode([text], normalize_embeddings=True)[0]
-    t1 = time.perf_counter()
+    vecs = _get_model().encode(texts, normalize_embeddings=True)
 
-    vec = np.asarray(vec, dtype=np.float32)
-    if vec.shape != (EMBED_DIM,):
+    vecs = np.asarray(vecs, dtype=np.float32)
+    if vecs.shape != (len(texts), EMBED_DIM):
         raise ValueError(
-            f"Embedding dim mismatch: model returned {vec.shape}, expected ({EMBED_DIM},). "
+            f"Embedding dim mismatch: model returned {vecs.shape[1:]}, expected ({EMBED_DIM},). "
             f"Check EMBED_MODEL/EMBED_DIM and Vespa schema tensor dimension."
         )
 
-    norm = float(np.linalg.norm(vec))
-    return vec.tolist(), (t1 - t0) * 1000.0, norm
+    norms = np.linalg.norm(vecs, axis=1)
+    if _projection is not None:
+        vecs = _projection.apply(vecs)
+    t1 = time.perf_counter()
+    return vecs.tolist(), (t1 - t0) * 1000.0, [float(n) for n in norms]
+
+
+def _fetch_chunks(chunk_ids: list[str], transfer: dict[str, float]) -> dict[str, dict[str, Any]]:
+    """
+    Second phase of a two-phase search: chunk fields for `chunk_ids` in one query.
+    Adds response bytes / latency to `transfer`.
+    """
+    yql = f"select {_HIT_FIELDS} from sources chunk where {chunk_cache.yql_in('chunk_id', chunk_ids)};"
+    t0 = time.perf_counter()
+    r = requests.post(
+        f"{VESPA_URL}/search/",
+        json={"yql": yql, "hits": len(chunk_ids), "ranking.profile": "unranked"},
+        timeout=30,
+    )
+    transfer["fetch_latency_ms"] += (time.perf_counter() - t0) * 1000.0
+    transfer["fetch_bytes"] += len(r.content)
+    r.raise_for_status()
+    out: dict[str, dict[str, Any]] = {}
+    for h in ((r.json().get("root") or {}).get("children") or []):
+        fields = h.get("fields") or {}
+        if fields.get("chunk_id"):
+            out[fields["chunk_id"]] = {k: fields.get(k) for k in ("tenant_id", "source", "text")}
+    return out
+
+
+def _shadow_recall(nn_field: str, profile: str, vec: list[float], hits: int, used: int, approx_ids: list[str]) -> None:
+    """
+    Ground truth for the targetHits controller: the same search run exactly, compared by top-`hits` ids.
+    """
+    recall = None
+    try:
+        yql = f"select * from sources chunk where ({{targetHits:{hits}, approximate:false}}nearestNeighbor({nn_field}, q));"
+        req = {"yql": yql, "hits": hits, "ranking.profile": profile, "input.query(q)": vec, "presentation.summary": "ids"}
+        r = requests.post(f"{VESPA_URL}/search/", json=req, timeout=60)
+        r.raise_for_status()
+        exact = [(h.get("fields") or {}).get("chunk_id") for h in ((r.json().get("root") or {}).get("children") or [])]
+        recall = target_hits.recall_at_k(approx_ids, exact)
+    except Exception as e:
+        print(f"[target_hits] shadow search failed: {type(e).__name__}: {e}", file=sys.stderr)
+    finally:
+        _target_hits.shadow_done(used, recall)
 
 
 def _append_log(record: dict[str, Any]) -> None:
+    _append_logs([record])
+
+
+def _append_logs(records: list[dict[str, Any]]) -> None:
     os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
     with open(LOG_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
 
 
 @app.get("/health")
@@ -59,20 +189,130 @@ def health() -> dict[str, Any]:
         "vespa_namespace": VESPA_NAMESPACE,
         "embed_model": EMBED_MODEL,
         "embed_dim": EMBED_DIM,
+        "projection": _projection.info() if _projection is not None else None,
+        "batch": {"max_queries": BATCH_MAX_QUERIES, "fanout": BATCH_FANOUT},
+        "target_hits": {"default": TARGET_HITS_DEFAULT, **_target_hits.stats()},
+        "planner": {
+            "default": PLANNER_DEFAULT,
+            "total_docs": _filter_stats.total,
+            "values": {a: len(v) for a, v in _filter_stats.counts.items()},
+            "stats_age_s": _filter_stats.age_s(),
+        },
     }
 
 
 @app.post("/search")
-def search(payload: dict[str, Any]) -> dict[str, Any]:
+def search(payload: dict[str, Any], request: Request) -> dict[str, Any]:
+    with tracer.span("search", traceparent=request.headers.get("traceparent")):
+        return _search(payload)
+
+
+@app.post("/search/batch")
+def search_batch(payload: dict[str, Any], request: Request) -> dict[str, Any]:
+    with tracer.span("search_batch", traceparent=request.headers.get("traceparent")):
+        return _search_batch(payload)
+
+
+def _search_batch(payload: dict[str, Any]) -> dict[str, Any]:
+    """
+    Many /search payloads in one call:
+      {
+        "queries": [{"query": "...", "tenant_id": "t1"}, {"query": "...", "mode": "hybrid", "keyword": "chmod"}],
+        "defaults": {"hits": 5, "target_hits": 50},   # merged under every query payload
+        "concurrency": 4                               # Vespa searches in flight (max BATCH_FANOUT)
+      }
+
+    All queries are embedded in ONE model call, then searched concurrently. `results` are in input
+    order; an invalid payload gets {"error": ...} in its place. Log records are written together,
+    sharing a `batch_id`.
+    """
+    queries = payload.get("queries")
+    if not isinstance(queries, list) or not queries:
+        return {"error": "Missing 'queries' (a non-empty list of /search payloads)."}
+    if len(queries) > BATCH_MAX_QUERIES:
+        return {"error": f"Too many queries ({len(queries)} > BATCH_MAX_QUERIES={BATCH_MAX_QUERIES})."}
+    defaults = payload.get("defaults") or {}
+    if not isinstance(defaults, dict):
+        return {"error": "'defaults' must be an object (a /search payload)."}
+    try:
+        concurrency = max(1, min(int(payload.get("concurrency") or BATCH_FANOUT), BATCH_FANOUT))
+    except (TypeError, ValueError):
+        return {"error": "concurrency must be a number."}
+    batch_id = payload.get("batch_id") or str(uuid.uuid4())
+
+    t_start = time.perf_counter()
+    parsed = [
+        _parse_search({**defaults, **(q if isinstance(q, dict) else {"query": q})})
+        if isinstance(q, (dict, str))
+        else {"error": "Each query must be a /search payload (object) or a query string."}
+        for q in queries
+    ]
+    valid = [i for i, p in enumerate(parsed) if "error" not in p]
+
+    results: list[dict[str, Any]] = [p if "error" in p else {} for p in parsed]
+    log_records: list[dict[str, Any]] = []
+    embed_ms = 0.0
+    if valid:
+        with tracer.span("embed", model=EMBED_MODEL, batch_size=len(valid)):
+            vecs, embed_ms, norms = _embed_many([parsed[i]["raw_query"] for i in valid])
+        # Each query is charged its share of the batched forward pass.
+        per_query_embed_ms = embed_ms / len(valid)
+
+        def run_one(i: int, vec: list[float], norm: float) -> tuple[dict[str, Any], dict[str, Any]]:
+            t0 = time.perf_counter()
+            with tracer.span("search", request_id=parsed[i]["request_id"], mode=parsed[i]["mode"]):
+                response, record = _run_search(parsed[i], vec, per_query_embed_ms, norm)
+            response["latency_ms"] = (time.perf_counter() - t0) * 1000.0
+            return response, record
+
+        # At most `concurrency` searches in flight; contextvars copied so spans nest under this batch.
+        pending: dict[Future[tuple[dict[str, Any], dict[str, Any]]], int] = {}
+        todo = list(zip(valid, vecs, norms))
+        done_records: dict[int, dict[str, Any]] = {}
+        while todo or pending:
+            while todo and len(pending) < concurrency:
+                i, vec, norm = todo.pop(0)
+                pending[_batch_pool.submit(contextvars.copy_context().run, run_one, i, vec, norm)] = i
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                i = pending.pop(fut)
+                try:
+                    results[i], done_records[i] = fut.result()
+                except Exception as e:
+                    results[i] = {"request_id": parsed[i]["request_id"], "ok": False, "error": f"{type(e).__name__}: {e}"}
+        for i in sorted(done_records):
+            done_records[i]["batch_id"] = batch_id
+            log_records.append(done_records[i])
+
+    if log_records:
+        _append_logs(log_records)
+
+    span = tracing.current_span()
+    if span is not None:
+        span.set(batch_id=batch_id, queries=len(queries), valid=len(valid), concurrency=concurrency)
+
+    return {
+        "batch_id": batch_id,
+        "count": len(results),
+        "errors": sum(1 for r in results if r.get("error")),
+        "embed_batch_ms": embed_ms,
+        "total_latency_ms": (time.perf_counter() - t_start) * 1000.0,
+        "results": results,
+    }
+
+
+def _search(payload: dict[str, Any]) -> dict[str, Any]:
     """
     Payload (examples):
       {
         "query": "docker daemon not running",
         "mode": "vector",
         "hits": 5,
-        "target_hits": 50,
+        "target_hits": 50,         # or "auto": the adaptive controller's current value (see /health)
         "tenant_id": "t1",
-        "source": "docs"
+        "source": "docs",
+        "fetch": "full",           # or "two_phase": ids-only search + local chunk-text cache
+        "plan": "auto"             # or "fixed": always target_hits, approximate, Vespa defaults
       }
 
       {
@@ -83,23 +323,104 @@ def search(payload: dict[str, Any]) -> dict[str, Any]:
         "target_hits": 50
       }
     """
+    p = _parse_search(payload)
+    if "error" in p:
+        return p
+
+    root = tracing.current_span()
+    if root is not None:
+        root.set(
+            request_id=p["request_id"], mode=p["mode"], hits=p["hits"], target_hits=p["target_hits"],
+            tenant_id=p["tenant_id"] or None,
+        )
+
+    with tracer.span("embed", model=EMBED_MODEL, query_chars=len(p["raw_query"])):
+        vec, embed_latency_ms, vec_norm = _embed(p["raw_query"])
+
+    response, log_record = _run_search(p, vec, embed_latency_ms, vec_norm)
+    if root is not None:
+        root.set(hit_count=len(response["hits"]))
+    _append_log(log_record)
+    return response
+
+
+def _parse_search(payload: dict[str, Any]) -> dict[str, Any]:
+    """
+    Validated /search parameters, or {"error": ...}.
+    """
     request_id = payload.get("request_id") or str(uuid.uuid4())
-    raw_query = (payload.get("query") or "").strip()
+    raw_query = payload.get("query") or ""
+    if not isinstance(raw_query, str):
+        return {"error": "'query' must be a string."}
+    raw_query = raw_query.strip()
     if not raw_query:
         return {"error": "Missing 'query'."}
 
-    mode = (payload.get("mode") or "vector").strip().lower()
+    # Batch items come straight from the client: check types here, so a bad item gets its own error.
+    text: dict[str, str] = {}
+    for key, default in (
+        ("mode", "vector"),
+        ("fetch", "full"),
+        ("plan", PLANNER_DEFAULT),
+        ("tenant_id", ""),
+        ("source", ""),
+        ("keyword", ""),
+    ):
+        value = payload.get(key) or default
+        if not isinstance(value, str):
+            return {"error": f"'{key}' must be a string."}
+        text[key] = value.strip()
+
+    mode = text["mode"].lower()
     if mode not in ("vector", "hybrid"):
         return {"error": "mode must be 'vector' or 'hybrid'."}
 
-    hits = int(payload.get("hits") or 5)
-    target_hits = int(payload.get("target_hits") or 50)
+    fetch = text["fetch"].lower()
+    if fetch not in ("full", "two_phase"):
+        return {"error": "fetch must be 'full' or 'two_phase'."}
+
+    plan_mode = text["plan"].lower()
+    if plan_mode not in ("fixed", "auto"):
+        return {"error": "plan must be 'fixed' or 'auto'."}
+
+    try:
+        hits = int(payload.get("hits") or 5)
+    except (TypeError, ValueError):
+        return {"error": "hits must be a number."}
+    target_hits_auto = str(payload.get("target_hits") or TARGET_HITS_DEFAULT).strip().lower() == "auto"
+    try:
+        target_hits = max(hits, _target_hits.current) if target_hits_auto else int(payload.get("target_hits") or TARGET_HITS_DEFAULT)
+    except (TypeError, ValueError):
+        return {"error": "target_hits must be a number or 'auto'."}
+
+    tenant_id, source, keyword = text["tenant_id"], text["source"], text["keyword"]
+
+    return {
+        "request_id": request_id,
+        "raw_query": raw_query,
+        "mode": mode,
+        "fetch": fetch,
+        "plan": plan_mode,
+        "hits": hits,
+        "target_hits": target_hits,
+        "target_hits_auto": target_hits_auto,
+        "tenant_id": tenant_id,
+        "source": source,
+        "keyword": keyword,
+    }
 
-    tenant_id = (payload.get("tenant_id") or "").strip()
-    source = (payload.get("source") or "").strip()
-    keyword = (payload.get("keyword") or "").strip()
 
-    vec, embed_latency_ms, vec_norm = _embed(raw_query)
+def _run_search(
+    p: dict[str, Any], vec: list[float], embed_latency_ms: float, vec_norm: float
+) -> tuple[dict[str, Any], dict[str, Any]]:
+    """
+    Everything after the embedding: plan, Vespa search, optional chunk fetch.
+    Returns (response, log record).
+    """
+    request_id, raw_query, mode, fetch = p["request_id"], p["raw_query"], p["mode"], p["fetch"]
+    hits, target_hits = p["hits"], p["target_hits"]
+    tenant_id, source, keyword = p["tenant_id"], p["source"], p["keyword"]
+    slim = fetch == "two_phase"
 
     where_parts: list[str] = []
     if tenant_id:
@@ -113,34 +434,68 @@ def search(payload: dict[str, Any]) -> dict[str, Any]:
     if where_parts:
         where_prefix = " and ".join(where_parts) + " and "
 
+    nn_field, profile = ("embedding_reduced", f"{mode}_reduced") if _projection is not None else ("embedding", mode)
+
+    if p["plan"] == "auto":
+        with tracer.span("plan") as span:
+            qplan = planner.plan(
+                _filter_stats,
+                {"tenant_id": tenant_id, "source": source},
+                keyword if mode == "hybrid" else None,
+                hits,
+                target_hits,
+                PLANNER_EXACT_MAX_DOCS,
+                PLANNER_POSTFILTER_MIN,
+                PLANNER_FILTER_FIRST_THRESHOLD,
+            )
+            span.set(strategy=qplan.strategy, est_matches=qplan.est_matches, planned_target_hits=qplan.target_hits)
+    else:
+        qplan = planner.QueryPlan("fixed", target_hits, True, None, None)
+
     yql = (
-        "select chunk_id, doc_id, tenant_id, source, text "
+        f"select {'*' if slim else _HIT_FIELDS} "
         f"from sources chunk where {where_prefix}"
-        f"({{targetHits:{target_hits}}}nearestNeighbor(embedding, q));"
+        f"({qplan.nn_annotation()}nearestNeighbor({nn_field}, q));"
     )
 
     req = {
         "yql": yql,
         "hits": hits,
-        "ranking.profile": mode,
+        "ranking.profile": profile,
         "input.query(q)": vec,
     }
-
-    t0 = time.perf_counter()
-    r = requests.post(f"{VESPA_URL}/search/", json=req, timeout=30)
-    t1 = time.perf_counter()
-
-    retrieval_latency_ms = (t1 - t0) * 1000.0
-    ok = r.ok
-
-    body: dict[str, Any]
-    try:
-        body = r.json()
-    except Exception:
-        body = {"raw": r.text}
+    if slim:
+        req["presentation.summary"] = "ids"
+    req.update(qplan.params)
+
+    with tracer.span("vespa_search", mode=mode, hits=hits, target_hits=qplan.target_hits, plan=qplan.strategy) as span:
+        req.update(tracing.vespa_query_params(span))
+        t0 = time.perf_counter()
+        r = requests.post(f"{VESPA_URL}/search/", json=req, headers={"traceparent": span.traceparent}, timeout=30)
+        t1 = time.perf_counter()
+
+        retrieval_latency_ms = (t1 - t0) * 1000.0
+        ok = r.ok
+        span.set(response_bytes=len(r.content))
+
+        body: dict[str, Any]
+        try:
+            body = r.json()
+        except Exception:
+            body = {"raw": r.text}
+        tracing.record_vespa_response(span, body)
+        span.set(http_status=r.status_code)
 
     hits_out: list[dict[str, Any]] = []
     children = (((body or {}).get("root") or {}).get("children") or []) if ok else []
+
+    # Only plain approximate vector searches teach the controller: filters and hybrid ranking change
+    # both latency and what "recall" means.
+    if ok and mode == "vector" and not where_parts and qplan.approximate:
+        _target_hits.observe_latency(qplan.target_hits, retrieval_latency_ms)
+        if _target_hits.shadow_due():
+            approx_ids = [(h.get("fields") or {}).get("chunk_id") for h in children]
+            _shadow_pool.submit(_shadow_recall, nn_field, profile, vec, hits, qplan.target_hits, approx_ids)
     for h in children:
         fields = h.get("fields") or {}
         hits_out.append(
@@ -155,8 +510,19 @@ def search(payload: dict[str, Any]) -> dict[str, Any]:
             }
         )
 
+    transfer = {"search_bytes": len(r.content), "fetch_bytes": 0, "fetch_latency_ms": 0.0}
+    if slim and hits_out:
+        with tracer.span("fetch_chunks", hits=len(hits_out)) as span:
+            ids = [h["chunk_id"] for h in hits_out if h.get("chunk_id")]
+            found, fetched = _chunk_cache.resolve(ids, lambda missing: _fetch_chunks(missing, transfer))
+            for h in hits_out:
+                h.update(found.get(h.get("chunk_id") or "", {}))
+            transfer.update(cache_hits=len(ids) - len(fetched), fetched=len(fetched))
+            span.set(**transfer)
+
     log_record = {
         "request_id": request_id,
+        "trace_id": tracing.current_trace_id(),
         "timestamp_ms": int(time.time() * 1000),
         "raw_query": raw_query,
         "final_query": raw_query,
@@ -164,6 +530,7 @@ def search(payload: dict[str, Any]) -> dict[str, Any]:
         "embedding": {
             "model": EMBED_MODEL,
             "dim": EMBED_DIM,
+            "projection": _projection.name if _projection is not None else None,
             "vector_norm": vec_norm,
             "latency_ms": embed_latency_ms,
         },
@@ -174,9 +541,13 @@ def search(payload: dict[str, Any]) -> dict[str, Any]:
             "keyword": keyword or None,
             "hits": hits,
             "target_hits": target_hits,
+            "target_hits_auto": p["target_hits_auto"],
             "yql": yql,
             "latency_ms": retrieval_latency_ms,
             "http_status": r.status_code,
+            "fetch": fetch,
+            "transfer": transfer,
+            "plan": qplan.to_dict(),
         },
         "results": [
             {
@@ -188,18 +559,21 @@ def search(payload: dict[str, Any]) -> dict[str, Any]:
         ],
     }
 
-    _append_log(log_record)
-
-    return {
+    response = {
         "request_id": request_id,
+        "trace_id": tracing.current_trace_id(),
         "ok": ok,
         "http_status": r.status_code,
         "embed_latency_ms": embed_latency_ms,
         "retrieval_latency_ms": retrieval_latency_ms,
+        "fetch": fetch,
+        "transfer": transfer,
+        "plan": qplan.to_dict(),
         "yql": yql,
         "hits": hits_out,
         "error": None if ok else body,
     }
+    return response, log_record
 
 
 
@@ -0,0 +1,194 @@
+"""
+Filter-selectivity-aware planning for filtered nearestNeighbor queries.
+
+Vespa's HNSW search with a filter behaves very differently depending on how much of the corpus the
+filter keeps:
+  - very selective (a small tenant): the graph walk visits many nodes to find enough matches, while
+    an exact scan over the few matching documents is cheap  -> approximate:false
+  - selective: pre-filtered HNSW, but let Vespa switch to its filter-first exploration early
+  - broad (most documents match): post-filtering is cheaper, with targetHits raised so enough
+    hits survive the filter
+  - no filter: plain HNSW
+
+The planner estimates the fraction of documents a request's filters keep from per-attribute value
+counts (Vespa grouping queries, refreshed in the background) and keyword document frequencies
+(`limit 0` count queries, cached), assuming filters are independent.
+"""
+
+from __future__ import annotations
+
+import math
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+import requests
+
+FILTER_ATTRIBUTES = ("tenant_id", "source")
+
+
+@dataclass
+class QueryPlan:
+    strategy: str  # unfiltered | exact | prefilter | postfilter
+    target_hits: int
+    approximate: bool
+    est_selectivity: float | None
+    est_matches: int | None
+    params: dict[str, Any] = field(default_factory=dict)  # extra Vespa query parameters
+    stats_age_s: float | None = None
+
+    def nn_annotation(self) -> str:
+        if self.approximate:
+            return f"{{targetHits:{self.target_hits}}}"
+        return f"{{targetHits:{self.target_hits}, approximate:false}}"
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+class FilterStats:
+    """
+    Document counts per value of each filter attribute, plus the total, from one grouping query.
+    """
+
+    def __init__(self, vespa_url: str, refresh_s: float, keyword_ttl_s: float = 300.0, max_keywords: int = 1000) -> None:
+        self.vespa_url = vespa_url.rstrip("/")
+        self.refresh_s = refresh_s
+        self.keyword_ttl_s = keyword_ttl_s
+        self.max_keywords = max_keywords
+        self.total: int | None = None
+        self.counts: dict[str, dict[str, int]] = {}
+        self.refreshed_at: float | None = None
+        self._keywords: dict[str, tuple[float, int]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name="planner-stats", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[planner] stats refresh failed: {type(e).__name__}: {e}", file=sys.stderr)
+            self._stop.wait(self.refresh_s)
+
+    def refresh(self) -> None:
+        groups = " ".join(
+            f"all(group({a}) max(10000) each(output(count())))" for a in FILTER_ATTRIBUTES
+        )
+        yql = f"select * from sources chunk where true limit 0 | all({groups});"
+        r = requests.post(f"{self.vespa_url}/search/", json={"yql": yql}, timeout=30)
+        r.raise_for_status()
+        root = r.json().get("root") or {}
+
+        counts: dict[str, dict[str, int]] = {a: {} for a in FILTER_ATTRIBUTES}
+        for group_root in root.get("children") or []:
+            for grouplist in group_root.get("children") or []:
+                attr = str(grouplist.get("label") or grouplist.get("id", "").split(":")[-1])
+                if attr not in counts:
+                    continue
+                for g in grouplist.get("children") or []:
+                    counts[attr][str(g.get("value"))] = int((g.get("fields") or {}).get("count()") or 0)
+
+        with self._lock:
+            self.total = int((root.get("fields") or {}).get("totalCount") or 0)
+            self.counts = counts
+            self.refreshed_at = time.time()
+            self._keywords.clear()
+
+    def keyword_count(self, keyword: str) -> int | None:
+        """
+        Documents whose text contains `keyword` (cached for keyword_ttl_s).
+        """
+        now = time.time()
+        with self._lock:
+            hit = self._keywords.get(keyword)
+        if hit is not None and now - hit[0] < self.keyword_ttl_s:
+            return hit[1]
+        try:
+            r = requests.post(
+                f"{self.vespa_url}/search/",
+                json={"yql": "select * from sources chunk where text contains @kw limit 0;", "kw": keyword},
+                timeout=5,
+            )
+            r.raise_for_status()
+            n = int(((r.json().get("root") or {}).get("fields") or {}).get("totalCount") or 0)
+        except Exception:
+            return None
+        with self._lock:
+            if len(self._keywords) >= self.max_keywords:
+                self._keywords.clear()
+            self._keywords[keyword] = (now, n)
+        return n
+
+    def selectivity(self, filters: dict[str, str], keyword: str | None) -> tuple[float | None, int | None]:
+        """
+        Estimated (fraction of documents kept, matching documents); (None, None) before the first refresh.
+        """
+        with self._lock:
+            total, counts = self.total, self.counts
+        if not total:
+            return None, None
+        frac = 1.0
+        for attr, value in filters.items():
+            if value:
+                frac *= counts.get(attr, {}).get(value, 0) / total
+        if keyword:
+            n = self.keyword_count(keyword)
+            if n is not None:
+                frac *= n / total
+        return frac, int(round(frac * total))
+
+    def age_s(self) -> float | None:
+        return None if self.refreshed_at is None else time.time() - self.refreshed_at
+
+
+def plan(
+    stats: FilterStats,
+    filters: dict[str, str],
+    keyword: str | None,
+    hits: int,
+    target_hits: int,
+    exact_max_docs: int,
+    postfilter_min_selectivity: float,
+    filter_first_threshold: float,
+) -> QueryPlan:
+    """
+    Choose targetHits / approximate / Vespa filter thresholds for one request.
+    `target_hits` is the requested recall budget; it is never lowered below `hits`.
+    """
+    target_hits = max(hits, target_hits)
+    if not any(filters.values()) and not keyword:
+        return QueryPlan("unfiltered", target_hits, True, 1.0, stats.total, stats_age_s=stats.age_s())
+
+    frac, matches = stats.selectivity(filters, keyword)
+    age = stats.age_s()
+    if frac is None or matches is None:
+        # No statistics yet: leave it to Vespa's defaults.
+        return QueryPlan("prefilter", target_hits, True, None, None, stats_age_s=age)
+
+    if matches <= exact_max_docs:
+        # Brute-force distance over the few matching docs beats walking the graph looking for them.
+        return QueryPlan("exact", min(target_hits, max(hits, matches)), False, frac, matches, stats_age_s=age)
+
+    if frac >= postfilter_min_selectivity:
+        # Most documents pass: search HNSW unfiltered, drop non-matches afterwards. Ask for enough extra
+        # candidates that about target_hits survive the filter.
+        boosted = int(math.ceil(target_hits / max(frac, 1e-6)))
+        params = {"ranking.matching.postFilterThreshold": round(frac - 0.01, 4)}
+        return QueryPlan("postfilter", boosted, True, frac, matches, params, age)
+
+    # Pre-filtered HNSW; below filter_first_threshold, let Vespa use filter-first exploration so the
+    # walk does not stall in regions where no node passes the filter.
+    params = {
+        "ranking.matching.approximateThreshold": round(min(0.05, exact_max_docs / max(stats.total or 1, 1)), 6),
+        "ranking.matching.filterFirstThreshold": filter_first_threshold,
+    }
+    return QueryPlan("prefilter", target_hits, True, frac, matches, params, age)
@@ -0,0 +1,362 @@
+"""
+Incremental analytics over the lab's request log (`requests.jsonl`, written by `_append_log`).
+
+The log only grows, so each run continues from the byte offset saved in a state file and only parses
+the records appended since, merging them into the aggregates kept in the same file. Memory stays
+constant however large the log gets:
+  - latency percentiles come from log-bucketed histograms (1% relative error) instead of raw values
+  - "slowest queries" is a fixed-size heap
+  - groups are keyed by (mode, target_hits, which filters were set), not by filter values
+
+Reports:
+  - p50/p95/p99 of embed, retrieval and total latency per group
+  - zero-hit rate per group and per tenant (a typical over-filtering symptom) and the Vespa error rate
+  - requests per tenant
+  - the slowest queries
+
+  docker compose exec lab python tools/analyze_log.py
+  docker compose exec lab python tools/analyze_log.py --out /logs/analysis.json --top 20
+  docker compose exec lab python tools/analyze_log.py --reset       # start over from byte 0
+
+If the log was truncated or replaced (its size is below the saved offset, or its first bytes changed),
+the state is discarded and the whole file is read again.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import heapq
+import json
+import math
+import os
+import time
+from typing import Any, Iterator
+
+LATENCIES = ("embed", "retrieval", "total")
+_HEAD_BYTES = 4096
+
+
+class LogHistogram:
+    """
+    Streaming quantiles with bounded relative error: value v goes to bucket ceil(log_gamma(v)).
+    Size grows with log(max/min), not with the number of values.
+    """
+
+    def __init__(self, rel_acc: float = 0.01) -> None:
+        self.rel_acc = rel_acc
+        self.gamma = (1.0 + rel_acc) / (1.0 - rel_acc)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, v: float) -> None:
+        self.count += 1
+        self.max = max(self.max, v)
+        if v <= 0.0:
+            self.zeros += 1
+            return
+        k = math.ceil(math.log(v) / self._log_gamma)
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if rank < seen:
+                return 2.0 * self.gamma**k / (self.gamma + 1.0)
+        return self.max
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "rel_acc": self.rel_acc,
+            "buckets": {str(k): n for k, n in self.buckets.items()},
+            "zeros": self.zeros,
+            "count": self.count,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict[str, Any]) -> "LogHistogram":
+        h = cls(d.get("rel_acc", 0.01))
+        h.buckets = {int(k): int(n) for k, n in (d.get("buckets") or {}).items()}
+        h.zeros = int(d.get("zeros", 0))
+        h.count = int(d.get("count", 0))
+        h.max = float(d.get("max", 0.0))
+        return h
+
+
+class Stats:
+    """
+    Counters + latency histograms for one group (or one tenant).
+    """
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.zero_hits = 0
+        self.errors = 0
+        self.latency = {name: LogHistogram() for name in LATENCIES}
+
+    def add(self, lat: dict[str, float], hit_count: int, ok: bool) -> None:
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        elif hit_count == 0:
+            self.zero_hits += 1
+        for name, v in lat.items():
+            self.latency[name].add(v)
+
+    def report(self) -> dict[str, Any]:
+        ok = self.requests - self.errors
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "zero_hit_rate": (self.zero_hits / ok) if ok else None,
+            "latency_ms": {
+                name: {
+                    "p50": h.quantile(0.50),
+                    "p95": h.quantile(0.95),
+                    "p99": h.quantile(0.99),
+                    "max": h.max if h.count else None,
+                }
+                for name, h in self.latency.items()
+            },
+        }
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "zero_hits": self.zero_hits,
+            "errors": self.errors,
+            "latency": {name: h.to_dict() for name, h in self.latency.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict[str, Any]) -> "Stats":
+        s = cls()
+        s.requests = int(d.get("requests", 0))
+        s.zero_hits = int(d.get("zero_hits", 0))
+        s.errors = int(d.get("errors", 0))
+        for name, h in (d.get("latency") or {}).items():
+            s.latency[name] = LogHistogram.from_dict(h)
+        return s
+
+
+class Analysis:
+    def __init__(self, top: int) -> None:
+        self.top = top
+        self.offset = 0
+        self.head_sha1: str | None = None
+        self.records = 0
+        self.bad_lines = 0
+        self.first_ts: int | None = None
+        self.last_ts: int | None = None
+        self.overall = Stats()
+        self.groups: dict[str, Stats] = {}
+        self.tenants: dict[str, Stats] = {}
+        self.slowest: list[tuple[float, str, dict[str, Any]]] = []  # min-heap of (total_ms, request_id, summary)
+
+    def add(self, rec: dict[str, Any]) -> None:
+        retrieval = rec.get("retrieval") or {}
+        filters = rec.get("filters") or {}
+        transfer = retrieval.get("transfer") or {}
+        embed_ms = float((rec.get("embedding") or {}).get("latency_ms") or 0.0)
+        retrieval_ms = float(retrieval.get("latency_ms") or 0.0) + float(transfer.get("fetch_latency_ms") or 0.0)
+        lat = {"embed": embed_ms, "retrieval": retrieval_ms, "total": embed_ms + retrieval_ms}
+        hit_count = len(rec.get("results") or [])
+        ok = retrieval.get("http_status") in (None, 200)
+
+        set_filters = [k for k in ("tenant_id", "source") if filters.get(k)]
+        if retrieval.get("keyword"):
+            set_filters.append("keyword")
+        key = f"mode={retrieval.get('mode')} target_hits={retrieval.get('target_hits')} filters={'+'.join(set_filters) or 'none'}"
+
+        self.records += 1
+        ts = rec.get("timestamp_ms")
+        if isinstance(ts, int):
+            self.first_ts = ts if self.first_ts is None else min(self.first_ts, ts)
+            self.last_ts = ts if self.last_ts is None else max(self.last_ts, ts)
+        self.overall.add(lat, hit_count, ok)
+        self.groups.setdefault(key, Stats()).add(lat, hit_count, ok)
+        tenant = filters.get("tenant_id") or "(none)"
+        self.tenants.setdefault(tenant, Stats()).add(lat, hit_count, ok)
+
+        entry = (
+            lat["total"],
+            str(rec.get("request_id") or ""),
+            {
+                "request_id": rec.get("request_id"),
+                "timestamp_ms": ts,
+                "query": (rec.get("raw_query") or "")[:200],
+                "group": key,
+                "tenant_id": filters.get("tenant_id"),
+                "hits": hit_count,
+                "latency_ms": lat,
+            },
+        )
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, entry)
+        elif entry[0] > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "records": self.records,
+            "bad_lines": self.bad_lines,
+            "bytes_read": self.offset,
+            "first_timestamp_ms": self.first_ts,
+            "last_timestamp_ms": self.last_ts,
+            "overall": self.overall.report(),
+            "groups": {k: s.report() for k, s in sorted(self.groups.items(), key=lambda kv: -kv[1].requests)},
+            "tenants": {k: s.report() for k, s in sorted(self.tenants.items(), key=lambda kv: -kv[1].requests)},
+            "slowest": [e[2] for e in sorted(self.slowest, key=lambda e: -e[0])],
+        }
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "offset": self.offset,
+            "head_sha1": self.head_sha1,
+            "records": self.records,
+            "bad_lines": self.bad_lines,
+            "first_ts": self.first_ts,
+            "last_ts": self.last_ts,
+            "overall": self.overall.to_dict(),
+            "groups": {k: s.to_dict() for k, s in self.groups.items()},
+            "tenants": {k: s.to_dict() for k, s in self.tenants.items()},
+            "slowest": [list(e) for e in self.slowest],
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict[str, Any], top: int) -> "Analysis":
+        a = cls(top)
+        a.offset = int(d.get("offset", 0))
+        a.head_sha1 = d.get("head_sha1")
+        a.records = int(d.get("records", 0))
+        a.bad_lines = int(d.get("bad_lines", 0))
+        a.first_ts = d.get("first_ts")
+        a.last_ts = d.get("last_ts")
+        a.overall = Stats.from_dict(d.get("overall") or {})
+        a.groups = {k: Stats.from_dict(v) for k, v in (d.get("groups") or {}).items()}
+        a.tenants = {k: Stats.from_dict(v) for k, v in (d.get("tenants") or {}).items()}
+        a.slowest = [(float(e[0]), str(e[1]), e[2]) for e in d.get("slowest") or []]
+        heapq.heapify(a.slowest)
+        while len(a.slowest) > top:
+            heapq.heappop(a.slowest)
+        return a
+
+
+def head_sha1(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read(_HEAD_BYTES)).hexdigest()
+
+
+def iter_new_lines(path: str, offset: int) -> Iterator[tuple[bytes, int]]:
+    """
+    Complete lines after `offset`, with the offset just past each line. A trailing line without a
+    newline is still being written: it is left for the next run.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                return
+            offset += len(line)
+            yield line, offset
+
+
+def load_state(path: str, top: int) -> Analysis:
+    if not os.path.exists(path):
+        return Analysis(top)
+    with open(path, "r", encoding="utf-8") as f:
+        return Analysis.from_dict(json.load(f), top)
+
+
+def save_state(path: str, a: Analysis) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(a.to_dict(), f)
+    os.replace(tmp, path)
+
+
+def print_report(r: dict[str, Any], new_records: int, elapsed_s: float) -> None:
+    def ms(v: float | None) -> str:
+        return "-" if v is None else f"{v:7.1f}"
+
+    def rate(v: float | None) -> str:
+        return "-" if v is None else f"{v:6.1%}"
+
+    print(f"records={r['records']} (+{new_records} new in {elapsed_s:.1f}s)  bad_lines={r['bad_lines']}  bytes={r['bytes_read']}")
+    o = r["overall"]
+    print(f"errors={o['errors']}  zero_hit_rate={rate(o['zero_hit_rate'])}")
+    print()
+    print(f"{'group':<52} {'n':>7} {'zero':>7} {'emb p50':>8} {'ret p50':>8} {'ret p95':>8} {'ret p99':>8} {'tot p99':>8}")
+    for key, g in r["groups"].items():
+        lat = g["latency_ms"]
+        print(
+            f"{key:<52} {g['requests']:>7} {rate(g['zero_hit_rate']):>7} {ms(lat['embed']['p50']):>8} "
+            f"{ms(lat['retrieval']['p50']):>8} {ms(lat['retrieval']['p95']):>8} {ms(lat['retrieval']['p99']):>8} "
+            f"{ms(lat['total']['p99']):>8}"
+        )
+    print()
+    print(f"{'tenant':<20} {'n':>7} {'zero':>7} {'tot p50':>8} {'tot p95':>8}")
+    for tenant, t in r["tenants"].items():
+        lat = t["latency_ms"]["total"]
+        print(f"{tenant:<20} {t['requests']:>7} {rate(t['zero_hit_rate']):>7} {ms(lat['p50']):>8} {ms(lat['p95']):>8}")
+    print()
+    print("slowest:")
+    for s in r["slowest"]:
+        print(f"  {ms(s['latency_ms']['total'])}ms  hits={s['hits']:<3} {s['group']}  {s['query'][:60]!r}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--log", default="/logs/requests.jsonl")
+    ap.add_argument("--state", help="Offset + aggregates between runs (default: <log>.analysis.json)")
+    ap.add_argument("--reset", action="store_true", help="Ignore the saved state and read the whole log")
+    ap.add_argument("--top", type=int, default=10, help="How many slowest queries to keep")
+    ap.add_argument("--out", help="Write the report as JSON here")
+    args = ap.parse_args()
+    state_path = args.state or args.log + ".analysis.json"
+
+    a = Analysis(args.top) if args.reset else load_state(state_path, args.top)
+    size = os.path.getsize(args.log)
+    head = head_sha1(args.log)
+    if size < a.offset or (a.head_sha1 is not None and a.head_sha1 != head and a.offset >= _HEAD_BYTES):
+        print("Log was truncated or replaced; starting over.")
+        a = Analysis(args.top)
+    a.head_sha1 = head if size >= _HEAD_BYTES else None
+
+    t0 = time.perf_counter()
+    before = a.records
+    for line, offset in iter_new_lines(args.log, a.offset):
+        a.offset = offset
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rec = json.loads(line)
+            if not isinstance(rec, dict) or "retrieval" not in rec:
+                raise ValueError("not a /search record")
+            a.add(rec)
+        except (json.JSONDecodeError, UnicodeDecodeError, TypeError, ValueError):
+            a.bad_lines += 1
+    elapsed = time.perf_counter() - t0
+
+    save_state(state_path, a)
+    report = a.report()
+    print_report(report, a.records - before, elapsed)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compare full-text search responses with two-phase fetch (ids-only search + chunk-text cache).
+
+For every eval query, calls /search with "fetch": "full" and "fetch": "two_phase" for a few rounds
+and reports bytes received from Vespa and Vespa-side latency (search + fetch) per mode.
+Round 1 of two_phase is mostly cache misses; later rounds show the warm-cache case.
+
+  docker compose exec lab python tools/bench_fetch.py --hits 20 --rounds 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+from typing import Any
+
+import requests
+
+LAB_URL = os.environ.get("LAB_URL", "http://localhost:8000")
+
+
+def call_search(payload: dict[str, Any]) -> dict[str, Any]:
+    r = requests.post(f"{LAB_URL}/search", json=payload, timeout=60)
+    r.raise_for_status()
+    return r.json()
+
+
+def p95(values: list[float]) -> float:
+    s = sorted(values)
+    return s[min(len(s) - 1, int(0.95 * len(s)))]
+
+
+def run_mode(queries: list[str], fetch: str, hits: int, target_hits: int, rounds: int) -> list[dict[str, Any]]:
+    out = []
+    for rnd in range(1, rounds + 1):
+        for q in queries:
+            resp = call_search(
+                {"query": q, "mode": "vector", "hits": hits, "target_hits": target_hits, "tenant_id": "t1", "fetch": fetch}
+            )
+            t = resp.get("transfer") or {}
+            out.append(
+                {
+                    "round": rnd,
+                    "bytes": t.get("search_bytes", 0) + t.get("fetch_bytes", 0),
+                    "latency_ms": resp.get("retrieval_latency_ms", 0.0) + t.get("fetch_latency_ms", 0.0),
+                    "cache_hits": t.get("cache_hits", 0),
+                    "fetched": t.get("fetched", 0),
+                }
+            )
+    return out
+
+
+def summarize(name: str, rows: list[dict[str, Any]]) -> dict[str, Any]:
+    lat = [r["latency_ms"] for r in rows]
+    hits = sum(r["cache_hits"] for r in rows)
+    fetched = sum(r["fetched"] for r in rows)
+    res = {
+        "mode": name,
+        "requests": len(rows),
+        "avg_bytes": statistics.mean(r["bytes"] for r in rows),
+        "p50_ms": statistics.median(lat),
+        "p95_ms": p95(lat),
+        "cache_hit_ratio": (hits / (hits + fetched)) if (hits + fetched) else None,
+    }
+    ratio = "-" if res["cache_hit_ratio"] is None else f"{res['cache_hit_ratio']:.0%}"
+    print(
+        f"{name:<22} requests={res['requests']:<4} avg_bytes={res['avg_bytes']:>9.0f} "
+        f"p50={res['p50_ms']:6.1f}ms p95={res['p95_ms']:6.1f}ms cache_hits={ratio}"
+    )
+    return res
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--eval", default="/data/eval_queries.json")
+    ap.add_argument("--hits", type=int, default=20)
+    ap.add_argument("--target-hits", type=int, default=50)
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--out", help="Write the summary as JSON here")
+    args = ap.parse_args()
+
+    with open(args.eval, "r", encoding="utf-8") as f:
+        queries = [item["query"] for item in json.load(f)]
+
+    full = run_mode(queries, "full", args.hits, args.target_hits, args.rounds)
+    two_phase = run_mode(queries, "two_phase", args.hits, args.target_hits, args.rounds)
+
+    results = [
+        summarize("full", full),
+        summarize("two_phase (all)", two_phase),
+        summarize("two_phase (round 1)", [r for r in two_phase if r["round"] == 1]),
+        summarize("two_phase (warm)", [r for r in two_phase if r["round"] > 1] or two_phase),
+    ]
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
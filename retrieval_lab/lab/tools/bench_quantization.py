@@ -0,0 +1,225 @@
+"""
+Compare the float, int8 and binary embedding fields: memory per document, recall@k against exact
+float search, and query latency.
+
+Needs chunks fed with the compact variants (ingest_sample.py does this by default, `--variants`).
+Queries are the eval queries plus the first sentence of a sample of stored chunks. The ground truth
+for each query is an exact (approximate:false) float nearestNeighbor search.
+
+  docker compose exec lab python tools/bench_quantization.py --k 10 --sample 200
+  docker compose exec lab python tools/bench_quantization.py --out /logs/quantization.json
+
+Footprint per document, for the layout each mode is deployed with: float is vespa/app (float vectors
+and their HNSW graph in memory); int8 / binary are vespa/app-compact (compact vectors and their graph
+in memory, the float vectors paged to disk and only read for rescoring). So each mode's total is
+compact + graph + float:
+
+  memory_bytes   vector cells (float 4*D, int8 D, binary D/8) + HNSW graph estimate
+  paged_bytes    float vectors of a compact mode (4*D), on disk and in the page cache while read
+  total_bytes    memory_bytes + paged_bytes
+
+`measured_bytes_per_doc` is what Vespa reports, when its metrics API is reachable at VESPA_CONFIG_URL,
+for the attributes the mode reads (its ANN field plus `embedding`) in the package that is deployed now.
+Compare latencies with vespa/app deployed, where all three fields have an HNSW index; in app-compact
+the float mode runs as an exact search.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import statistics
+import time
+from typing import Any
+
+import numpy as np
+import requests
+from rag_common import quantize
+from sentence_transformers import SentenceTransformer
+
+VESPA_URL = os.environ.get("VESPA_URL", "http://vespa:8080")
+VESPA_CONFIG_URL = os.environ.get("VESPA_CONFIG_URL", "http://vespa:19071")
+EMBED_MODEL = os.environ.get("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_DIM = int(os.environ.get("EMBED_DIM", "384"))
+
+MODES = ("float", "int8", "binary")
+# max-links-per-node of the HNSW indexes in the chunk schemas.
+MAX_LINKS = 16
+
+
+def graph_bytes(max_links: int = MAX_LINKS) -> int:
+    """
+    Rough HNSW graph memory per document: up to 2*max_links 4-byte links on level 0, about 1/max_links
+    of that again for the upper levels, and ~16 bytes of node bookkeeping.
+    """
+    return 2 * max_links * 4 + 8 + 16
+
+
+def footprint(mode: str, dim: int) -> dict[str, Any]:
+    """
+    Estimated bytes per document for `mode` in its deployment layout (see the module docstring).
+    """
+    vector = quantize.bytes_per_vector(dim, mode)
+    graph = graph_bytes()
+    paged = 0 if mode == "float" else quantize.bytes_per_vector(dim, "float")
+    return {
+        "vector_bytes": vector,
+        "graph_bytes": graph,
+        "memory_bytes": vector + graph,
+        "paged_bytes": paged,
+        "total_bytes": vector + graph + paged,
+    }
+
+
+def vespa_search(req: dict[str, Any]) -> tuple[list[str], float, float | None]:
+    """
+    (chunk ids in rank order, client latency ms, Vespa search time ms).
+    """
+    t0 = time.perf_counter()
+    r = requests.post(f"{VESPA_URL}/search/", json={**req, "presentation.timing": True}, timeout=60)
+    latency_ms = (time.perf_counter() - t0) * 1000.0
+    r.raise_for_status()
+    body = r.json()
+    ids = [(h.get("fields") or {}).get("chunk_id") for h in ((body.get("root") or {}).get("children") or [])]
+    search_s = (body.get("timing") or {}).get("searchtime")
+    return [i for i in ids if i], latency_ms, (search_s * 1000.0 if search_s is not None else None)
+
+
+def nn_request(vec: list[float], mode: str, k: int, target_hits: int, exact: bool = False) -> dict[str, Any]:
+    field, query_input = quantize.FIELDS[mode], quantize.QUERY_INPUTS[mode]
+    ann = f"{{targetHits:{target_hits}, approximate:false}}" if exact else f"{{targetHits:{target_hits}}}"
+    req: dict[str, Any] = {
+        "yql": f"select chunk_id from sources chunk where ({ann}nearestNeighbor({field}, {query_input}));",
+        "hits": k,
+        "ranking.profile": quantize.RANK_PROFILES[mode],
+    }
+    req["input.query(q)"] = vec  # float search, or float rescoring of the compact candidates
+    if mode != "float":
+        req[f"input.query({query_input})"] = quantize.encode(vec, mode)
+    return req
+
+
+def sample_queries(n: int) -> list[str]:
+    r = requests.post(
+        f"{VESPA_URL}/search/",
+        json={"yql": "select text from sources chunk where true;", "hits": n, "ranking.profile": "unranked"},
+        timeout=60,
+    )
+    r.raise_for_status()
+    out = []
+    for h in (r.json().get("root") or {}).get("children") or []:
+        text = ((h.get("fields") or {}).get("text") or "").strip()
+        first = re.split(r"(?<=[.!?])\s+|\n+", text, maxsplit=1)[0].strip()
+        if first:
+            out.append(first[:300])
+    return out
+
+
+def attribute_bytes() -> tuple[dict[str, float], int | None]:
+    """
+    Allocated bytes per attribute field and the document count, from Vespa's metrics API ({} if unavailable).
+    """
+    try:
+        r = requests.get(f"{VESPA_CONFIG_URL}/metrics/v2/values", timeout=10)
+        r.raise_for_status()
+        body = r.json()
+    except Exception:
+        return {}, None
+    by_field: dict[str, float] = {}
+    docs: int | None = None
+    for node in body.get("nodes") or []:
+        for service in node.get("services") or []:
+            for m in service.get("metrics") or []:
+                values = m.get("values") or {}
+                dims = m.get("dimensions") or {}
+                field = dims.get("field") or dims.get("attribute")
+                for name, v in values.items():
+                    if field and name.endswith("attribute.memory_usage.allocated_bytes.average"):
+                        by_field[field] = by_field.get(field, 0.0) + float(v)
+                    elif name == "content.proton.documentdb.documents.total.last":
+                        docs = max(docs or 0, int(v))
+    return by_field, docs
+
+
+def p95(values: list[float]) -> float:
+    s = sorted(values)
+    return s[min(len(s) - 1, int(0.95 * len(s)))]
+
+
+def fmt(v: float | None, spec: str) -> str:
+    return "-" if v is None else format(v, spec)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--eval", default="/data/eval_queries.json")
+    ap.add_argument("--sample", type=int, default=200, help="Stored chunks to turn into extra queries")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--target-hits", type=int, default=100)
+    ap.add_argument("--out", help="Write the results as JSON here")
+    args = ap.parse_args()
+
+    with open(args.eval, "r", encoding="utf-8") as f:
+        queries = [item["query"] for item in json.load(f)]
+    queries += sample_queries(args.sample)
+
+    model = SentenceTransformer(EMBED_MODEL)
+    vecs = np.asarray(model.encode(queries, normalize_embeddings=True), dtype=np.float32).tolist()
+
+    truth = [vespa_search(nn_request(v, "float", args.k, args.k, exact=True))[0] for v in vecs]
+    attr_bytes, doc_count = attribute_bytes()
+
+    results = []
+    print(f"{len(queries)} queries, k={args.k}, target_hits={args.target_hits}")
+    print(
+        f"{'mode':<8} {'mem B/doc':>9} {'paged B/doc':>11} {'total B/doc':>11} {'measured':>9} "
+        f"{'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} {'vespa p50':>10}"
+    )
+    for mode in MODES:
+        recalls, lat, search_ms = [], [], []
+        for v, want in zip(vecs, truth):
+            try:
+                got, ms, sms = vespa_search(nn_request(v, mode, args.k, args.target_hits))
+            except requests.HTTPError as e:
+                print(f"{mode}: search failed ({e}); was the corpus fed with --variants {mode}?")
+                break
+            if want:
+                recalls.append(len(set(got[: args.k]) & set(want)) / len(want))
+            lat.append(ms)
+            if sms is not None:
+                search_ms.append(sms)
+        if not lat:
+            continue
+        field = quantize.FIELDS[mode]
+        fields = {field, quantize.FIELDS["float"]}
+        measured = (
+            sum(attr_bytes[f] for f in fields) / doc_count if doc_count and fields <= attr_bytes.keys() else None
+        )
+        est = footprint(mode, EMBED_DIM)
+        res = {
+            "mode": mode,
+            "field": field,
+            **est,
+            "measured_bytes_per_doc": measured,
+            "recall_at_k": statistics.mean(recalls) if recalls else None,
+            "p50_ms": statistics.median(lat),
+            "p95_ms": p95(lat),
+            "vespa_search_p50_ms": statistics.median(search_ms) if search_ms else None,
+        }
+        results.append(res)
+        print(
+            f"{mode:<8} {est['memory_bytes']:>9} {est['paged_bytes']:>11} {est['total_bytes']:>11} "
+            f"{fmt(measured, '.0f'):>9} {fmt(res['recall_at_k'], '.3f'):>9} "
+            f"{res['p50_ms']:8.1f} {res['p95_ms']:8.1f} {fmt(res['vespa_search_p50_ms'], '.1f'):>10}"
+        )
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "queries": len(queries), "results": results}, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,12 +8,25 @@ from typing import Any
 import requests
 
 LAB_URL = os.environ.get("LAB_URL", "http://localhost:8000")
-
-
-def call_search(payload: dict[str, Any]) -> dict[str, Any]:
-    r = requests.post(f"{LAB_URL}/search", json=payload, timeout=60)
-    r.raise_for_status()
-    return r.json()
+# Queries per /search/batch call; must not exceed the lab's BATCH_MAX_QUERIES.
+BATCH_SIZE = int(os.environ.get("BATCH_MAX_QUERIES", "256"))
+
+
+def call_search_batch(payloads: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    # The lab embeds each call's queries together and runs the searches concurrently.
+    results: list[dict[str, Any]] = []
+    for start in range(0, len(payloads), BATCH_SIZE):
+        chunk = payloads[start : start + BATCH_SIZE]
+        r = requests.post(f"{LAB_URL}/search/batch", json={"queries": chunk}, timeout=300)
+        r.raise_for_status()
+        data = r.json()
+        if data.get("error"):
+            raise RuntimeError(f"/search/batch failed: {data['error']}")
+        for i, res in enumerate(data["results"], start=start):
+            if res.get("error"):
+                raise RuntimeError(f"/search/batch query {i} ({payloads[i]['query']!r}) failed: {res['error']}")
+        results.extend(data["results"])
+    return results
 
 
 def recall_at_k(retrieved_doc_ids: list[str], relevant_doc_ids: set[str], k: int) -> float:
@@ -60,12 +73,10 @@ def eval_config(name: str, mode: str, target_hits: int, keyword: str | None, k:
     recalls = []
     ndcgs = []
 
+    payloads: list[dict[str, Any]] = []
     for item in eval_items:
-        q = item["query"]
-        relevant = set(item["relevant_doc_ids"])
-
         payload: dict[str, Any] = {
-            "query": q,
+            "query": item["query"],
             "mode": mode,
             "hits": k,
             "target_hits": target_hits,
@@ -73,8 +84,10 @@ def eval_config(name: str, mode: str, target_hits: int, keyword: str | None, k:
         }
         if keyword:
             payload["keyword"] = keyword
+        payloads.append(payload)
 
-        resp = call_search(payload)
+    for item, resp in zip(eval_items, call_search_batch(payloads)):
+        relevant = set(item["relevant_doc_ids"])
         retrieved = [h.get("doc_id") for h in (resp.get("hits") or []) if h.get("doc_id")]
 
         recalls.append(recall_at_k(retrieved, relevant, k))
@@ -9,12 +9,15 @@ from typing import Any, Iterable
 
 import numpy as np
 import requests
+from rag_common import projection, quantize
+from rag_common.chunking import Chunker, HFTokenizer, WhitespaceTokenizer
 from sentence_transformers import SentenceTransformer
 
 VESPA_URL = os.environ.get("VESPA_URL", "http://vespa:8080")
 VESPA_NAMESPACE = os.environ.get("VESPA_NAMESPACE", "lab")
 EMBED_MODEL = os.environ.get("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 EMBED_DIM = int(os.environ.get("EMBED_DIM", "384"))
+EMBED_PROJECTION = os.environ.get("EMBED_PROJECTION", "")
 
 
 @dataclass
@@ -46,46 +49,26 @@ def load_docs(path: str) -> list[Doc]:
     return docs
 
 
-def chunk_fixed(text: str, chunk_words: int, overlap_words: int) -> list[str]:
-    words = text.split()
-    if not words:
-        return []
-    out: list[str] = []
-    i = 0
-    while i < len(words):
-        j = min(len(words), i + chunk_words)
-        out.append(" ".join(words[i:j]).strip())
-        if j >= len(words):
-            break
-        i = max(0, j - overlap_words)
-    return [c for c in out if c]
-
-
-def chunk_structure_aware(text: str, chunk_words: int, overlap_words: int) -> list[str]:
+def make_chunker(
+    model: SentenceTransformer,
+    chunking: str,
+    tokenizer: str,
+    chunk_words: int,
+    overlap_words: int,
+    chunk_tokens: int,
+    overlap_tokens: int,
+) -> Chunker:
     """
-    Simple structure-aware chunker:
-    - splits on markdown headings "## " if present
-    - falls back to fixed chunking
+    tokenizer="model" budgets chunks in the embedding model's own tokens (capped at its window,
+    so nothing is silently truncated at encode time); "words" keeps the old word budget.
     """
-    if "\n## " not in text:
-        return chunk_fixed(text, chunk_words, overlap_words)
-
-    parts = []
-    current = []
-    for line in text.splitlines():
-        if line.startswith("## "):
-            if current:
-                parts.append("\n".join(current).strip())
-                current = []
-        current.append(line)
-    if current:
-        parts.append("\n".join(current).strip())
-
-    # Each section can still be long: apply fixed chunking per section
-    out: list[str] = []
-    for p in parts:
-        out.extend(chunk_fixed(p, chunk_words, overlap_words))
-    return [c for c in out if c]
+    structure = chunking == "structure"
+    if tokenizer == "words":
+        return Chunker(WhitespaceTokenizer(), chunk_words, overlap_words, structure=structure)
+
+    tok = HFTokenizer(model.tokenizer, model_max_tokens=model.max_seq_length)
+    max_tokens = min(chunk_tokens, tok.max_tokens) if chunk_tokens > 0 else tok.max_tokens
+    return Chunker(tok, max_tokens, overlap_tokens, structure=structure)
 
 
 def embed_texts(model: SentenceTransformer, texts: list[str]) -> list[list[float]]:
@@ -110,20 +93,21 @@ def feed_chunks(chunks: Iterable[dict[str, Any]]) -> None:
 
 def iter_chunks(
     docs: list[Doc],
-    chunking: str,
-    chunk_words: int,
-    overlap_words: int,
+    chunker: Chunker,
     model: SentenceTransformer,
+    variants: tuple[str, ...] = (),
+    proj: projection.Projection | None = None,
 ) -> Iterable[dict[str, Any]]:
     for d in docs:
         text = (d.title + "\n\n" + d.body).strip()
-        if chunking == "fixed":
-            parts = chunk_fixed(text, chunk_words, overlap_words)
-        else:
-            parts = chunk_structure_aware(text, chunk_words, overlap_words)
+        parts = [c.text for c in chunker.chunk_text(text)]
+        if not parts:
+            continue
 
         vecs = embed_texts(model, parts)
+        reduced = proj.apply(vecs).tolist() if proj is not None else None
         for idx, (t, v) in enumerate(zip(parts, vecs, strict=True)):
+            extra = {"embedding_reduced": reduced[idx]} if reduced is not None else {}
             yield {
                 "chunk_id": f"{d.doc_id}::chunk-{idx}",
                 "doc_id": d.doc_id,
@@ -131,6 +115,8 @@ def iter_chunks(
                 "source": d.source,
                 "text": t,
                 "embedding": v,
+                **quantize.variant_fields(v, variants),
+                **extra,
             }
 
 
@@ -138,30 +124,60 @@ def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("--docs", default="/data/docs.jsonl")
     ap.add_argument("--chunking", choices=["fixed", "structure"], default="fixed")
-    ap.add_argument("--chunk-words", type=int, default=140)
-    ap.add_argument("--overlap-words", type=int, default=25)
+    ap.add_argument("--chunk-words", type=int, help="Words per chunk (implies --tokenizer words; default 140)")
+    ap.add_argument("--overlap-words", type=int, help="Words of overlap (implies --tokenizer words; default 25)")
+    ap.add_argument(
+        "--tokenizer",
+        choices=["model", "words"],
+        help="Budget chunks in embedding-model tokens (default) or in whitespace words",
+    )
+    ap.add_argument("--chunk-tokens", type=int, default=200, help="0 = the model's full window")
+    ap.add_argument("--overlap-tokens", type=int, default=32)
+    ap.add_argument(
+        "--variants",
+        default="int8,binary",
+        help='Compact embedding copies to feed too (embedding_int8 / embedding_bits); "" for float only',
+    )
+    ap.add_argument(
+        "--projection",
+        default=EMBED_PROJECTION,
+        help="Projection artifact (tools/reduce_dims.py) to also feed embedding_reduced; default EMBED_PROJECTION",
+    )
     args = ap.parse_args()
+    word_flags = args.chunk_words is not None or args.overlap_words is not None
+    if word_flags and args.tokenizer == "model":
+        ap.error("--chunk-words / --overlap-words need --tokenizer words; use --chunk-tokens / --overlap-tokens")
+    # Older invocations pass only the word flags: keep budgeting those in words.
+    args.tokenizer = args.tokenizer or ("words" if word_flags else "model")
+    args.chunk_words = 140 if args.chunk_words is None else args.chunk_words
+    args.overlap_words = 25 if args.overlap_words is None else args.overlap_words
+    variants = quantize.parse_variants(args.variants)
+    proj = projection.load(args.projection) if args.projection else None
 
     t0 = time.perf_counter()
     docs = load_docs(args.docs)
     model = SentenceTransformer(EMBED_MODEL)
-
-    chunks = list(
-        iter_chunks(
-            docs=docs,
-            chunking="fixed" if args.chunking == "fixed" else "structure",
-            chunk_words=args.chunk_words,
-            overlap_words=args.overlap_words,
-            model=model,
-        )
+    chunker = make_chunker(
+        model,
+        chunking=args.chunking,
+        tokenizer=args.tokenizer,
+        chunk_words=args.chunk_words,
+        overlap_words=args.overlap_words,
+        chunk_tokens=args.chunk_tokens,
+        overlap_tokens=args.overlap_tokens,
     )
 
+    chunks = list(iter_chunks(docs=docs, chunker=chunker, model=model, variants=variants, proj=proj))
+
     feed_chunks(chunks)
     t1 = time.perf_counter()
 
     print(
         f"Fed {len(chunks)} chunks from {len(docs)} docs "
-        f"using chunking={args.chunking} in {(t1 - t0):.2f}s"
+        f"using chunking={args.chunking} tokenizer={args.tokenizer} "
+        f"(max_tokens={chunker.max_tokens}, overlap={chunker.overlap_tokens}) "
+        f"variants={','.join(variants) or 'float only'} "
+        f"projection={proj.name if proj is not None else 'none'} in {(t1 - t0):.2f}s"
     )
     print(f"Vespa: {VESPA_URL} namespace={VESPA_NAMESPACE}")
 
@@ -0,0 +1,310 @@
+"""
+Open-loop load generator for retrieval-lab /search (or rag-api /v1/chat/completions).
+
+Requests are sent on a fixed arrival schedule (Poisson or evenly spaced at --qps), whether or not
+earlier requests have finished, so a slow server builds up a queue instead of quietly slowing the
+client down. End-to-end latency is measured from the *scheduled* send time for the same reason.
+
+Workload:
+  - replay of the lab's own request log (`_append_log` records: query, mode, filters, hits, ...)
+  - or a synthetic mix built from the eval queries (--synthetic)
+
+Reports throughput, error rate and p50/p95/p99/p99.9 of embed, retrieval and end-to-end latency,
+and writes them as JSON (--out) so runs can be compared across commits.
+
+  docker compose exec lab python tools/loadgen.py --qps 20 --duration 60 --out /logs/load.json
+  docker compose exec lab python tools/loadgen.py --synthetic --qps 50 --duration 30
+  python tools/loadgen.py --target rag-api --url http://localhost:8000 --qps 2 --duration 60
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+from typing import Any
+
+import httpx
+
+LAB_URL = os.environ.get("LAB_URL", "http://localhost:8000")
+RAG_API_URL = os.environ.get("RAG_API_URL", "http://localhost:8000")
+
+PERCENTILES = (50.0, 95.0, 99.0, 99.9)
+
+
+def load_trace(path: str) -> list[dict[str, Any]]:
+    """
+    /search payloads rebuilt from request log records (see `_append_log` in app/main.py).
+    """
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            query = rec.get("raw_query")
+            if not query:
+                continue
+            retrieval = rec.get("retrieval") or {}
+            filters = rec.get("filters") or {}
+            payload: dict[str, Any] = {
+                "query": query,
+                "mode": retrieval.get("mode") or "vector",
+                "hits": retrieval.get("hits") or 5,
+                "target_hits": "auto" if retrieval.get("target_hits_auto") else retrieval.get("target_hits") or 50,
+            }
+            for key, value in (
+                ("tenant_id", filters.get("tenant_id")),
+                ("source", filters.get("source")),
+                ("keyword", retrieval.get("keyword")),
+                ("fetch", retrieval.get("fetch")),
+            ):
+                if value:
+                    payload[key] = value
+            # Any strategy other than "fixed" was chosen by the planner ("plan": "auto").
+            strategy = (retrieval.get("plan") or {}).get("strategy")
+            if strategy:
+                payload["plan"] = "fixed" if strategy == "fixed" else "auto"
+            out.append(payload)
+    return out
+
+
+def synthetic_mix(eval_path: str, rng: random.Random, n: int) -> list[dict[str, Any]]:
+    """
+    n /search payloads: eval queries with a mix of modes, tenants and target_hits.
+    """
+    with open(eval_path, "r", encoding="utf-8") as f:
+        queries = [item["query"] for item in json.load(f)]
+    out = []
+    for _ in range(n):
+        q = rng.choice(queries)
+        payload: dict[str, Any] = {
+            "query": q,
+            "mode": "vector",
+            "hits": 5,
+            "target_hits": rng.choice([10, 50, 100]),
+            "tenant_id": rng.choice(["t1", "t1", "t1", "t2"]),
+        }
+        if rng.random() < 0.3:
+            payload["mode"] = "hybrid"
+            payload["keyword"] = max(q.split(), key=len).lower()
+        out.append(payload)
+    return out
+
+
+def to_chat_payload(p: dict[str, Any], model: str) -> dict[str, Any]:
+    return {"model": model, "messages": [{"role": "user", "content": p["query"]}]}
+
+
+def arrival_offsets(qps: float, duration_s: float, arrival: str, rng: random.Random) -> list[float]:
+    offsets: list[float] = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(qps) if arrival == "poisson" else 1.0 / qps
+        if t >= duration_s:
+            return offsets
+        offsets.append(t)
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    # Nearest-rank percentile.
+    if not values:
+        return None
+    s = sorted(values)
+    rank = max(1, int(-(-p * len(s) // 100)))
+    return s[min(len(s), rank) - 1]
+
+
+def latency_summary(values: list[float]) -> dict[str, Any]:
+    d: dict[str, Any] = {f"p{p:g}": percentile(values, p) for p in PERCENTILES}
+    d["mean"] = (sum(values) / len(values)) if values else None
+    d["max"] = max(values) if values else None
+    d["count"] = len(values)
+    return d
+
+
+def server_timings(target: str, body: dict[str, Any]) -> tuple[float | None, float | None]:
+    """
+    (embed_ms, retrieval_ms) as reported by the server.
+    """
+    if target == "lab":
+        return body.get("embed_latency_ms"), body.get("retrieval_latency_ms")
+    timings = ((body.get("rag_debug") or {}).get("timings_ms")) or {}
+    return timings.get("embed_ms"), timings.get("retrieve_ms")
+
+
+def response_ok(target: str, status: int, body: dict[str, Any]) -> bool:
+    """
+    rag-api reports a failed chat as HTTP 200 with "RAG error: ..." as the answer, so look at the content too.
+    """
+    if status != 200 or body.get("error") or body.get("ok", True) is False:
+        return False
+    if target == "lab":
+        return True
+    choices = body.get("choices") or [{}]
+    content = ((choices[0] or {}).get("message") or {}).get("content")
+    return isinstance(content, str) and not content.startswith("RAG error:")
+
+
+async def send_one(
+    client: httpx.AsyncClient,
+    url: str,
+    target: str,
+    payload: dict[str, Any],
+    scheduled: float,
+    results: list[dict[str, Any]],
+) -> None:
+    sent = time.perf_counter()
+    row: dict[str, Any] = {"scheduled": scheduled, "send_lag_ms": (sent - scheduled) * 1000.0}
+    try:
+        r = await client.post(url, json=payload)
+        body = r.json() if r.headers.get("content-type", "").startswith("application/json") else {}
+        row.update(status=r.status_code, ok=response_ok(target, r.status_code, body))
+        row["embed_ms"], row["retrieval_ms"] = server_timings(target, body)
+    except Exception as e:
+        row.update(status=None, ok=False, error=type(e).__name__)
+    done = time.perf_counter()
+    row["e2e_ms"] = (done - scheduled) * 1000.0
+    row["service_ms"] = (done - sent) * 1000.0
+    results.append(row)
+
+
+async def run(args: argparse.Namespace, workload: list[dict[str, Any]], rng: random.Random) -> dict[str, Any]:
+    url = args.url.rstrip("/") + ("/search" if args.target == "lab" else "/v1/chat/completions")
+    offsets = arrival_offsets(args.qps, args.warmup + args.duration, args.arrival, rng)
+    results: list[dict[str, Any]] = []
+    dropped = 0
+    in_flight: set[asyncio.Task[None]] = set()
+
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        for i, offset in enumerate(offsets):
+            scheduled = start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(in_flight) >= args.max_in_flight:
+                # Safety valve: never queue unboundedly inside the client. Counted as errors.
+                if offset >= args.warmup:
+                    dropped += 1
+                continue
+            payload = workload[i % len(workload)]
+            if args.target == "rag-api":
+                payload = to_chat_payload(payload, args.model)
+            task = asyncio.create_task(send_one(client, url, args.target, payload, scheduled, results))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        wall_s = time.perf_counter() - start
+
+    measured = [r for r in results if r["scheduled"] - start >= args.warmup]
+    errors = [r for r in measured if not r["ok"]]
+    ok_rows = [r for r in measured if r["ok"]]
+    window_s = max(1e-9, wall_s - args.warmup)
+    status_counts: dict[str, int] = {}
+    for r in measured:
+        key = str(r.get("status") or r.get("error"))
+        status_counts[key] = status_counts.get(key, 0) + 1
+
+    return {
+        "target": args.target,
+        "url": url,
+        "offered_qps": args.qps,
+        "sent": len(measured),
+        "dropped_client_side": dropped,
+        "throughput_qps": len(ok_rows) / window_s,
+        "error_rate": (len(errors) + dropped) / max(1, len(measured) + dropped),
+        "status_counts": status_counts,
+        "latency_ms": {
+            "e2e": latency_summary([r["e2e_ms"] for r in ok_rows]),
+            "service": latency_summary([r["service_ms"] for r in ok_rows]),
+            "embed": latency_summary([r["embed_ms"] for r in ok_rows if r.get("embed_ms") is not None]),
+            "retrieval": latency_summary([r["retrieval_ms"] for r in ok_rows if r.get("retrieval_ms") is not None]),
+            "send_lag": latency_summary([r["send_lag_ms"] for r in measured]),
+        },
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def print_summary(s: dict[str, Any]) -> None:
+    print(f"target={s['target']} url={s['url']}")
+    print(
+        f"offered={s['offered_qps']:.1f} qps  throughput={s['throughput_qps']:.1f} qps  "
+        f"sent={s['sent']}  dropped={s['dropped_client_side']}  error_rate={s['error_rate']:.2%}"
+    )
+    print(f"status: {s['status_counts']}")
+
+    def fmt(v: float | None) -> str:
+        return "-" if v is None else f"{v:8.1f}"
+
+    print(f"{'latency (ms)':<12} {'p50':>8} {'p95':>8} {'p99':>8} {'p99.9':>8} {'max':>8}")
+    for name, d in s["latency_ms"].items():
+        print(f"{name:<12} {fmt(d['p50'])} {fmt(d['p95'])} {fmt(d['p99'])} {fmt(d['p99.9'])} {fmt(d['max'])}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--target", choices=["lab", "rag-api"], default="lab")
+    ap.add_argument("--url", help="Base URL (default: LAB_URL or RAG_API_URL)")
+    ap.add_argument("--model", default="rag-ollama", help="Model name sent to rag-api")
+    ap.add_argument("--trace", default="/logs/requests.jsonl", help="Request log to replay")
+    ap.add_argument("--synthetic", action="store_true", help="Use a synthetic mix of eval queries instead of --trace")
+    ap.add_argument("--eval", default="/data/eval_queries.json")
+    ap.add_argument("--qps", type=float, default=10.0)
+    ap.add_argument("--duration", type=float, default=30.0, help="Measured seconds")
+    ap.add_argument("--warmup", type=float, default=5.0, help="Seconds sent first but left out of the results")
+    ap.add_argument("--arrival", choices=["poisson", "uniform"], default="poisson")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--max-in-flight", type=int, default=512)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--target-hits", help='Send this target_hits in every lab request (a number or "auto")')
+    ap.add_argument("--unfiltered", action="store_true", help="Drop tenant_id / source filters from every request")
+    ap.add_argument("--out", help="Write args + summary as JSON here")
+    args = ap.parse_args()
+    args.url = args.url or (LAB_URL if args.target == "lab" else RAG_API_URL)
+
+    rng = random.Random(args.seed)
+    if args.synthetic:
+        workload = synthetic_mix(args.eval, rng, 1000)
+    else:
+        workload = load_trace(args.trace)
+        if not workload:
+            raise SystemExit(f"No replayable requests in {args.trace}; run some queries first or use --synthetic.")
+    if args.target_hits:
+        override = args.target_hits if args.target_hits == "auto" else int(args.target_hits)
+        workload = [dict(p, target_hits=override) for p in workload]
+    if args.unfiltered:
+        workload = [{k: v for k, v in p.items() if k not in ("tenant_id", "source")} for p in workload]
+
+    summary = asyncio.run(run(args, workload, rng))
+    print_summary(summary)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(
+                {"commit": git_commit(), "timestamp_ms": int(time.time() * 1000), "args": vars(args), "results": summary},
+                f,
+                indent=2,
+            )
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
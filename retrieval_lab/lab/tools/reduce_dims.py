@@ -0,0 +1,221 @@
+"""
+Shrink embeddings with PCA or Matryoshka-style truncation (shared/rag_common/projection.py).
+
+  sweep  recall@k and scoring latency for each target dimension, measured offline on a sample of
+         stored embeddings (exact NumPy search in the reduced space vs. in the full space)
+  fit    fit / build one projection and save it as the next version in --out-dir
+  apply  write `embedding_reduced` into every stored chunk from its stored `embedding` (partial
+         updates, no re-embedding), so existing data matches the artifact
+
+  docker compose exec lab python tools/reduce_dims.py sweep --dims 32,64,128,192,256 --k 10
+  docker compose exec lab python tools/reduce_dims.py fit --method pca --dim 128
+  docker compose exec lab python tools/reduce_dims.py apply --projection /artifacts/pca-128-v1.npz
+
+Then set EMBED_PROJECTION to the same file for the lab (query time) and for ingest_sample.py. The
+`embedding_reduced` field in the schema has a fixed dimension (128); change it to match --dim.
+
+Truncation only keeps quality for models trained with Matryoshka loss (nomic-embed-text is,
+all-MiniLM-L6-v2 is not); the sweep shows the difference.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import time
+from typing import Any, Iterator
+
+import numpy as np
+import requests
+from rag_common import projection
+
+VESPA_URL = os.environ.get("VESPA_URL", "http://vespa:8080")
+VESPA_NAMESPACE = os.environ.get("VESPA_NAMESPACE", "lab")
+EMBED_MODEL = os.environ.get("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_DIM = int(os.environ.get("EMBED_DIM", "384"))
+ARTIFACT_DIR = os.environ.get("PROJECTION_DIR", "/artifacts")
+
+
+def _dense(value: Any) -> list[float] | None:
+    # Document API tensor renderings: [..], {"values": [..]}, {"cells": [{"address": .., "value": ..}]}.
+    if isinstance(value, dict):
+        if isinstance(value.get("values"), list):
+            value = value["values"]
+        elif isinstance(value.get("cells"), list):
+            cells = sorted(value["cells"], key=lambda c: int(next(iter((c.get("address") or {"x": 0}).values()))))
+            value = [c.get("value") for c in cells]
+    if isinstance(value, list) and value and all(isinstance(v, (int, float)) for v in value):
+        return [float(v) for v in value]
+    return None
+
+
+def visit(fields: str, limit: int | None = None, page: int = 500) -> Iterator[dict[str, Any]]:
+    """
+    Stored chunk documents ({"id": ..., "fields": {...}}) via the Document API, up to `limit`.
+    """
+    url = f"{VESPA_URL}/document/v1/{VESPA_NAMESPACE}/chunk/docid"
+    params: dict[str, Any] = {"wantedDocumentCount": page, "fieldSet": f"chunk:{fields}", "format.tensors": "short-value"}
+    seen = 0
+    while True:
+        r = requests.get(url, params=params, timeout=120)
+        r.raise_for_status()
+        body = r.json()
+        for doc in body.get("documents") or []:
+            yield doc
+            seen += 1
+            if limit is not None and seen >= limit:
+                return
+        if not body.get("continuation"):
+            return
+        params["continuation"] = body["continuation"]
+
+
+def sample_embeddings(n: int, with_text: bool = False) -> tuple[np.ndarray, list[str]]:
+    vecs, texts = [], []
+    for doc in visit("embedding,text" if with_text else "embedding", limit=n):
+        fields = doc.get("fields") or {}
+        v = _dense(fields.get("embedding"))
+        if v is None or len(v) != EMBED_DIM:
+            continue
+        vecs.append(v)
+        texts.append(str(fields.get("text") or ""))
+    if not vecs:
+        raise SystemExit(f"No {EMBED_DIM}-dim embeddings found at {VESPA_URL}; ingest first.")
+    return np.asarray(vecs, dtype=np.float32), texts
+
+
+def build(method: str, dim: int, sample: np.ndarray) -> projection.Projection:
+    if method == "pca":
+        return projection.fit_pca(sample, dim, model=EMBED_MODEL)
+    return projection.truncation(sample.shape[1], dim, model=EMBED_MODEL)
+
+
+def top_k(queries: np.ndarray, corpus: np.ndarray, k: int) -> tuple[np.ndarray, float]:
+    """
+    Exact top-k by cosine (inputs are unit length). Returns (indices, ms per query).
+    """
+    t0 = time.perf_counter()
+    scores = queries @ corpus.T
+    k = min(k, corpus.shape[0])
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    ms = (time.perf_counter() - t0) * 1000.0 / max(1, len(queries))
+    return idx, ms
+
+
+def recall(got: np.ndarray, want: np.ndarray) -> float:
+    return float(np.mean([len(set(g) & set(w)) / len(w) for g, w in zip(got, want)]))
+
+
+def query_vectors(eval_path: str, texts: list[str], n_from_corpus: int) -> np.ndarray:
+    from sentence_transformers import SentenceTransformer
+
+    queries = []
+    if eval_path and os.path.exists(eval_path):
+        with open(eval_path, "r", encoding="utf-8") as f:
+            queries = [item["query"] for item in json.load(f)]
+    # First sentence of some stored chunks: realistic queries with known close neighbours.
+    for text in texts[:n_from_corpus]:
+        first = re.split(r"(?<=[.!?])\s+|\n+", text.strip(), maxsplit=1)[0].strip()
+        if first:
+            queries.append(first[:300])
+    vecs = SentenceTransformer(EMBED_MODEL).encode(queries, normalize_embeddings=True)
+    return np.asarray(vecs, dtype=np.float32)
+
+
+def cmd_sweep(args: argparse.Namespace) -> None:
+    corpus, texts = sample_embeddings(args.sample, with_text=True)
+    queries = query_vectors(args.eval, texts, args.query_sample)
+    want, full_ms = top_k(queries, corpus, args.k)
+    print(f"{len(corpus)} stored vectors, {len(queries)} queries, k={args.k}")
+    print(f"{'method':<9} {'dim':>5} {'bytes':>6} {'recall@k':>9} {'ms/query':>9} {'expl.var':>9} {'fit s':>6}")
+    rows: list[dict[str, Any]] = [
+        {"method": "full", "dim": EMBED_DIM, "bytes": 4 * EMBED_DIM, "recall_at_k": 1.0, "ms_per_query": full_ms}
+    ]
+    print(f"{'full':<9} {EMBED_DIM:>5} {4 * EMBED_DIM:>6} {1.0:>9.3f} {full_ms:>9.3f} {'-':>9} {'-':>6}")
+    for method in args.methods.split(","):
+        for dim in sorted(int(d) for d in args.dims.split(",")):
+            if dim >= EMBED_DIM or (method == "pca" and dim > len(corpus)):
+                continue
+            t0 = time.perf_counter()
+            p = build(method, dim, corpus)
+            fit_s = time.perf_counter() - t0
+            got, ms = top_k(p.apply(queries), p.apply(corpus), args.k)
+            row = {
+                "method": method,
+                "dim": dim,
+                "bytes": 4 * dim,
+                "recall_at_k": recall(got, want),
+                "ms_per_query": ms,
+                "explained_variance": p.info().get("explained_variance"),
+                "fit_s": fit_s,
+            }
+            rows.append(row)
+            ev = "-" if row["explained_variance"] is None else f"{row['explained_variance']:.3f}"
+            print(
+                f"{method:<9} {dim:>5} {row['bytes']:>6} {row['recall_at_k']:>9.3f} {ms:>9.3f} {ev:>9} {fit_s:>6.2f}"
+            )
+    print("ms/query is exact NumPy scoring over the sample; HNSW latency scales less than linearly with dim.")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "corpus": len(corpus), "queries": len(queries), "results": rows}, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+def cmd_fit(args: argparse.Namespace) -> None:
+    sample, _ = sample_embeddings(args.sample)
+    p = build(args.method, args.dim, sample)
+    path = projection.save_versioned(p, args.out_dir)
+    print(f"Saved {path}: {json.dumps(p.info())}")
+
+
+def cmd_apply(args: argparse.Namespace) -> None:
+    p = projection.load(args.projection)
+    if p.in_dim != EMBED_DIM:
+        raise SystemExit(f"{p.name} projects {p.in_dim}-dim vectors, EMBED_DIM={EMBED_DIM}")
+    t0 = time.perf_counter()
+    updated = skipped = 0
+    with requests.Session() as s:
+        for doc in visit("embedding"):
+            v = _dense((doc.get("fields") or {}).get("embedding"))
+            doc_id = str(doc.get("id") or "").split("::", 1)[-1]
+            if v is None or len(v) != EMBED_DIM or not doc_id:
+                skipped += 1
+                continue
+            url = f"{VESPA_URL}/document/v1/{VESPA_NAMESPACE}/chunk/docid/{doc_id}"
+            r = s.put(url, json={"fields": {"embedding_reduced": {"assign": p.apply(v).tolist()}}}, timeout=30)
+            if not r.ok:
+                raise RuntimeError(f"Update failed for {doc_id}: {r.status_code} {r.text}")
+            updated += 1
+    print(f"Wrote embedding_reduced ({p.name}) to {updated} chunks, skipped {skipped}, in {time.perf_counter() - t0:.1f}s")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    sw = sub.add_parser("sweep", help="Recall / latency per target dimension")
+    sw.add_argument("--dims", default="32,64,96,128,192,256")
+    sw.add_argument("--methods", default="pca,truncate")
+    sw.add_argument("--sample", type=int, default=5000, help="Stored vectors to search over / fit on")
+    sw.add_argument("--query-sample", type=int, default=200, help="Stored chunks to turn into extra queries")
+    sw.add_argument("--eval", default="/data/eval_queries.json")
+    sw.add_argument("--k", type=int, default=10)
+    sw.add_argument("--out", help="Write the results as JSON here")
+
+    fit = sub.add_parser("fit", help="Build a projection and save it as a new versioned artifact")
+    fit.add_argument("--method", choices=projection.METHODS, default="pca")
+    fit.add_argument("--dim", type=int, default=128)
+    fit.add_argument("--sample", type=int, default=5000)
+    fit.add_argument("--out-dir", default=ARTIFACT_DIR)
+
+    app_ = sub.add_parser("apply", help="Write embedding_reduced into all stored chunks")
+    app_.add_argument("--projection", default=os.environ.get("EMBED_PROJECTION", ""), required=not os.environ.get("EMBED_PROJECTION"))
+
+    args = ap.parse_args()
+    {"sweep": cmd_sweep, "fit": cmd_fit, "apply": cmd_apply}[args.cmd](args)
+
+
+if __name__ == "__main__":
+    main()
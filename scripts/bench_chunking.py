@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Benchmark the shared offset-based chunker (shared/rag_common/chunking.py) against the legacy
+word-list chunkers it replaced (rag-api `_chunk_text`, retrieval-lab `chunk_fixed` /
+`chunk_structure_aware`, copied below verbatim as baselines).
+
+Generates synthetic markdown-ish text (default 100MB) and reports, per implementation:
+wall time, throughput, chunk count, and peak Python heap (with --trace-memory; slower).
+
+Example:
+  python scripts/bench_chunking.py --mb 100
+  python scripts/bench_chunking.py --mb 10 --trace-memory --out /tmp/chunk_bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+from typing import Callable, Iterator, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+
+from rag_common.chunking import ApproxSubwordTokenizer, Chunker, WhitespaceTokenizer  # noqa: E402
+
+
+# ---- legacy implementations (baselines) ----
+
+
+def legacy_chunk_fixed(text: str, chunk_words: int, overlap_words: int) -> List[str]:
+    words = text.split()
+    if not words:
+        return []
+    out: List[str] = []
+    i = 0
+    while i < len(words):
+        j = min(len(words), i + chunk_words)
+        out.append(" ".join(words[i:j]).strip())
+        if j >= len(words):
+            break
+        i = max(0, j - overlap_words)
+    return [c for c in out if c]
+
+
+def legacy_chunk_structure_aware(text: str, chunk_words: int, overlap_words: int) -> List[str]:
+    if "\n## " not in text:
+        return legacy_chunk_fixed(text, chunk_words, overlap_words)
+
+    parts = []
+    current = []
+    for line in text.splitlines():
+        if line.startswith("## "):
+            if current:
+                parts.append("\n".join(current).strip())
+                current = []
+        current.append(line)
+    if current:
+        parts.append("\n".join(current).strip())
+
+    out: List[str] = []
+    for p in parts:
+        out.extend(legacy_chunk_fixed(p, chunk_words, overlap_words))
+    return [c for c in out if c]
+
+
+# ---- corpus ----
+
+
+def make_text(n_bytes: int, seed: int) -> str:
+    rng = random.Random(seed)
+    vocab = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 11))) for _ in range(5000)]
+    parts: List[str] = []
+    size = 0
+    section = 0
+    while size < n_bytes:
+        if rng.random() < 0.02:
+            section += 1
+            line = f"\n## Section {section}\n"
+        else:
+            line = " ".join(rng.choice(vocab) for _ in range(rng.randint(5, 25))) + (".\n" if rng.random() < 0.3 else ". ")
+        parts.append(line)
+        size += len(line)
+    return "".join(parts)
+
+
+def pieces(text: str, size: int) -> Iterator[str]:
+    for i in range(0, len(text), size):
+        yield text[i : i + size]
+
+
+# ---- runner ----
+
+
+def run(name: str, fn: Callable[[], int], trace_memory: bool, text_bytes: int) -> dict:
+    if trace_memory:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    n_chunks = fn()
+    secs = time.perf_counter() - t0
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    res = {
+        "name": name,
+        "seconds": secs,
+        "mb_per_s": (text_bytes / 1e6) / secs if secs > 0 else None,
+        "chunks": n_chunks,
+        "peak_heap_mb": (peak / 1e6) if peak is not None else None,
+    }
+    peak_s = f"{res['peak_heap_mb']:.0f}MB" if peak is not None else "-"
+    print(f"{name:<44} {secs:8.2f}s {res['mb_per_s']:8.1f} MB/s {n_chunks:>9} chunks  peak={peak_s}")
+    return res
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mb", type=float, default=100.0, help="Size of the synthetic text in MB")
+    ap.add_argument("--chunk-words", type=int, default=220)
+    ap.add_argument("--overlap-words", type=int, default=40)
+    ap.add_argument("--max-tokens", type=int, default=300, help="Token budget for the approx-subword run")
+    ap.add_argument("--overlap-tokens", type=int, default=50)
+    ap.add_argument("--piece-bytes", type=int, default=1024 * 1024, help="Piece size for the streaming runs")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--trace-memory", action="store_true", help="Measure peak Python heap (much slower)")
+    ap.add_argument("--out", help="Write results as JSON here")
+    args = ap.parse_args()
+
+    text = make_text(int(args.mb * 1e6), args.seed)
+    n = len(text.encode("utf-8"))
+    print(f"text: {n / 1e6:.1f}MB, chunk_words={args.chunk_words}, overlap_words={args.overlap_words}")
+
+    cw, ov = args.chunk_words, args.overlap_words
+    words = Chunker(WhitespaceTokenizer(), cw, ov)
+    words_md = Chunker(WhitespaceTokenizer(), cw, ov, structure=True)
+    approx = Chunker(ApproxSubwordTokenizer(), args.max_tokens, args.overlap_tokens)
+
+    def count(it) -> int:
+        return sum(1 for _ in it)
+
+    results = [
+        run("legacy fixed (word list + join)", lambda: len(legacy_chunk_fixed(text, cw, ov)), args.trace_memory, n),
+        run("legacy structure-aware", lambda: len(legacy_chunk_structure_aware(text, cw, ov)), args.trace_memory, n),
+        run("offsets, words, whole text", lambda: count(words.iter_chunks([text])), args.trace_memory, n),
+        run("offsets, words, streamed pieces", lambda: count(words.iter_chunks(pieces(text, args.piece_bytes))), args.trace_memory, n),
+        run("offsets, words, markdown structure", lambda: count(words_md.iter_chunks(pieces(text, args.piece_bytes))), args.trace_memory, n),
+        run(
+            f"offsets, approx-subword {args.max_tokens}/{args.overlap_tokens} tokens",
+            lambda: count(approx.iter_chunks(pieces(text, args.piece_bytes))),
+            args.trace_memory,
+            n,
+        ),
+    ]
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"text_bytes": n, "args": vars(args), "results": results}, f, indent=2)
+        print(f"Wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,129 @@
+"""
+Bounded LRU cache of chunk fields (text, ...) keyed by chunk_id, for two-phase retrieval.
+
+Phase 1 asks Vespa only for ids + relevance through a slim document-summary (served from attributes,
+no chunk bodies on the wire). Phase 2 resolves the chunk fields here; ids not in the cache are fetched
+in ONE batched Vespa query (`chunk_id in (...)`, see `yql_in`) and cached for the next request.
+
+Bounded by entry count and by an approximate byte size, with a TTL as a safety net for chunks
+re-fed by another process (the writer in this process should call `invalidate`).
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable
+
+
+def _size(fields: dict[str, Any]) -> int:
+    n = 64
+    for v in fields.values():
+        if isinstance(v, str):
+            n += len(v)
+        elif isinstance(v, list):
+            n += 8 * len(v)
+        else:
+            n += 16
+    return n
+
+
+def yql_in(field: str, values: Iterable[str]) -> str:
+    """
+    `field in ("a", "b", ...)` for a string attribute, with quotes/backslashes escaped.
+    """
+    quoted = ", ".join('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values)
+    return f"{field} in ({quoted})"
+
+
+class ChunkCache:
+    def __init__(self, max_entries: int, max_bytes: int, ttl_s: float) -> None:
+        self.max_entries = max(0, max_entries)
+        self.max_bytes = max(0, max_bytes)
+        self.ttl_s = ttl_s
+        self._data: OrderedDict[str, tuple[float, int, dict[str, Any]]] = OrderedDict()  # id -> (stored_at, size, fields)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def get_many(self, ids: Iterable[str]) -> dict[str, dict[str, Any]]:
+        now = time.time()
+        out: dict[str, dict[str, Any]] = {}
+        with self._lock:
+            for cid in ids:
+                item = self._data.get(cid)
+                if item is None:
+                    self.misses += 1
+                    continue
+                stored_at, size, fields = item
+                if now - stored_at > self.ttl_s:
+                    self._drop(cid)
+                    self.misses += 1
+                    continue
+                self._data.move_to_end(cid)
+                out[cid] = fields
+                self.hits += 1
+        return out
+
+    def put_many(self, items: dict[str, dict[str, Any]]) -> None:
+        if self.max_entries == 0:
+            return
+        now = time.time()
+        with self._lock:
+            for cid, fields in items.items():
+                self._drop(cid)
+                size = _size(fields)
+                if size > self.max_bytes:
+                    continue
+                self._data[cid] = (now, size, fields)
+                self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._drop(oldest)
+
+    def invalidate(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for cid in ids:
+                self._drop(cid)
+
+    def resolve(
+        self,
+        ids: list[str],
+        fetch: Callable[[list[str]], dict[str, dict[str, Any]]],
+    ) -> tuple[dict[str, dict[str, Any]], list[str]]:
+        """
+        Fields for `ids`: from the cache, plus one `fetch(missing_ids)` call for the rest.
+        Returns (fields by id, ids that had to be fetched). Ids that `fetch` does not return are absent.
+        """
+        found = self.get_many(ids)
+        missing = [cid for cid in dict.fromkeys(ids) if cid not in found]
+        if missing:
+            fetched = fetch(missing)
+            self.put_many(fetched)
+            found.update(fetched)
+        return found, missing
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _drop(self, cid: str) -> None:
+        # Caller holds the lock.
+        item = self._data.pop(cid, None)
+        if item is not None:
+            self._bytes -= item[1]
@@ -0,0 +1,268 @@
+"""
+Offset-based, token-budgeted chunking shared by rag-api and retrieval-lab.
+
+The text is never split into a word list and re-joined per window. Instead, a tokenizer returns
+character spans `(start, end)` for each token, windows are formed over those spans, and a chunk's
+text is sliced from the source (`text[first.start:last.end]`) only when the chunk is emitted.
+Budgets are in tokenizer tokens, so with the embedding model's own tokenizer a chunk can never
+exceed the model window (and get silently truncated).
+
+Input can be a stream of text pieces (file blocks, PDF pages...): pieces are buffered, tokenized
+in whitespace-aligned segments, and the buffer is trimmed as chunks are emitted, so memory stays
+bounded by roughly one chunk plus one segment regardless of document size.
+
+Tokenizers:
+  WhitespaceTokenizer      one token per whitespace-separated word (the legacy "words" budget)
+  ApproxSubwordTokenizer   conservative estimate for WordPiece/BPE models when the real tokenizer
+                           is not available in-process (e.g. embeddings served by Ollama)
+  HFTokenizer              a Hugging Face fast tokenizer (e.g. SentenceTransformer(...).tokenizer)
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Any, Iterable, Iterator, Protocol
+
+_WS = re.compile(r"\s")
+_NON_WS = re.compile(r"\S+")
+_SUBWORD = re.compile(r"\w+|[^\w\s]")
+# Markdown ATX heading at the start of a line: "# Title", "## Title", ...
+_HEADING = re.compile(r"^#{1,6}[ \t]", re.MULTILINE)
+
+# Tokenize in segments of about this many characters (cut at whitespace).
+SEGMENT_CHARS = 64 * 1024
+
+
+class Tokenizer(Protocol):
+    def token_spans(self, text: str, start: int, end: int) -> list[tuple[int, int]]:
+        """
+        Character spans (s, e) of each token in text[start:end], as offsets into `text`, in order.
+        """
+        ...
+
+
+_span = re.Match.span
+
+
+class WhitespaceTokenizer:
+    def token_spans(self, text: str, start: int, end: int) -> list[tuple[int, int]]:
+        return list(map(_span, _NON_WS.finditer(text, start, end)))
+
+
+class ApproxSubwordTokenizer:
+    """
+    Upper-bound-ish token estimate for subword models: every punctuation mark is a token and
+    words are split into pieces of at most `max_chars` characters. Real WordPiece/BPE tokenizers
+    produce fewer tokens for common English words, so budgets based on this rarely overflow.
+    """
+
+    def __init__(self, max_chars: int = 6) -> None:
+        self.max_chars = max(1, max_chars)
+        self._pattern = re.compile(rf"\w{{1,{self.max_chars}}}|[^\w\s]")
+
+    def token_spans(self, text: str, start: int, end: int) -> list[tuple[int, int]]:
+        return list(map(_span, self._pattern.finditer(text, start, end)))
+
+
+class HFTokenizer:
+    """
+    Adapter for Hugging Face fast tokenizers (needs `return_offsets_mapping`).
+    `max_tokens` is the model window minus the special tokens added at encode time.
+    """
+
+    def __init__(self, tokenizer: Any, model_max_tokens: int | None = None) -> None:
+        self.tokenizer = tokenizer
+        limit = model_max_tokens or getattr(tokenizer, "model_max_length", 512)
+        self.max_tokens = int(limit) - int(tokenizer.num_special_tokens_to_add(pair=False))
+
+    def token_spans(self, text: str, start: int, end: int) -> list[tuple[int, int]]:
+        enc = self.tokenizer(text[start:end], add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        return [(start + s, start + e) for s, e in enc["offset_mapping"] if e > s]
+
+
+@dataclass
+class Chunk:
+    index: int
+    start: int  # character offsets in the full (concatenated) input
+    end: int
+    n_tokens: int
+    text: str
+    heading: str | None = None
+
+
+class Chunker:
+    """
+    Token windows of `max_tokens`, consecutive windows sharing `overlap_tokens`.
+
+    A window is only emitted once a token beyond it exists (or at a boundary), so the final chunk
+    is never a bare copy of the previous overlap. With `structure=True`, markdown headings start a
+    new chunk (no window crosses a heading) and each chunk records its section heading.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Tokenizer,
+        max_tokens: int,
+        overlap_tokens: int = 0,
+        structure: bool = False,
+    ) -> None:
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be > 0")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(max(0, overlap_tokens), max_tokens - 1)
+        self.structure = structure
+
+    def chunk_text(self, text: str) -> list[Chunk]:
+        return list(self.iter_chunks([text or ""]))
+
+    def iter_chunks(self, pieces: Iterable[str]) -> Iterator[Chunk]:
+        return _ChunkStream(self).run(pieces)
+
+
+class _ChunkStream:
+    """
+    State for one streamed document. Pending token spans are kept as offsets into `buf`
+    (which holds the text from global offset `base` on); everything else is in global offsets.
+    """
+
+    def __init__(self, chunker: Chunker) -> None:
+        self.c = chunker
+        self.buf = ""
+        self.base = 0  # global offset of buf[0]
+        self.scanned = 0  # global offset up to which buf has been tokenized
+        self.spans: list[tuple[int, int]] = []  # pending tokens, offsets into buf
+        self.heading: str | None = None
+        self.heading_start: int | None = None  # set at a heading, resolved to `heading` once its line is complete
+        self.held: list[Chunk] = []  # chunks emitted before their heading line was complete
+        self.final = False  # the whole input is in buf
+        self.index = 0
+
+    def run(self, pieces: Iterable[str]) -> Iterator[Chunk]:
+        for piece in pieces:
+            if not piece:
+                continue
+            self.buf += piece
+            yield from self._release()
+            yield from self._advance(final=False)
+        self.final = True
+        yield from self._advance(final=True)
+        yield from self._flush()
+        yield from self._release()
+
+    def _advance(self, final: bool) -> Iterator[Chunk]:
+        if final:
+            limit = self.base + len(self.buf)
+        else:
+            # Only tokenize up to the last whitespace: the text after it may continue in the next piece.
+            local = len(self.buf) - 1
+            lo = self.scanned - self.base
+            while local >= lo and not self.buf[local].isspace():
+                local -= 1
+            if local < lo:
+                return
+            limit = self.base + local
+
+        while self.scanned < limit:
+            seg_end = min(limit, self.scanned + SEGMENT_CHARS)
+            if seg_end < limit:
+                m = _WS.search(self.buf, seg_end - self.base, limit - self.base)
+                seg_end = self.base + m.start() if m else limit
+            yield from self._segment(self.scanned, seg_end)
+            self.scanned = seg_end
+            self._compact()
+
+    def _segment(self, g_start: int, g_end: int) -> Iterator[Chunk]:
+        # The buffer is not compacted while a segment is processed, so local offsets stay valid here.
+        lo, hi = g_start - self.base, g_end - self.base
+        cuts: list[int] = []
+        if self.c.structure:
+            # Look a few chars past the cut so "##" + " " split across it still matches;
+            # `^` only matches at a real line start, even when the search starts mid-buffer.
+            cuts = [m.start() for m in _HEADING.finditer(self.buf, lo, min(len(self.buf), hi + 8)) if m.start() < hi]
+
+        prev = lo
+        for cut in cuts + [hi]:
+            if cut > prev:
+                yield from self._tokenize(prev, cut)
+            if cut < hi:
+                yield from self._flush()
+                # The rest of the heading line may not have arrived yet: read it when the section's first chunk is emitted.
+                self.heading_start = self.base + cut
+            prev = cut
+
+    def _tokenize(self, lo: int, hi: int) -> Iterator[Chunk]:
+        spans = self.spans
+        spans.extend(self.c.tokenizer.token_spans(self.buf, lo, hi))
+        max_t = self.c.max_tokens
+        step = max_t - self.c.overlap_tokens
+        head = 0
+        while len(spans) - head > max_t:
+            yield from self._emit(spans[head][0], spans[head + max_t - 1][1], max_t)
+            head += step
+        if head:
+            del spans[:head]
+
+    def _flush(self) -> Iterator[Chunk]:
+        if self.spans:
+            yield from self._emit(self.spans[0][0], self.spans[-1][1], len(self.spans))
+            self.spans = []
+
+    def _emit(self, start: int, end: int, n_tokens: int) -> Iterator[Chunk]:
+        self.held.append(
+            Chunk(
+                index=self.index,
+                start=self.base + start,
+                end=self.base + end,
+                n_tokens=n_tokens,
+                text=self.buf[start:end],
+            )
+        )
+        self.index += 1
+        yield from self._release()
+
+    def _release(self) -> Iterator[Chunk]:
+        """
+        Yield the held chunks once the section heading is known: a heading line longer than a window
+        emits chunks before its newline has arrived, and must not be recorded cut short.
+        """
+        if not self.held:
+            return
+        if self.heading_start is not None:
+            local = self.heading_start - self.base
+            eol = self.buf.find("\n", local)
+            if eol < 0 and not self.final:
+                return
+            self.heading = self.buf[local : eol if eol >= 0 else len(self.buf)].strip()
+            self.heading_start = None
+        for ch in self.held:
+            ch.heading = self.heading
+            yield ch
+        self.held = []
+
+    def _compact(self) -> None:
+        """
+        Drop buffered text nobody can reference any more (before the first pending token).
+        Copying the buffer is O(len), so only do it once the dead prefix is a large share of it.
+        """
+        keep_from = self.spans[0][0] if self.spans else self.scanned - self.base
+        if self.heading_start is not None:
+            keep_from = min(keep_from, self.heading_start - self.base)
+        if keep_from > 0 and keep_from >= max(SEGMENT_CHARS, len(self.buf) // 2):
+            self.buf = self.buf[keep_from:]
+            self.base += keep_from
+            # At most one window of pending tokens here, so re-basing them is cheap.
+            self.spans = [(s - keep_from, e - keep_from) for s, e in self.spans]
+
+
+def make_tokenizer(name: str) -> Tokenizer:
+    """
+    Build one of the in-process tokenizers by name ("words" or "approx").
+    """
+    name = (name or "words").strip().lower()
+    if name in ("words", "whitespace"):
+        return WhitespaceTokenizer()
+    if name in ("approx", "subword"):
+        return ApproxSubwordTokenizer()
+    raise ValueError(f"Unknown tokenizer {name!r} (expected 'words' or 'approx')")
@@ -0,0 +1,156 @@
+"""
+Embedding dimensionality reduction, saved as a versioned artifact so ingest and query time project
+vectors the same way.
+
+  pca       fitted on a sample of stored embeddings: subtract the sample mean, keep the top
+            `out_dim` principal components
+  truncate  keep the first `out_dim` dimensions (Matryoshka-style). Only meaningful for models
+            trained for it (e.g. nomic-embed-text); for others PCA is the better choice.
+
+Both re-normalize to unit length, so angular distance / cosine keeps working on the reduced vectors.
+
+Artifacts are `.npz` files named `<method>-<out_dim>-v<version>.npz`:
+
+  p = projection.fit_pca(sample, 128, model="sentence-transformers/all-MiniLM-L6-v2")
+  path = projection.save_versioned(p, "/data/projections")   # .../pca-128-v<next>.npz
+  projection.load(path).apply(vecs)
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+
+METHODS = ("pca", "truncate")
+_ARTIFACT = re.compile(r"^(?P<method>[a-z]+)-(?P<dim>\d+)-v(?P<version>\d+)\.npz$")
+
+
+@dataclass
+class Projection:
+    method: str
+    in_dim: int
+    out_dim: int
+    version: int = 1
+    model: str = ""
+    sample_size: int = 0
+    created_ms: int = field(default_factory=lambda: int(time.time() * 1000))
+    # pca only: sample mean (in_dim,), components (out_dim, in_dim), explained variance ratio per component.
+    mean: np.ndarray | None = None
+    components: np.ndarray | None = None
+    explained_variance: np.ndarray | None = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.method}-{self.out_dim}-v{self.version}"
+
+    def apply(self, vecs: Any) -> np.ndarray:
+        """
+        (n, in_dim) or (in_dim,) -> unit-length (n, out_dim) / (out_dim,) float32.
+        """
+        x = np.asarray(vecs, dtype=np.float32)
+        single = x.ndim == 1
+        x = np.atleast_2d(x)
+        if x.shape[1] != self.in_dim:
+            raise ValueError(f"Projection {self.name} expects {self.in_dim}-dim vectors, got {x.shape[1]}")
+        if self.method == "pca":
+            assert self.mean is not None and self.components is not None
+            y = (x - self.mean) @ self.components.T
+        else:
+            y = x[:, : self.out_dim]
+        norms = np.linalg.norm(y, axis=1, keepdims=True)
+        y = y / np.where(norms > 0, norms, 1.0)
+        return y[0] if single else y
+
+    def info(self) -> dict[str, Any]:
+        d: dict[str, Any] = {
+            "name": self.name,
+            "method": self.method,
+            "in_dim": self.in_dim,
+            "out_dim": self.out_dim,
+            "version": self.version,
+            "model": self.model,
+            "sample_size": self.sample_size,
+            "created_ms": self.created_ms,
+        }
+        if self.explained_variance is not None:
+            d["explained_variance"] = float(np.sum(self.explained_variance))
+        return d
+
+    def save(self, path: str) -> str:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {
+            k: v
+            for k, v in (
+                ("mean", self.mean),
+                ("components", self.components),
+                ("explained_variance", self.explained_variance),
+            )
+            if v is not None
+        }
+        meta = {k: v for k, v in self.info().items() if k not in ("name", "explained_variance")}
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp, path)
+        return path
+
+
+def fit_pca(sample: Any, out_dim: int, model: str = "", version: int = 1) -> Projection:
+    x = np.asarray(sample, dtype=np.float64)
+    n, in_dim = x.shape
+    if not 0 < out_dim <= min(n, in_dim):
+        raise ValueError(f"PCA to {out_dim} dims needs 0 < out_dim <= min(samples={n}, dim={in_dim})")
+    mean = x.mean(axis=0)
+    _, s, vt = np.linalg.svd(x - mean, full_matrices=False)
+    var = s**2
+    return Projection(
+        method="pca",
+        in_dim=in_dim,
+        out_dim=out_dim,
+        version=version,
+        model=model,
+        sample_size=n,
+        mean=mean.astype(np.float32),
+        components=vt[:out_dim].astype(np.float32),
+        explained_variance=(var[:out_dim] / var.sum()).astype(np.float32) if var.sum() > 0 else None,
+    )
+
+
+def truncation(in_dim: int, out_dim: int, model: str = "", version: int = 1) -> Projection:
+    if not 0 < out_dim <= in_dim:
+        raise ValueError(f"Truncation to {out_dim} dims needs 0 < out_dim <= {in_dim}")
+    return Projection(method="truncate", in_dim=in_dim, out_dim=out_dim, version=version, model=model)
+
+
+def load(path: str) -> Projection:
+    with np.load(path, allow_pickle=False) as z:
+        meta = json.loads(str(z["meta"]))
+        arrays = {k: z[k] for k in ("mean", "components", "explained_variance") if k in z.files}
+    return Projection(**meta, **arrays)
+
+
+def artifact_path(directory: str, method: str, out_dim: int, version: int) -> str:
+    return os.path.join(directory, f"{method}-{out_dim}-v{version}.npz")
+
+
+def next_version(directory: str, method: str, out_dim: int) -> int:
+    taken = [
+        int(m.group("version"))
+        for m in (_ARTIFACT.match(f) for f in (os.listdir(directory) if os.path.isdir(directory) else []))
+        if m and m.group("method") == method and int(m.group("dim")) == out_dim
+    ]
+    return max(taken, default=0) + 1
+
+
+def save_versioned(p: Projection, directory: str) -> str:
+    """
+    Saves `p` as the next unused version of `<method>-<out_dim>` in `directory`; existing artifacts are
+    never overwritten, so vectors fed with an older version can still be matched to it.
+    """
+    p.version = next_version(directory, p.method, p.out_dim)
+    return p.save(artifact_path(directory, p.method, p.out_dim, p.version))
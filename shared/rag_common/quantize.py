@@ -0,0 +1,85 @@
+"""
+Compact embedding variants fed next to the float `embedding` field.
+
+  int8    tensor<int8>(x[D])      each vector scaled so its largest |value| maps to 127 (angular
+                                  distance ignores the scale); 4x smaller than float
+  binary  tensor<int8>(x[D/8])    sign bits packed 8 per byte, first dimension in the highest bit
+                                  (same layout as Vespa's `pack_bits`); 32x smaller, searched with
+                                  hamming distance and rescored with the float vector
+
+The schema fields are `embedding_int8` / `embedding_bits`, queried with the rank profiles
+`vector_int8` / `vector_binary`, which rescore the candidates with the float vector (see the chunk
+schemas; the `app-compact` packages keep that float vector paged and without an HNSW index).
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, Sequence
+
+VARIANTS = ("int8", "binary")
+FIELDS = {"float": "embedding", "int8": "embedding_int8", "binary": "embedding_bits"}
+QUERY_INPUTS = {"float": "q", "int8": "q_int8", "binary": "q_bits"}
+RANK_PROFILES = {"float": "vector", "int8": "vector_int8", "binary": "vector_binary"}
+
+
+def parse_variants(spec: str | Iterable[str] | None) -> tuple[str, ...]:
+    """
+    "int8,binary" -> ("int8", "binary"); unknown names raise ValueError.
+    """
+    if spec is None:
+        return ()
+    names = spec.split(",") if isinstance(spec, str) else list(spec)
+    out = tuple(dict.fromkeys(n.strip().lower() for n in names if n and n.strip()))
+    bad = [n for n in out if n not in VARIANTS]
+    if bad:
+        raise ValueError(f"Unknown embedding variant(s) {bad}; expected a subset of {VARIANTS}")
+    return out
+
+
+def to_int8(vec: Sequence[float]) -> list[int]:
+    scale = max((abs(v) for v in vec), default=0.0)
+    if scale == 0.0:
+        return [0] * len(vec)
+    return [int(round(v * 127.0 / scale)) for v in vec]
+
+
+def pack_bits(vec: Sequence[float]) -> list[int]:
+    if len(vec) % 8:
+        raise ValueError(f"pack_bits needs a dimension divisible by 8, got {len(vec)}")
+    out = []
+    for i in range(0, len(vec), 8):
+        byte = 0
+        for v in vec[i : i + 8]:
+            byte = (byte << 1) | (1 if v > 0 else 0)
+        out.append(byte - 256 if byte > 127 else byte)
+    return out
+
+
+def encode(vec: Sequence[float], variant: str) -> list[float] | list[int]:
+    if variant == "float":
+        return list(vec)
+    if variant == "int8":
+        return to_int8(vec)
+    if variant == "binary":
+        return pack_bits(vec)
+    raise ValueError(f"Unknown embedding variant {variant!r}")
+
+
+def variant_fields(vec: Sequence[float], variants: Iterable[str]) -> dict[str, list[int]]:
+    """
+    Extra document fields for `variants`, to merge into a feed next to "embedding".
+    """
+    return {FIELDS[v]: encode(vec, v) for v in variants}  # type: ignore[misc]
+
+
+def bytes_per_vector(dim: int, variant: str) -> int:
+    """
+    Attribute memory for one vector's cells (excluding the HNSW graph).
+    """
+    if variant == "float":
+        return 4 * dim
+    if variant == "int8":
+        return dim
+    if variant == "binary":
+        return dim // 8
+    raise ValueError(f"Unknown embedding variant {variant!r}")
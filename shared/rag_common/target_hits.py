@@ -0,0 +1,208 @@
+"""
+Online controller for nearestNeighbor `targetHits`, driven by a latency SLO and a recall target.
+
+targetHits is how many candidates HNSW explores per query: too high wastes graph exploration on every
+query, too low silently loses recall. The controller watches two signals per setting:
+
+- the latency of ANN queries (`observe_latency`)
+- recall@k of a sampled fraction of queries, measured by re-running them as an exact search
+  (approximate:false) off the request path and comparing the top-k ids (`shadow_due` decides when to
+  sample, with at most one shadow query in flight; `shadow_done` records the result)
+
+and every `interval_s` takes at most one multiplicative step within [min_hits, max_hits]:
+
+- p95 latency above the SLO          -> down (the SLO wins when both targets cannot be met)
+- estimated recall below the target  -> up
+- recall at least target + margin    -> down a smaller step, to find the cheapest setting that holds
+
+Samples are kept per setting, so after a step the new value is judged on its own samples. A value that
+broke the SLO becomes a ceiling, and one that missed the recall target a floor, for `memory_s`, so the
+controller settles instead of oscillating between two neighbours.
+"""
+
+from __future__ import annotations
+
+import math
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Iterable
+
+UP = "up"
+DOWN = "down"
+
+
+def recall_at_k(approx_ids: Iterable[str], exact_ids: Iterable[str]) -> float | None:
+    """
+    Fraction of the exact top-k that the approximate search also returned (None for an empty exact result).
+    """
+    exact = [i for i in exact_ids if i]
+    if not exact:
+        return None
+    return len(set(exact) & {i for i in approx_ids if i}) / len(exact)
+
+
+def _p95(values: list[float]) -> float:
+    s = sorted(values)
+    return s[min(len(s) - 1, int(math.ceil(0.95 * len(s))) - 1)]
+
+
+class Controller:
+    def __init__(
+        self,
+        initial: int,
+        min_hits: int,
+        max_hits: int,
+        latency_slo_ms: float,
+        recall_target: float,
+        shadow_rate: float,
+        recall_margin: float = 0.02,
+        interval_s: float = 30.0,
+        min_latency_samples: int = 20,
+        min_recall_samples: int = 10,
+        max_age_s: float = 600.0,
+        memory_s: float = 900.0,
+        step_up: float = 1.5,
+        step_down: float = 0.8,
+        probe_down: float = 0.9,
+    ) -> None:
+        self.min_hits = max(1, min_hits)
+        self.max_hits = max(self.min_hits, max_hits)
+        self.latency_slo_ms = latency_slo_ms
+        self.recall_target = recall_target
+        self.shadow_rate = shadow_rate
+        self.recall_margin = recall_margin
+        self.interval_s = interval_s
+        self.min_latency_samples = min_latency_samples
+        self.min_recall_samples = min_recall_samples
+        self.max_age_s = max_age_s
+        self.memory_s = memory_s
+        self.step_up = step_up
+        self.step_down = step_down
+        self.probe_down = probe_down
+        self._current = min(self.max_hits, max(self.min_hits, initial))
+        self._latency: dict[int, deque[tuple[float, float]]] = {}  # target_hits -> (time, ms)
+        self._recall: dict[int, deque[tuple[float, float]]] = {}  # target_hits -> (time, recall)
+        self._ceiling: tuple[int, float] | None = None  # (value, until)
+        self._floor: tuple[int, float] | None = None
+        self._last_step = time.time()
+        self._steps = {UP: 0, DOWN: 0}
+        self._shadow_in_flight = False
+        self._shadow_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def adaptive(self) -> bool:
+        return self.min_hits < self.max_hits
+
+    @property
+    def current(self) -> int:
+        return self._current
+
+    def observe_latency(self, target_hits: int, ms: float) -> None:
+        with self._lock:
+            self._latency.setdefault(target_hits, deque(maxlen=200)).append((time.time(), ms))
+            self._maybe_step()
+
+    def shadow_due(self) -> bool:
+        """
+        True if this query should be checked against an exact search; the caller must then call
+        `shadow_done` (with the recall, or None on failure) when the check finishes.
+        """
+        if self.shadow_rate <= 0.0 or random.random() >= self.shadow_rate:
+            return False
+        with self._lock:
+            if self._shadow_in_flight:
+                return False
+            self._shadow_in_flight = True
+            return True
+
+    def shadow_done(self, target_hits: int, recall: float | None) -> None:
+        with self._lock:
+            self._shadow_in_flight = False
+            if recall is None:
+                return
+            self._shadow_count += 1
+            self._recall.setdefault(target_hits, deque(maxlen=50)).append((time.time(), recall))
+            self._maybe_step()
+
+    def estimate(self, target_hits: int | None = None) -> dict[str, Any]:
+        """
+        p95 latency and mean recall from the recent samples at `target_hits` (default: the current value).
+        """
+        with self._lock:
+            return self._estimate(self._current if target_hits is None else target_hits)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            now = time.time()
+            return {
+                "target_hits": self._current,
+                "adaptive": self.adaptive,
+                "min": self.min_hits,
+                "max": self.max_hits,
+                "latency_slo_ms": self.latency_slo_ms,
+                "recall_target": self.recall_target,
+                "shadow_rate": self.shadow_rate,
+                "shadow_queries": self._shadow_count,
+                "steps": dict(self._steps),
+                "ceiling": self._ceiling[0] if self._ceiling and self._ceiling[1] > now else None,
+                "floor": self._floor[0] if self._floor and self._floor[1] > now else None,
+                **self._estimate(self._current),
+            }
+
+    def _samples(self, store: dict[int, deque[tuple[float, float]]], target_hits: int) -> list[float]:
+        cutoff = time.time() - self.max_age_s
+        return [v for t, v in store.get(target_hits, ()) if t >= cutoff]
+
+    def _estimate(self, target_hits: int) -> dict[str, Any]:
+        # Caller holds the lock.
+        lat = self._samples(self._latency, target_hits)
+        rec = self._samples(self._recall, target_hits)
+        return {
+            "latency_p95_ms": _p95(lat) if lat else None,
+            "latency_samples": len(lat),
+            "estimated_recall": sum(rec) / len(rec) if rec else None,
+            "recall_samples": len(rec),
+        }
+
+    def _maybe_step(self) -> None:
+        # Caller holds the lock.
+        now = time.time()
+        if not self.adaptive or now - self._last_step < self.interval_s:
+            return
+        cur = self._current
+        est = self._estimate(cur)
+        slow = (
+            self.latency_slo_ms > 0
+            and est["latency_samples"] >= self.min_latency_samples
+            and est["latency_p95_ms"] > self.latency_slo_ms
+        )
+        measured = est["recall_samples"] >= self.min_recall_samples
+        if slow:
+            self._ceiling = (cur, now + self.memory_s)
+            new = self._lower(cur, self.step_down, now)
+        elif measured and est["estimated_recall"] < self.recall_target:
+            self._floor = (cur, now + self.memory_s)
+            new = self._higher(cur, now)
+        elif measured and est["estimated_recall"] >= self.recall_target + self.recall_margin:
+            new = self._lower(cur, self.probe_down, now, probe=True)
+        else:
+            return
+        if new != cur:
+            self._steps[UP if new > cur else DOWN] += 1
+            self._current = new
+            self._last_step = now
+
+    def _higher(self, cur: int, now: float) -> int:
+        new = min(self.max_hits, max(cur + 1, int(math.ceil(cur * self.step_up))))
+        if self._ceiling is not None and self._ceiling[1] > now and new >= self._ceiling[0]:
+            new = max(cur, self._ceiling[0] - 1)
+        return new
+
+    def _lower(self, cur: int, factor: float, now: float, probe: bool = False) -> int:
+        new = max(self.min_hits, min(cur - 1, int(cur * factor)))
+        if probe and self._floor is not None and self._floor[1] > now and new <= self._floor[0]:
+            new = min(cur, self._floor[0] + 1)
+        return new
@@ -0,0 +1,361 @@
+"""
+Minimal request tracing shared by rag-api and retrieval-lab.
+
+- Nested spans via contextvars (works for plain sync handlers and asyncio tasks).
+- Head-based sampling: the decision is made once at the root span (or taken from an incoming
+  W3C `traceparent` header) and inherited by every child, so unsampled requests cost ~nothing.
+- Pluggable exporters: JSONL file (default) or OTLP/HTTP JSON, flushed from a background thread
+  so request threads never block on span I/O.
+- Vespa propagation: sampled spans ask Vespa for `trace.level` + `presentation.timing` and
+  record the returned timing/trace on the span.
+
+Config (env):
+  TRACE_EXPORTER       jsonl | otlp | none     (default: jsonl)
+  TRACE_JSONL_PATH     file for the jsonl exporter (default: ./traces.jsonl)
+  TRACE_OTLP_ENDPOINT  OTLP/HTTP traces URL (default: http://otel-collector:4318/v1/traces)
+  TRACE_SAMPLE_RATE    0.0..1.0 (default: 0.1)
+  TRACE_VESPA_LEVEL    Vespa trace.level for sampled queries, 0 disables (default: 3)
+"""
+
+from __future__ import annotations
+
+import atexit
+import contextvars
+import json
+import os
+import queue
+import random
+import secrets
+import sys
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Iterator, Protocol
+
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "jsonl").strip().lower()
+TRACE_JSONL_PATH = os.environ.get("TRACE_JSONL_PATH", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.environ.get("TRACE_OTLP_ENDPOINT", "http://otel-collector:4318/v1/traces")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_VESPA_LEVEL = int(os.environ.get("TRACE_VESPA_LEVEL", "3"))
+
+# Vespa traces can be large; keep span records bounded.
+_MAX_VESPA_TRACE_CHARS = 64_000
+
+_CURRENT: contextvars.ContextVar[Span | None] = contextvars.ContextVar("rag_common_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    service: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    sampled: bool
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: int = 0
+    attributes: dict[str, Any] = field(default_factory=dict)
+    events: list[dict[str, Any]] = field(default_factory=list)
+    error: str | None = None
+
+    def set(self, **attrs: Any) -> None:
+        if self.sampled:
+            self.attributes.update(attrs)
+
+    def add_event(self, name: str, **attrs: Any) -> None:
+        if self.sampled:
+            self.events.append({"name": name, "time_ns": time.time_ns(), "attributes": attrs})
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": self.service,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": self.duration_ms,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+            "events": self.events,
+        }
+
+
+class SpanExporter(Protocol):
+    def export(self, spans: list[Span]) -> None: ...
+
+
+class JsonlSpanExporter:
+    """
+    One JSON object per finished span, appended to a local file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def export(self, spans: list[Span]) -> None:
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            for s in spans:
+                f.write(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+def _otlp_value(v: Any) -> dict[str, Any]:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    if isinstance(v, str):
+        return {"stringValue": v}
+    return {"stringValue": json.dumps(v, ensure_ascii=False, default=str)}
+
+
+def _otlp_attrs(attrs: dict[str, Any]) -> list[dict[str, Any]]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attrs.items() if v is not None]
+
+
+class OtlpHttpSpanExporter:
+    """
+    OTLP/HTTP with the JSON encoding (POST {endpoint}), so any OpenTelemetry collector,
+    Jaeger or Tempo can ingest the spans without adding the OTel SDK as a dependency.
+    """
+
+    def __init__(self, endpoint: str, timeout_s: float = 5.0) -> None:
+        self.endpoint = endpoint
+        self.timeout_s = timeout_s
+
+    def export(self, spans: list[Span]) -> None:
+        by_service: dict[str, list[dict[str, Any]]] = {}
+        for s in spans:
+            by_service.setdefault(s.service, []).append(
+                {
+                    "traceId": s.trace_id,
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent_id or "",
+                    "name": s.name,
+                    "kind": 1,  # SPAN_KIND_INTERNAL
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns),
+                    "attributes": _otlp_attrs(s.attributes),
+                    "events": [
+                        {"timeUnixNano": str(e["time_ns"]), "name": e["name"], "attributes": _otlp_attrs(e["attributes"])}
+                        for e in s.events
+                    ],
+                    "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+                }
+            )
+
+        body = {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": _otlp_attrs({"service.name": svc})},
+                    "scopeSpans": [{"scope": {"name": "rag_common.tracing"}, "spans": out}],
+                }
+                for svc, out in by_service.items()
+            ]
+        }
+        req = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout_s) as resp:
+            resp.read()
+
+
+class BatchSpanProcessor:
+    """
+    Buffers finished spans and exports them from a daemon thread.
+    When the buffer is full, spans are dropped (and counted) rather than blocking requests.
+    """
+
+    def __init__(self, exporter: SpanExporter, max_queue: int = 10_000, max_batch: int = 512, interval_s: float = 1.0) -> None:
+        self.exporter = exporter
+        self.max_batch = max_batch
+        self.interval_s = interval_s
+        self.dropped = 0
+        self._q: queue.Queue[Span] = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def on_end(self, span: Span) -> None:
+        try:
+            self._q.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self) -> list[Span]:
+        batch: list[Span] = []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self) -> None:
+        with self._lock:
+            while True:
+                batch = self._drain()
+                if not batch:
+                    return
+                try:
+                    self.exporter.export(batch)
+                except Exception as e:
+                    print(f"[tracing] export of {len(batch)} spans failed: {e}", file=sys.stderr)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval_s)
+            self.flush()
+
+
+def parse_traceparent(header: str | None) -> tuple[str, str, bool] | None:
+    """
+    Parse a W3C traceparent header -> (trace_id, parent_span_id, sampled).
+    """
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3], 16)
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(flags & 0x01)
+
+
+class Tracer:
+    def __init__(self, service: str, processor: BatchSpanProcessor | None, sample_rate: float) -> None:
+        self.service = service
+        self.processor = processor
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+
+    @contextmanager
+    def span(self, name: str, traceparent: str | None = None, **attrs: Any) -> Iterator[Span]:
+        """
+        Start a span as a child of the current one, or as a new root.
+        `traceparent` is only consulted for roots (continues a caller's trace and sampling decision).
+        """
+        parent = _CURRENT.get()
+        if parent is not None:
+            trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+        else:
+            incoming = parse_traceparent(traceparent)
+            if incoming is not None:
+                trace_id, parent_id, sampled = incoming
+            else:
+                trace_id, parent_id = secrets.token_hex(16), None
+                sampled = self.processor is not None and random.random() < self.sample_rate
+
+        s = Span(
+            name=name,
+            service=self.service,
+            trace_id=trace_id,
+            span_id=secrets.token_hex(8),
+            parent_id=parent_id,
+            sampled=sampled,
+        )
+        s.set(**attrs)
+        token = _CURRENT.set(s)
+        try:
+            yield s
+        except Exception as e:
+            s.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            s.end_ns = time.time_ns()
+            _CURRENT.reset(token)
+            if s.sampled and self.processor is not None:
+                self.processor.on_end(s)
+
+
+def current_span() -> Span | None:
+    return _CURRENT.get()
+
+
+def current_trace_id() -> str | None:
+    s = _CURRENT.get()
+    return s.trace_id if s is not None else None
+
+
+def mark_error(e: BaseException) -> None:
+    """
+    Flag the current span as failed when the caller handles the exception itself
+    (e.g. endpoints that turn errors into {"ok": false} responses).
+    """
+    s = _CURRENT.get()
+    if s is not None:
+        s.error = f"{type(e).__name__}: {e}"
+
+
+def vespa_query_params(span: Span | None) -> dict[str, Any]:
+    """
+    Extra Vespa query parameters for a sampled span: ask for a trace and the timing breakdown.
+    Unsampled requests send nothing extra, so Vespa does no extra work for them.
+    """
+    if span is None or not span.sampled or TRACE_VESPA_LEVEL <= 0:
+        return {}
+    return {
+        "trace.level": TRACE_VESPA_LEVEL,
+        "trace.timestamps": True,
+        "presentation.timing": True,
+    }
+
+
+def record_vespa_response(span: Span | None, body: dict[str, Any] | None) -> None:
+    """
+    Copy Vespa's `timing` (seconds) onto the span as *_ms attributes and keep the trace tree as an event.
+    """
+    if span is None or not span.sampled or not isinstance(body, dict):
+        return
+    timing = body.get("timing")
+    if isinstance(timing, dict):
+        for k, v in timing.items():
+            if isinstance(v, (int, float)):
+                span.set(**{f"vespa.{k}_ms": float(v) * 1000.0})
+    root = body.get("root") or {}
+    total = ((root.get("fields") or {}).get("totalCount")) if isinstance(root, dict) else None
+    if total is not None:
+        span.set(**{"vespa.total_count": total})
+    trace = body.get("trace")
+    if trace is not None:
+        span.add_event("vespa.trace", trace=json.dumps(trace, ensure_ascii=False)[:_MAX_VESPA_TRACE_CHARS])
+
+
+def _exporter_from_env() -> SpanExporter | None:
+    if TRACE_EXPORTER == "jsonl":
+        return JsonlSpanExporter(TRACE_JSONL_PATH)
+    if TRACE_EXPORTER == "otlp":
+        return OtlpHttpSpanExporter(TRACE_OTLP_ENDPOINT)
+    if TRACE_EXPORTER in ("", "none", "off"):
+        return None
+    raise ValueError(f"Unknown TRACE_EXPORTER={TRACE_EXPORTER!r} (expected jsonl, otlp or none)")
+
+
+def tracer_from_env(service: str) -> Tracer:
+    exporter = _exporter_from_env()
+    processor = BatchSpanProcessor(exporter) if exporter is not None else None
+    return Tracer(service=service, processor=processor, sample_rate=TRACE_SAMPLE_RATE)
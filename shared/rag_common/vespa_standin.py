@@ -0,0 +1,935 @@
+"""
+A small Vespa stand-in: the subset of the HTTP API that rag-api and retrieval-lab use, served from
+memory, so the client-side pipeline can be benchmarked and tested without a Vespa container.
+
+Supported:
+  - /document/v1/<namespace>/<doctype>/docid/<id>   POST (put), PUT (assign update), GET, DELETE
+  - /document/v1/<namespace>/<doctype>/docid         GET visit (wantedDocumentCount, continuation)
+  - /search/   YQL `select <fields|*> from sources <doctypes|*> where <expr> [limit N] [offset N]
+               [| all(group(<attr>) ... count())]` where <expr> combines, with and/or/parentheses:
+                 {targetHits:N, approximate:...}nearestNeighbor(<tensor field>, <query tensor>)
+                 {defaultIndex:"<field>"}userInput(@param | "text")
+                 <field> contains "value" | @param
+                 <field> in ("a", "b", ...)
+                 true / false
+               rank profiles vector, bm25, hybrid, *_reduced, unranked (RANK_PROFILES), the compact
+               profiles vector_int8 / vector_binary / hybrid_int8 / hybrid_binary / float_rescore (first
+               phase over embedding_int8 or the hamming-distance embedding_bits, then an exact float
+               cosine rescore of the top rerank-count, SECOND_PHASE), document summary `ids`,
+               presentation.format.tensors=short-value, presentation.timing
+  - /state/v1/health, /ApplicationStatus
+
+Matching is exact: nearestNeighbor scores every document that passes the other filters of its
+`and` (Vespa's pre-filtering, without HNSW error), so results are deterministic. BM25 uses Vespa's
+formula over lowercase word tokens (no stemming). Latency can be injected per request.
+
+  python -m rag_common.vespa_standin --port 8080 --search-latency-ms 5 --jitter-ms 2
+
+In-process (tests / benchmarks):
+
+  with VespaStandIn(search_latency_ms=3) as vespa:
+      os.environ["VESPA_URL"] = vespa.url
+      ...
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterable
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+
+# profile -> (bm25 weight, closeness weight); None = unranked (document order, relevance 0).
+RANK_PROFILES: dict[str, tuple[float, float] | None] = {
+    "vector": (0.0, 1.0),
+    "bm25": (1.0, 0.0),
+    "hybrid": (0.5, 0.5),
+    "vector_reduced": (0.0, 1.0),
+    "hybrid_reduced": (0.5, 0.5),
+    "vector_int8": (0.0, 1.0),
+    "vector_binary": (0.0, 1.0),
+    "hybrid_int8": (0.5, 0.5),
+    "hybrid_binary": (0.5, 0.5),
+    "float_rescore": (0.0, 0.0),
+    "unranked": None,
+}
+# profile -> (bm25 weight, float cosine weight, rerank-count): the best first-phase hits are rescored with
+# the cosine of query(q) and the `embedding` field, like the schemas' `float_rescore` profile.
+SECOND_PHASE: dict[str, tuple[float, float, int]] = {
+    "vector_int8": (0.0, 1.0, 100),
+    "vector_binary": (0.0, 1.0, 100),
+    "hybrid_int8": (0.5, 0.5, 100),
+    "hybrid_binary": (0.5, 0.5, 100),
+    "float_rescore": (0.0, 1.0, 100),
+}
+RESCORE_FIELD, RESCORE_INPUT = "embedding", "q"
+# Fields with their own distance-metric in the schemas (others use the stand-in's metric).
+FIELD_DISTANCE_METRICS = {"embedding_bits": "hamming"}
+DOCUMENT_SUMMARIES = {"ids": ("chunk_id", "doc_id")}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+_MAX_EXACT_CHARS = 256  # string values up to this length are also indexed for `in (...)` / exact match
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _terms(text: str) -> list[str]:
+    return _WORD.findall(text.lower())
+
+
+class QueryError(ValueError):
+    pass
+
+
+# --------------------------------------------------------------------------------------------
+# Index
+# --------------------------------------------------------------------------------------------
+
+
+class _TensorField:
+    def __init__(self, dim: int, capacity: int) -> None:
+        self.dim = dim
+        self.vecs = np.zeros((capacity, dim), dtype=np.float32)
+        self.norms = np.zeros(capacity, dtype=np.float32)
+
+    def grow(self, capacity: int) -> None:
+        vecs = np.zeros((capacity, self.dim), dtype=np.float32)
+        vecs[: len(self.vecs)] = self.vecs
+        norms = np.zeros(capacity, dtype=np.float32)
+        norms[: len(self.norms)] = self.norms
+        self.vecs, self.norms = vecs, norms
+
+
+class Index:
+    """
+    All documents of all doctypes, in slots. Per string field: word postings (with term frequency,
+    for `contains` / userInput / bm25) and exact-value postings (for `in`). Per tensor field: a matrix.
+    """
+
+    def __init__(self, distance_metric: str = "angular", capacity: int = 1024) -> None:
+        self.distance_metric = distance_metric
+        self.capacity = capacity
+        self.ids: list[str | None] = [None] * capacity  # slot -> "id:ns:doctype::id"
+        self.doctypes: list[str | None] = [None] * capacity
+        self.fields: list[dict[str, Any] | None] = [None] * capacity
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.slot_of: dict[str, int] = {}
+        self.free: list[int] = list(range(capacity - 1, -1, -1))
+        self.tensors: dict[str, _TensorField] = {}
+        self.postings: dict[str, dict[str, dict[int, int]]] = defaultdict(lambda: defaultdict(dict))
+        self.exact: dict[str, dict[str, set[int]]] = defaultdict(lambda: defaultdict(set))
+        self.lengths: dict[str, np.ndarray] = {}
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+    # -- writes ------------------------------------------------------------------------------
+
+    def put(self, doc_id: str, doctype: str, fields: dict[str, Any]) -> None:
+        with self.lock:
+            for name, value in fields.items():
+                vec = _tensor_values(value)
+                t = self.tensors.get(name)
+                if vec is not None and t is not None and len(vec) != t.dim:
+                    raise QueryError(f"Field '{name}': expected {t.dim} values, got {len(vec)}")
+            self.remove(doc_id)
+            if not self.free:
+                self._grow(self.capacity * 2)
+            slot = self.free.pop()
+            self.ids[slot], self.doctypes[slot], self.fields[slot] = doc_id, doctype, dict(fields)
+            self.slot_of[doc_id] = slot
+            self.alive[slot] = True
+            self._index(slot, fields)
+
+    def update(self, doc_id: str, doctype: str, assignments: dict[str, Any], create: bool = False) -> bool:
+        with self.lock:
+            slot = self.slot_of.get(doc_id)
+            if slot is None and not create:
+                return False
+            fields = dict(self.fields[slot] or {}) if slot is not None else {}
+            fields.update(assignments)
+            self.put(doc_id, doctype, fields)
+            return True
+
+    def remove(self, doc_id: str) -> bool:
+        with self.lock:
+            slot = self.slot_of.pop(doc_id, None)
+            if slot is None:
+                return False
+            self._unindex(slot, self.fields[slot] or {})
+            self.ids[slot] = self.doctypes[slot] = self.fields[slot] = None
+            self.alive[slot] = False
+            self.free.append(slot)
+            return True
+
+    def get(self, doc_id: str) -> dict[str, Any] | None:
+        with self.lock:
+            slot = self.slot_of.get(doc_id)
+            return None if slot is None else dict(self.fields[slot] or {})
+
+    def _grow(self, capacity: int) -> None:
+        old = self.capacity
+        self.ids += [None] * (capacity - old)
+        self.doctypes += [None] * (capacity - old)
+        self.fields += [None] * (capacity - old)
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:old] = self.alive
+        self.alive = alive
+        for t in self.tensors.values():
+            t.grow(capacity)
+        for name, lengths in self.lengths.items():
+            grown = np.zeros(capacity, dtype=np.float32)
+            grown[:old] = lengths
+            self.lengths[name] = grown
+        self.free.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def _index(self, slot: int, fields: dict[str, Any]) -> None:
+        for name, value in fields.items():
+            vec = _tensor_values(value)
+            if vec is not None:
+                t = self.tensors.get(name)
+                if t is None:
+                    t = self.tensors[name] = _TensorField(len(vec), self.capacity)
+                v = np.asarray(vec, dtype=np.float32)
+                t.vecs[slot] = v
+                t.norms[slot] = float(np.linalg.norm(v))
+            elif isinstance(value, str):
+                terms = _terms(value)
+                for term in terms:
+                    p = self.postings[name][term]
+                    p[slot] = p.get(slot, 0) + 1
+                if name not in self.lengths:
+                    self.lengths[name] = np.zeros(self.capacity, dtype=np.float32)
+                self.lengths[name][slot] = len(terms)
+                if len(value) <= _MAX_EXACT_CHARS:
+                    self.exact[name][value].add(slot)
+
+    def _unindex(self, slot: int, fields: dict[str, Any]) -> None:
+        for name, value in fields.items():
+            if isinstance(value, str):
+                for term in set(_terms(value)):
+                    p = self.postings[name].get(term)
+                    if p is not None:
+                        p.pop(slot, None)
+                        if not p:
+                            del self.postings[name][term]
+                self.lengths[name][slot] = 0.0
+                s = self.exact[name].get(value)
+                if s is not None:
+                    s.discard(slot)
+                    if not s:
+                        del self.exact[name][value]
+            elif name in self.tensors:
+                self.tensors[name].vecs[slot] = 0.0
+                self.tensors[name].norms[slot] = 0.0
+
+    # -- reads -------------------------------------------------------------------------------
+
+    def mask_of(self, slots: Iterable[int]) -> np.ndarray:
+        m = np.zeros(self.capacity, dtype=bool)
+        idx = list(slots)
+        if idx:
+            m[idx] = True
+        return m & self.alive
+
+    def distances(self, name: str, q: np.ndarray, slots: np.ndarray) -> np.ndarray:
+        t = self.tensors[name]
+        if len(q) != t.dim:
+            raise QueryError(f"Query tensor has {len(q)} values, field '{name}' has {t.dim}")
+        vecs = t.vecs[slots]
+        metric = self.metric_of(name)
+        if metric == "hamming":
+            # Packed int8 cells: count the differing bits.
+            diff = np.bitwise_xor(vecs.astype(np.int8).view(np.uint8), q.astype(np.int8).view(np.uint8))
+            return np.unpackbits(diff, axis=1).sum(axis=1).astype(np.float64)
+        if metric == "euclidean":
+            return np.linalg.norm(vecs - q, axis=1)
+        dots = vecs @ q
+        if metric == "dotproduct":
+            return -dots
+        denom = np.maximum(t.norms[slots] * float(np.linalg.norm(q)), 1e-12)
+        return np.arccos(np.clip(dots / denom, -1.0, 1.0))
+
+    def metric_of(self, name: str) -> str:
+        return FIELD_DISTANCE_METRICS.get(name, self.distance_metric)
+
+    def closeness(self, distances: np.ndarray, name: str) -> np.ndarray:
+        if self.metric_of(name) == "dotproduct":
+            return -distances
+        return 1.0 / (1.0 + distances)
+
+    def cosine(self, name: str, q: np.ndarray, slots: np.ndarray) -> np.ndarray:
+        t = self.tensors.get(name)
+        if t is None:
+            return np.zeros(len(slots))
+        if len(q) != t.dim:
+            raise QueryError(f"Query tensor has {len(q)} values, field '{name}' has {t.dim}")
+        denom = np.maximum(t.norms[slots] * float(np.linalg.norm(q)), 1e-12)
+        return (t.vecs[slots] @ q) / denom
+
+    def bm25(self, name: str, terms: list[str], slots: np.ndarray) -> np.ndarray:
+        scores = np.zeros(len(slots), dtype=np.float64)
+        postings = self.postings.get(name)
+        lengths = self.lengths.get(name)
+        if not postings or lengths is None or not len(slots):
+            return scores
+        n_docs = max(1, len(self.slot_of))
+        avg_len = float(lengths[self.alive].mean()) if self.alive.any() else 1.0
+        doc_len = lengths[slots]
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len / max(avg_len, 1e-9))
+        for term in dict.fromkeys(terms):
+            p = postings.get(term)
+            if not p:
+                continue
+            idf = math.log(1.0 + (n_docs - len(p) + 0.5) / (len(p) + 0.5))
+            tf = np.fromiter((p.get(int(s), 0) for s in slots), dtype=np.float64, count=len(slots))
+            scores += idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+        return scores
+
+
+def _tensor_values(value: Any) -> list[float] | None:
+    # Dense tensor feed formats: [..], {"values": [..]}.
+    if isinstance(value, dict) and isinstance(value.get("values"), list):
+        value = value["values"]
+    if isinstance(value, list) and value and all(isinstance(x, (int, float)) for x in value):
+        return value
+    return None
+
+
+# --------------------------------------------------------------------------------------------
+# YQL
+# --------------------------------------------------------------------------------------------
+
+_TOKEN = re.compile(
+    r'\s*(?:(?P<str>"(?:[^"\\]|\\.)*")|(?P<num>-?\d+(?:\.\d+)?)|(?P<param>@\w+)'
+    r"|(?P<word>[A-Za-z_][\w.]*)|(?P<punct>[(){},:!]))"
+)
+
+
+@dataclass
+class Node:
+    kind: str  # and | or | not | nn | terms | exact | true | false
+    children: list["Node"] = field(default_factory=list)
+    attr: str = ""  # document field the node reads
+    values: list[str] = field(default_factory=list)
+    annotations: dict[str, Any] = field(default_factory=dict)
+    tensor: str = ""
+    any_term: bool = False  # terms: userInput (any word) vs contains (all words)
+
+
+class _Parser:
+    def __init__(self, text: str, params: dict[str, Any]) -> None:
+        self.params = params
+        self.toks: list[tuple[str, str]] = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            m = _TOKEN.match(text, pos)
+            if m is None or m.end() == pos:
+                raise QueryError(f"Could not parse YQL near: {text[pos:pos + 30]!r}")
+            kind = m.lastgroup or ""
+            self.toks.append((kind, m.group(kind)))
+            pos = m.end()
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+        self.i = 0
+
+    def peek(self, value: str | None = None) -> bool:
+        if self.i >= len(self.toks):
+            return False
+        return value is None or self.toks[self.i][1].lower() == value.lower()
+
+    def take(self, value: str | None = None) -> tuple[str, str]:
+        if self.i >= len(self.toks):
+            raise QueryError("Unexpected end of YQL")
+        tok = self.toks[self.i]
+        if value is not None and tok[1].lower() != value.lower():
+            raise QueryError(f"Expected {value!r} in YQL, got {tok[1]!r}")
+        self.i += 1
+        return tok
+
+    def parse(self) -> Node:
+        node = self.expr()
+        if self.i != len(self.toks):
+            raise QueryError(f"Unexpected {self.toks[self.i][1]!r} in YQL")
+        return node
+
+    def expr(self) -> Node:
+        parts = [self.conj()]
+        while self.peek("or"):
+            self.take()
+            parts.append(self.conj())
+        return parts[0] if len(parts) == 1 else Node("or", parts)
+
+    def conj(self) -> Node:
+        parts = [self.factor()]
+        while self.peek("and"):
+            self.take()
+            parts.append(self.factor())
+        return parts[0] if len(parts) == 1 else Node("and", parts)
+
+    def factor(self) -> Node:
+        if self.peek("!"):
+            self.take()
+            return Node("not", [self.factor()])
+        annotations = self.annotations() if self.peek("{") else {}
+        if self.peek("("):
+            self.take("(")
+            node = self.expr()
+            self.take(")")
+            return node
+        kind, word = self.take()
+        if kind != "word":
+            raise QueryError(f"Unexpected {word!r} in YQL")
+        lw = word.lower()
+        if lw in ("true", "false"):
+            return Node(lw)
+        if lw == "nearestneighbor":
+            self.take("(")
+            fname = self.take()[1]
+            self.take(",")
+            tensor = self.take()[1]
+            self.take(")")
+            return Node("nn", attr=fname, tensor=tensor, annotations=annotations)
+        if lw == "userinput":
+            self.take("(")
+            text = str(self.value())
+            self.take(")")
+            fname = str(annotations.get("defaultIndex") or "default")
+            return Node("terms", attr=fname, values=_terms(text), annotations=annotations, any_term=True)
+        op = self.take()[1].lower()
+        if op == "contains":
+            if self.peek("("):  # contains ({annotations}"value")
+                self.take("(")
+                if self.peek("{"):
+                    self.annotations()
+                value = str(self.value())
+                self.take(")")
+            else:
+                value = str(self.value())
+            return Node("terms", attr=word, values=_terms(value))
+        if op == "in":
+            self.take("(")
+            values = [str(self.value())]
+            while self.peek(","):
+                self.take()
+                values.append(str(self.value()))
+            self.take(")")
+            return Node("exact", attr=word, values=values)
+        raise QueryError(f"Unsupported YQL operator {op!r}")
+
+    def value(self) -> Any:
+        kind, tok = self.take()
+        if kind == "str":
+            return json.loads(tok)
+        if kind == "num":
+            return float(tok) if "." in tok else int(tok)
+        if kind == "param":
+            name = tok[1:]
+            if name not in self.params:
+                raise QueryError(f"Missing query parameter {name!r}")
+            return self.params[name]
+        raise QueryError(f"Expected a value in YQL, got {tok!r}")
+
+    def annotations(self) -> dict[str, Any]:
+        out: dict[str, Any] = {}
+        self.take("{")
+        while not self.peek("}"):
+            key = self.take()[1]
+            self.take(":")
+            out[key] = self.value() if not self.peek("true") and not self.peek("false") else self.take()[1] == "true"
+            if self.peek(","):
+                self.take()
+        self.take("}")
+        return out
+
+
+_SELECT = re.compile(r"^\s*select\s+(?P<fields>.+?)\s+from\s+(?:sources\s+)?(?P<sources>.+?)\s+where\s+(?P<where>.+)$", re.I | re.S)
+_TAIL = re.compile(r"\s+(limit|offset)\s+(\d+)\s*$", re.I)
+
+
+@dataclass
+class Query:
+    fields: list[str] | None  # None = all
+    doctypes: list[str] | None  # None = all
+    where: Node
+    limit: int | None
+    offset: int
+    groups: list[str]
+
+
+def _split_outside_quotes(text: str, sep: str) -> tuple[str, str]:
+    quoted = False
+    for i, ch in enumerate(text):
+        if ch == '"' and (i == 0 or text[i - 1] != "\\"):
+            quoted = not quoted
+        elif ch == sep and not quoted:
+            return text[:i], text[i + 1 :]
+    return text, ""
+
+
+def parse_yql(yql: str, params: dict[str, Any]) -> Query:
+    yql = yql.strip().rstrip(";").strip()
+    body, grouping = _split_outside_quotes(yql, "|")
+    m = _SELECT.match(body)
+    if m is None:
+        raise QueryError("Expected: select <fields> from sources <doctypes> where <expr>")
+    where = m.group("where")
+    limit: int | None = None
+    offset = 0
+    while True:
+        t = _TAIL.search(where)
+        if t is None:
+            break
+        if t.group(1).lower() == "limit":
+            limit = int(t.group(2))
+        else:
+            offset = int(t.group(2))
+        where = where[: t.start()]
+    fields = [f.strip() for f in m.group("fields").split(",")]
+    sources = [s.strip() for s in m.group("sources").split(",")]
+    return Query(
+        fields=None if fields == ["*"] else fields,
+        doctypes=None if sources == ["*"] else sources,
+        where=_Parser(where, params).parse(),
+        limit=limit,
+        offset=offset,
+        groups=re.findall(r"group\(\s*(\w+)\s*\)", grouping),
+    )
+
+
+# --------------------------------------------------------------------------------------------
+# Search
+# --------------------------------------------------------------------------------------------
+
+
+class _Eval:
+    def __init__(self, index: Index, query_tensors: dict[str, np.ndarray], base: np.ndarray) -> None:
+        self.index = index
+        self.query_tensors = query_tensors
+        self.base = base
+        self.nn_closeness: dict[int, float] = {}
+        self.query_terms: dict[str, list[str]] = defaultdict(list)
+
+    def mask(self, node: Node, within: np.ndarray) -> np.ndarray:
+        ix = self.index
+        if node.kind == "true":
+            return within.copy()
+        if node.kind == "false":
+            return np.zeros_like(within)
+        if node.kind == "not":
+            return within & ~self.mask(node.children[0], within)
+        if node.kind == "or":
+            out = np.zeros_like(within)
+            for c in node.children:
+                out |= self.mask(c, within)
+            return out
+        if node.kind == "and":
+            # Filters first, so nearestNeighbor only sees documents that pass them (pre-filtering).
+            out = within.copy()
+            for c in sorted(node.children, key=lambda c: c.kind == "nn"):
+                out &= self.mask(c, out)
+            return out
+        if node.kind == "terms":
+            self.query_terms[node.attr].extend(node.values)
+            postings = ix.postings.get(node.attr, {})
+            slot_sets = [set(postings.get(t, {})) for t in node.values]
+            if not slot_sets:
+                return np.zeros_like(within)
+            slots = set.union(*slot_sets) if node.any_term else set.intersection(*slot_sets)
+            return ix.mask_of(slots) & within
+        if node.kind == "exact":
+            exact = ix.exact.get(node.attr, {})
+            slots: set[int] = set()
+            for v in node.values:
+                slots |= exact.get(v, set())
+            return ix.mask_of(slots) & within
+        if node.kind == "nn":
+            if node.attr not in ix.tensors:
+                return np.zeros_like(within)
+            q = self.query_tensors.get(node.tensor)
+            if q is None:
+                raise QueryError(f"Missing query tensor input.query({node.tensor})")
+            cand = np.flatnonzero(within)
+            out = np.zeros_like(within)
+            if not len(cand):
+                return out
+            d = ix.distances(node.attr, q, cand)
+            close = ix.closeness(d, node.attr)
+            k = min(int(node.annotations.get("targetHits") or 10), len(cand))
+            top = np.argpartition(d, k - 1)[:k] if k < len(cand) else np.arange(len(cand))
+            for j in top:
+                slot = int(cand[j])
+                prev = self.nn_closeness.get(slot)
+                self.nn_closeness[slot] = float(close[j]) if prev is None else max(prev, float(close[j]))
+            out[cand[top]] = True
+            return out
+        raise QueryError(f"Unsupported node {node.kind}")
+
+
+def _rerank(
+    index: Index,
+    second: tuple[float, float, int],
+    query_tensors: dict[str, np.ndarray],
+    order: np.ndarray,
+    scores: np.ndarray,
+    bm25: np.ndarray | None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Second phase: rescore the best rerank-count hits (`order` by first-phase score, `bm25` aligned with
+    it). Like Vespa, the hits that were not rescored stay in their order below the rescored ones.
+    """
+    w_bm25, w_cos, rerank_count = second
+    q = query_tensors.get(RESCORE_INPUT)
+    if q is None:
+        raise QueryError(f"Missing query tensor input.query({RESCORE_INPUT})")
+    n = min(rerank_count, len(order))
+    top = order[:n]
+    rescored = w_cos * index.cosine(RESCORE_FIELD, q, top)
+    if w_bm25 and bm25 is not None:
+        rescored += w_bm25 * bm25[:n]
+    perm = np.argsort(-rescored, kind="stable")
+    rest = scores[n:]
+    if len(rest) and n and rest.max() >= rescored.min():
+        rest = rest - (rest.max() - rescored.min()) - 1.0
+    return np.concatenate([top[perm], order[n:]]), np.concatenate([rescored[perm], rest])
+
+
+def _render_fields(fields: dict[str, Any], wanted: Iterable[str] | None, short_tensors: bool) -> dict[str, Any]:
+    out: dict[str, Any] = {}
+    for name, value in fields.items():
+        if wanted is not None and name not in wanted:
+            continue
+        vec = _tensor_values(value)
+        if vec is not None:
+            value = vec if short_tensors else {"type": f"tensor<float>(x[{len(vec)}])", "values": vec}
+        out[name] = value
+    return out
+
+
+def search(index: Index, params: dict[str, Any]) -> dict[str, Any]:
+    t0 = time.perf_counter()
+    yql = params.get("yql")
+    if not yql:
+        raise QueryError("Missing 'yql'")
+    q = parse_yql(str(yql), params)
+    profile_name = str(params.get("ranking.profile") or params.get("ranking") or "unranked")
+    if profile_name not in RANK_PROFILES:
+        raise QueryError(f"Unknown rank profile '{profile_name}'")
+    profile = RANK_PROFILES[profile_name]
+
+    query_tensors: dict[str, np.ndarray] = {}
+    for key, value in params.items():
+        m = re.fullmatch(r"(?:input\.)?query\((\w+)\)", key)
+        if m is None:
+            continue
+        vec = _tensor_values(json.loads(value) if isinstance(value, str) else value)
+        if vec is None:
+            raise QueryError(f"{key}: expected a dense tensor as a list of numbers")
+        query_tensors[m.group(1)] = np.asarray(vec, dtype=np.float32)
+
+    hits = int(params.get("hits") if params.get("hits") is not None else 10)
+    if q.limit is not None:
+        hits = max(0, q.limit - q.offset)
+    offset = int(params.get("offset") or q.offset)
+    summary = DOCUMENT_SUMMARIES.get(str(params.get("presentation.summary") or ""))
+    short_tensors = str(params.get("presentation.format.tensors") or "").startswith("short")
+
+    with index.lock:
+        base = index.alive.copy()
+        if q.doctypes is not None:
+            base &= index.mask_of(s for s, dt in enumerate(index.doctypes) if dt in q.doctypes)
+        ev = _Eval(index, query_tensors, base)
+        matched = np.flatnonzero(ev.mask(q.where, base))
+        t_match = time.perf_counter()
+
+        if profile is None or not len(matched):
+            order = matched
+            scores = np.zeros(len(matched))
+        else:
+            w_bm25, w_close = profile
+            scores = np.zeros(len(matched))
+            bm25 = index.bm25("text", ev.query_terms.get("text", []), matched) if w_bm25 else None
+            if bm25 is not None:
+                scores += w_bm25 * bm25
+            if w_close:
+                scores += w_close * np.array([ev.nn_closeness.get(int(s), 0.0) for s in matched])
+            perm = np.argsort(-scores, kind="stable")
+            order, scores = matched[perm], scores[perm]
+            second = SECOND_PHASE.get(profile_name)
+            if second is not None:
+                bm25_ordered = None if bm25 is None else bm25[perm]
+                order, scores = _rerank(index, second, query_tensors, order, scores, bm25_ordered)
+
+        children = []
+        for slot, score in list(zip(order, scores))[offset : offset + hits]:
+            slot = int(slot)
+            wanted = summary if summary is not None else q.fields
+            children.append(
+                {
+                    "id": index.ids[slot],
+                    "relevance": float(score),
+                    "source": index.doctypes[slot],
+                    "fields": _render_fields(index.fields[slot] or {}, wanted, short_tensors),
+                }
+            )
+
+        if q.groups:
+            children.append(_grouping(index, matched, q.groups))
+
+    root: dict[str, Any] = {
+        "id": "toplevel",
+        "relevance": 1.0,
+        "fields": {"totalCount": int(len(matched))},
+        "coverage": {"coverage": 100, "documents": len(index), "full": True, "nodes": 1, "results": 1, "resultsFull": 1},
+    }
+    if children:
+        root["children"] = children
+    out: dict[str, Any] = {"root": root}
+    if params.get("presentation.timing") in (True, "true"):
+        t1 = time.perf_counter()
+        out["timing"] = {"querytime": t_match - t0, "summaryfetchtime": t1 - t_match, "searchtime": t1 - t0}
+    return out
+
+
+def _grouping(index: Index, matched: np.ndarray, attrs: list[str]) -> dict[str, Any]:
+    lists = []
+    for attr in attrs:
+        counts: dict[str, int] = defaultdict(int)
+        for slot in matched:
+            v = (index.fields[int(slot)] or {}).get(attr)
+            if v is not None:
+                counts[str(v)] += 1
+        lists.append(
+            {
+                "id": f"grouplist:{attr}",
+                "label": attr,
+                "relevance": 1.0,
+                "children": [
+                    {"id": f"group:string:{v}", "relevance": 1.0, "value": v, "fields": {"count()": n}}
+                    for v, n in sorted(counts.items(), key=lambda kv: -kv[1])
+                ],
+            }
+        )
+    return {"id": "group:root:0", "relevance": 1.0, "continuation": {}, "children": lists}
+
+
+# --------------------------------------------------------------------------------------------
+# HTTP
+# --------------------------------------------------------------------------------------------
+
+_DOC_PATH = re.compile(r"^/document/v1/(?P<ns>[^/]+)/(?P<doctype>[^/]+)/docid(?:/(?P<id>.+))?$")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; with keep-alive clients Nagle + delayed ACK would
+    # add ~40 ms to every response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        if self.server.standin.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status: int, body: dict[str, Any]) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> dict[str, Any]:
+        n = int(self.headers.get("Content-Length") or 0)
+        if not n:
+            return {}
+        return json.loads(self.rfile.read(n) or b"{}")
+
+    def _route(self, method: str) -> None:
+        standin = self.server.standin
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            # Always consume the body, so a keep-alive connection stays in sync even on errors.
+            body = self._body() if method in ("POST", "PUT") else {}
+            if url.path in ("/state/v1/health", "/ApplicationStatus"):
+                return self._send(200, {"status": {"code": "up"}})
+            if url.path.rstrip("/") == "/search":
+                params = dict(query)
+                params.update(body)
+                standin.sleep(standin.search_latency_ms)
+                return self._send(200, search(standin.index, params))
+            m = _DOC_PATH.match(url.path)
+            if m is not None:
+                return self._document(method, m.group("ns"), m.group("doctype"), m.group("id"), query, body)
+            self._send(404, {"message": f"No handler for {url.path}"})
+        except (QueryError, json.JSONDecodeError, ValueError) as e:
+            self._send(400, {"root": {"errors": [{"code": 4, "summary": "Invalid query parameter", "message": str(e)}]}})
+
+    def _document(
+        self, method: str, ns: str, doctype: str, user_id: str | None, query: dict[str, str], body: dict[str, Any]
+    ) -> None:
+        standin = self.server.standin
+        index = standin.index
+        path_id = f"/document/v1/{ns}/{doctype}/docid/{user_id or ''}"
+        if user_id is None:
+            if method != "GET":
+                return self._send(405, {"message": "Only GET (visit) is supported without a document id"})
+            return self._send(200, standin.visit(ns, doctype, query))
+        doc_id = f"id:{ns}:{doctype}::{unquote(user_id)}"
+        standin.sleep(standin.feed_latency_ms)
+        if method == "GET":
+            fields = index.get(doc_id)
+            if fields is None:
+                return self._send(404, {"pathId": path_id, "id": doc_id})
+            return self._send(200, {"pathId": path_id, "id": doc_id, "fields": fields})
+        if method == "DELETE":
+            index.remove(doc_id)
+            return self._send(200, {"pathId": path_id, "id": doc_id})
+        fields = body.get("fields") or {}
+        if method == "POST":
+            index.put(doc_id, doctype, fields)
+            return self._send(200, {"pathId": path_id, "id": doc_id})
+        if method == "PUT":
+            assignments = {k: (v.get("assign") if isinstance(v, dict) and "assign" in v else v) for k, v in fields.items()}
+            create = str(query.get("create") or body.get("create") or "").lower() == "true"
+            # Like Vespa, an update of a missing document (without create=true) is a no-op.
+            index.update(doc_id, doctype, assignments, create=create)
+            return self._send(200, {"pathId": path_id, "id": doc_id})
+        self._send(405, {"message": f"Method {method} not supported"})
+
+    def do_GET(self) -> None:
+        self._route("GET")
+
+    def do_POST(self) -> None:
+        self._route("POST")
+
+    def do_PUT(self) -> None:
+        self._route("PUT")
+
+    def do_DELETE(self) -> None:
+        self._route("DELETE")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    standin: "VespaStandIn"
+
+
+class VespaStandIn:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        search_latency_ms: float = 0.0,
+        feed_latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        distance_metric: str = "angular",
+        seed: int = 0,
+        verbose: bool = False,
+    ) -> None:
+        self.index = Index(distance_metric)
+        self.search_latency_ms = search_latency_ms
+        self.feed_latency_ms = feed_latency_ms
+        self.jitter_ms = jitter_ms
+        self.verbose = verbose
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.standin = self
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def sleep(self, base_ms: float) -> None:
+        if base_ms <= 0 and self.jitter_ms <= 0:
+            return
+        with self._rng_lock:
+            jitter = self._rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms > 0 else 0.0
+        time.sleep(max(0.0, base_ms + jitter) / 1000.0)
+
+    def visit(self, ns: str, doctype: str, query: dict[str, str]) -> dict[str, Any]:
+        wanted = int(query.get("wantedDocumentCount") or 100)
+        start = int(query.get("continuation") or 0)
+        prefix = f"id:{ns}:{doctype}::"
+        docs = []
+        slot = start
+        with self.index.lock:
+            while slot < self.index.capacity and len(docs) < wanted:
+                doc_id = self.index.ids[slot]
+                if doc_id is not None and doc_id.startswith(prefix):
+                    docs.append({"id": doc_id, "fields": dict(self.index.fields[slot] or {})})
+                slot += 1
+            more = any(
+                d is not None and d.startswith(prefix) for d in self.index.ids[slot:]
+            )
+        out: dict[str, Any] = {"pathId": f"/document/v1/{ns}/{doctype}/docid", "documents": docs, "documentCount": len(docs)}
+        if more:
+            out["continuation"] = str(slot)
+        return out
+
+    def start(self) -> "VespaStandIn":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="vespa-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "VespaStandIn":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0] if __doc__ else None)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--search-latency-ms", type=float, default=0.0, help="Added to every /search/ call")
+    ap.add_argument("--feed-latency-ms", type=float, default=0.0, help="Added to every document API call")
+    ap.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform +/- jitter on the added latency")
+    ap.add_argument("--distance-metric", choices=["angular", "euclidean", "dotproduct"], default="angular")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--verbose", action="store_true", help="Log every request")
+    args = ap.parse_args()
+
+    standin = VespaStandIn(
+        args.host,
+        args.port,
+        args.search_latency_ms,
+        args.feed_latency_ms,
+        args.jitter_ms,
+        args.distance_metric,
+        args.seed,
+        args.verbose,
+    )
+    print(f"Vespa stand-in listening on {standin.url}")
+    try:
+        standin._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        standin._server.server_close()
+
+
+if __name__ == "__main__":
+    main()